@@ -16,14 +16,14 @@
 # along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
 
 import re # for searching in strings used to determine states
-import numpy as np
 import os
-from WattmanGTK.util import read
-from pathlib import Path
+import numpy as np
+from WattmanGTK.backend import SysfsBackend
+from WattmanGTK.gpumetrics import GpuMetrics
 
 class GPU:
     # Object which stores GPU information
-    def __init__(self, cardpath, linux_kernelmain, linux_kernelsub, fancyname = None):
+    def __init__(self, cardpath, linux_kernelmain, linux_kernelsub, fancyname = None, backend = None):
         # Can used for kernel specific workarounds
         self.linux_kernelmain = linux_kernelmain
         self.linux_kernelsub = linux_kernelsub
@@ -39,6 +39,27 @@ class GPU:
         self.volt_range = []        # Mimimum and Maximum voltage for both GPU and memory [mV]
         self.cardpath = cardpath    # starting path for card eg. /sys/class/drm/card0/device
         self.hwmonpath = ''
+        self.backend = backend if backend is not None else SysfsBackend() # used for all file access
+        self.metrics = self.init_metrics()  # gpu_metrics, replaces the reads of the files it contains
+        # Runtime power management: reading sensors of a suspended card wakes it up, runtime_status does not
+        self.runtime_status_path = self.cardpath + "/power/runtime_status"
+        self.runtime_pm = self.backend.isfile(self.runtime_status_path)
+        self.suspended = False
+        # Sensor files which take longer than latency_budget [s] to read are moved to a slow lane,
+        # read every slow_lane refreshes, or with drop_slow only every retime slow lane periods,
+        # so their read time is measured again and they can move back when they got faster
+        self.latency_budget = 0
+        self.slow_lane = 10
+        self.drop_slow = False
+        self.retime = 10
+        self.keep_sensors = []      # sensor files (e.g. temp1_input) which are never moved
+        self.slow_paths = set()
+        self.lanes_changed = 0      # incremented when a file moves between the lanes
+        self.ticks = 0
+        # Overdrive settings as currently set in sysfs, read with the other values in get_currents
+        self.sclk_od = 0
+        self.mclk_od = 0
+        self.performance_level = None
 
     def get_states(self):
         # Gets the ranges for GPU and Memory (clocks states and voltages)
@@ -48,10 +69,9 @@ class GPU:
         clock_limit_pattern = r"^(\d|\S{1,}):\s{1,}(\d{1,})(MHz|Mhz|mV)\s{1,}(\d{1,})(MHz|Mhz|mV)$"
         print("Reading clock states and limits.")
         try:
-            with open(filepath) as pp_od_clk_voltage:
-                # File not that large, can put all in memory
-                lines = pp_od_clk_voltage.readlines()
-                lines.append("\n")
+            # File not that large, can put all in memory
+            lines = self.backend.readlines(filepath)
+            lines.append("\n")
             readingSCLK = False
             readingMCLK = False
             readingVDDC = False
@@ -117,20 +137,18 @@ class GPU:
             clock_pattern = r"^(\d):\s(\d.*)(Mhz|MHz)\s(\*|)$"
             sclk_filepath = self.cardpath + "/pp_dpm_sclk"
             mclk_filepath = self.cardpath + "/pp_dpm_mclk"
-            if not os.path.isfile(sclk_filepath) or not os.path.isfile(mclk_filepath):
+            if not self.backend.isfile(sclk_filepath) or not self.backend.isfile(mclk_filepath):
                 print(f"Also cannot find {sclk_filepath} or {mclk_filepath}")
                 print("WattmanGTK will not be able to continue")
                 exit()
-            with open(sclk_filepath) as origin_file:
-                for i, line in enumerate(origin_file.readlines()):
-                    match = re.match(clock_pattern, line)
-                    if match:
-                        self.pstate_clock.append(int(match.group(2)))
-            with open(mclk_filepath) as origin_file:
-                for i, line in enumerate(origin_file.readlines()):
-                    match = re.match(clock_pattern, line)
-                    if match:
-                        self.pmem_clock.append(int(match.group(2)))
+            for i, line in enumerate(self.backend.readlines(sclk_filepath)):
+                match = re.match(clock_pattern, line)
+                if match:
+                    self.pstate_clock.append(int(match.group(2)))
+            for i, line in enumerate(self.backend.readlines(mclk_filepath)):
+                match = re.match(clock_pattern, line)
+                if match:
+                    self.pmem_clock.append(int(match.group(2)))
 
             if len(self.pstate_clock) == 0 or len(self.pmem_clock) == 0:
                 print(f"Also got an error reading {self.cardpath + '/pp_dpm_sclk'} or {self.cardpath + '/pp_dpm_sclk'}")
@@ -166,14 +184,14 @@ class GPU:
             print("WattmanGTK could not link the hwmon folder to the proper card, program will run without displaying any sensors")
             return sensors
         pattern = r"([a-zA-Z]{1,})(\d{1,})(_([a-zA-Z]{1,})|)(_([a-zA-Z]{1,})|)"
-        files = "\n".join(os.listdir(self.hwmonpath))
+        files = "\n".join(self.backend.listdir(self.hwmonpath))
         for match in re.finditer(pattern,files):
             # check if sensor is empty
             print(f"Found sensor {match.group(0).rstrip()}")
             subsystem, sensornumber, attribute, subattribute  = match.group(1,2,4,6)
             path = "/" + match.group(0).rstrip()
             print(f"Trying to read {self.hwmonpath + path}")
-            value = read(self.hwmonpath + path)
+            value = self.read(self.hwmonpath + path)
             if value is None:
                 print(f"Cannot read {self.hwmonpath + path}")
                 continue
@@ -194,30 +212,135 @@ class GPU:
                     sensors[subsystem][sensornumber][attribute][subattribute].update({"value": value, "path": path})
         return sensors
 
+    def init_metrics(self):
+        # Uses gpu_metrics when the kernel provides it in a known revision, otherwise every file is read
+        path = self.cardpath + "/gpu_metrics"
+        if not self.backend.isfile(path):
+            return None
+        try:
+            metrics = GpuMetrics(path, self.backend.readbytes)
+        except (OSError, ValueError) as error:
+            print(f"Cannot use {path} ({error}), reading the sensor files instead")
+            return None
+        print(f"Using gpu_metrics v{metrics.revision[0]}_{metrics.revision[1]} for {', '.join(metrics.fields)}")
+        return metrics
+
+    def metrics_value(self, path):
+        # Value of a card or hwmon file from gpu_metrics, None when it is not in there
+        if self.metrics is None:
+            return None
+        if self.hwmonpath != '' and path.startswith(self.hwmonpath):
+            return self.metrics.read(path[len(self.hwmonpath):])
+        if path.startswith(self.cardpath):
+            return self.metrics.read("/" + path[len(self.cardpath):].lstrip("/"))
+        return None
+
+    def update_runtime_status(self):
+        # Reads runtime_status, to be called before reading sensors
+        # outputs: True when the card is (being) suspended, its sensors are then not read
+        if self.runtime_pm:
+            try:
+                self.suspended = self.backend.read(self.runtime_status_path) in ["suspended", "suspending"]
+            except OSError:
+                self.suspended = False
+        return self.suspended
+
+    def read(self, path):
+        if self.suspended:
+            return None
+        value = self.metrics_value(path)
+        if value is not None:
+            return value
+        return self.backend.read(path)
+
+    def signal_path(self, sensorpath):
+        # Absolute path of a sensorpath used by a Plotsignal
+        if self.hwmonpath != '' and sensorpath.startswith(self.hwmonpath):
+            return sensorpath
+        return self.cardpath + "/" + sensorpath.lstrip("/")
+
+    def is_stale(self, path):
+        # True if the last read of path did not finish in time (see DeadlineBackend)
+        if hasattr(self.backend, "is_stale"):
+            return self.backend.is_stale(path)
+        return False
+
+    def set_lanes(self, latency_budget, slow_lane=10, drop_slow=False, keep_sensors=None):
+        self.latency_budget = latency_budget
+        self.slow_lane = slow_lane
+        self.drop_slow = drop_slow
+        self.keep_sensors = keep_sensors or []
+        self.update_lanes()
+
+    def is_slow(self, path):
+        # True when the recent read time of path is over the latency budget (needs a ProfilingBackend)
+        if self.latency_budget <= 0 or not hasattr(self.backend, "latency") or os.path.basename(path) in self.keep_sensors:
+            return False
+        latency = self.backend.latency(path)
+        return latency is not None and latency > self.latency_budget
+
+    def slow_period(self):
+        # Number of refreshes between reads of a file in the slow lane
+        return self.slow_lane * self.retime if self.drop_slow else self.slow_lane
+
+    def sensor_paths(self, sensordict):
+        for key, value in sensordict.items():
+            if type(value) is dict:
+                yield from self.sensor_paths(value)
+            elif key == "path":
+                yield self.hwmonpath + value
+
+    def update_lanes(self):
+        # Moves sensor files over the latency budget to the slow lane and back when they got faster
+        if not hasattr(self, "sensors"):
+            return
+        for path in self.sensor_paths(self.sensors):
+            slow = self.is_slow(path)
+            if slow and path not in self.slow_paths:
+                self.slow_paths.add(path)
+                self.lanes_changed += 1
+                print(f"Reading {path} takes {self.backend.latency(path) * 1000:.1f} ms, read every {self.slow_period()} refreshes")
+            elif not slow and path in self.slow_paths:
+                self.slow_paths.discard(path)
+                self.lanes_changed += 1
+                print(f"Reading {path} takes {self.backend.latency(path) * 1000:.1f} ms, read every refresh again")
+
     def read_sensor(self,filename):
-        return read(self.cardpath+"/"+filename)
+        return self.read(self.cardpath+"/"+filename)
 
     def update_sensors(self, sensordict):
         for key, value in sensordict.items():
             if type(value) is dict:
                 self.update_sensors(value)
             elif key == "value":
-                sensordict['value'] = read(self.hwmonpath + sensordict['path'])
+                path = self.hwmonpath + sensordict['path']
+                if path in self.slow_paths and self.ticks % self.slow_period() != 0:
+                    continue
+                sensordict['value'] = self.read(path)
             else:
                 continue
 
     def get_current_clock(self, filename):
         # function used to get current clock speed information
         # outputs: clockvalue, clockstate
-        with open(self.cardpath+filename) as origin_file:
-            for line in origin_file:
-                clock = re.match(r"^(\d):\s(\d.*)Mhz\s\*$", line)
-                if clock:
-                    return int(clock.group(2)), int(clock.group(1))
+        clock = self.metrics_value(self.cardpath+filename)
+        states = self.pstate_clock if filename == "/pp_dpm_sclk" else self.pmem_clock
+        if clock is not None and len(states) > 0:
+            # gpu_metrics only has the clock, the state is the one with the closest clock
+            return clock, int(np.argmin(np.abs(np.array(states) - clock)))
+        for line in self.backend.readlines(self.cardpath+filename):
+            clock = re.match(r"^(\d):\s(\d.*)Mhz\s\*$", line)
+            if clock:
+                return int(clock.group(2)), int(clock.group(1))
         return None, None
 
     def get_currents(self):
         # Gets current clocks and utilisation figures for displaying in GUI
+        if self.update_runtime_status():
+            self.gpu_clock = self.mem_clock = self.fan_speed = self.temperature = 'N/A'
+            self.gpu_state = self.mem_state = 'suspended'
+            self.gpu_clock_utilisation = self.mem_utilisation = self.fan_speed_utilisation = self.temp_utilisation = 0
+            return
         gpu_clock, gpu_state = self.get_current_clock("/pp_dpm_sclk")
         if gpu_clock is not None:
             self.gpu_clock = gpu_clock
@@ -238,7 +361,18 @@ class GPU:
             self.mem_state = 'N/A'
             self.mem_utilisation = 0
 
+        for attribute, filename in [("sclk_od", "pp_sclk_od"), ("mclk_od", "pp_mclk_od"),
+                                    ("performance_level", "power_dpm_force_performance_level")]:
+            try:
+                setattr(self, attribute, self.read_sensor(filename))
+            except OSError:
+                pass
+
+        self.ticks += 1
         self.update_sensors(self.sensors)
+        if self.latency_budget > 0 and self.ticks % self.slow_lane == 0:
+            # after the reads, so files of the slow lane are judged on the read just done
+            self.update_lanes()
 
         try:
             if self.sensors['fan']['1']['input']['value'] is None:
@@ -276,3 +410,12 @@ class GPU:
         except ZeroDivisionError:
             # set 100 degree as critical temperature
             self.temp_utilisation = self.temperature / 100
+
+    def snapshot(self):
+        # Values shown in the GUI, copied at once so the GUI never shows a partial update
+        return {"gpu_clock": self.gpu_clock, "gpu_state": self.gpu_state, "gpu_clock_utilisation": self.gpu_clock_utilisation,
+                "mem_clock": self.mem_clock, "mem_state": self.mem_state, "mem_utilisation": self.mem_utilisation,
+                "fan_speed": self.fan_speed, "fan_speed_utilisation": self.fan_speed_utilisation,
+                "temperature": self.temperature, "temp_utilisation": self.temp_utilisation,
+                "cardpath": self.cardpath, "sclk_od": self.sclk_od, "mclk_od": self.mclk_od,
+                "manual_mode": self.performance_level == "manual"}
@@ -0,0 +1,172 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Alert rules, evaluated on every sample of every card. Rules are read from an
+# ini file, one section per rule:
+#
+#   [Hot]
+#   when = temp1 > 90
+#   for = 10
+#
+#   [Power limited]
+#   when = power1 >= 98% and GPU State < 5
+#   for = 30
+#   notify = yes
+#   log = /var/log/wattmangtk-alerts.log
+#   cards = 0,1
+#
+# when: conditions joined by "and", each a signal (name, sensor file, hwmon
+# sensor e.g. temp1 or subsystem), a comparison (<, <=, >, >=, ==, !=) and a
+# value in the unit shown in the GUI (e.g. °C, W, MHz), "min", "max" or a
+# percentage between the min and max of the signal. for: time in s the
+# conditions must hold, a sample which does not hold or is missing (NaN,
+# suspended card) restarts it.
+
+import re
+import math
+import time
+import subprocess
+import configparser
+import operator
+from collections import deque
+from WattmanGTK.util import convert_to_si
+
+comparisons = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+               "==": operator.eq, "!=": operator.ne}
+condition_pattern = r"^\s*(.+?)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*$"
+
+
+class Condition:
+    def __init__(self, text):
+        match = re.match(condition_pattern, text)
+        if match is None:
+            raise ValueError(f"Cannot parse condition \"{text}\", use e.g. temp1 > 90")
+        self.text = text.strip()
+        self.key, comparison, self.value = match.groups()
+        self.compare = comparisons[comparison]
+        if self.value not in ["min", "max"] and not self.value.endswith("%"):
+            float(self.value)
+
+    def threshold(self, Plotsignal):
+        # Threshold in the unit of the sensor file, so samples are compared without conversion
+        if self.value == "min":
+            return Plotsignal.min
+        if self.value == "max":
+            return Plotsignal.max
+        if self.value.endswith("%"):
+            return Plotsignal.min + float(self.value[:-1]) / 100 * (Plotsignal.max - Plotsignal.min)
+        return float(self.value) / convert_to_si(Plotsignal.unit, 1)[1]
+
+
+class Rule:
+    def __init__(self, name, when, duration=0, notify=True, log=None, cards=None):
+        self.name = name
+        self.conditions = [Condition(text) for text in re.split(r"\s+and\s+", when)]
+        self.duration = duration
+        self.notify = notify
+        self.log = log
+        self.cards = cards      # card numbers the rule applies to, None for all cards
+
+
+def read_rules(filename):
+    config = configparser.ConfigParser(interpolation=None)  # % is used in conditions
+    if len(config.read(filename)) == 0:
+        raise ValueError(f"Cannot read {filename}")
+    rules = []
+    for name in config.sections():
+        section = config[name]
+        if "when" not in section:
+            raise ValueError(f"Rule {name} in {filename} has no when")
+        try:
+            cards = [int(card) for card in section["cards"].split(",")] if "cards" in section else None
+            rules.append(Rule(name, section["when"], section.getfloat("for", 0), section.getboolean("notify", True),
+                              section.get("log"), cards))
+        except ValueError as error:
+            raise ValueError(f"Rule {name} in {filename}: {error}")
+    return rules
+
+
+class AlertEngine:
+    # Sink of Plot which checks the rules after each sample. Every rule keeps per card
+    # the signals of its conditions and the time since when they hold, so a sample
+    # costs one comparison per condition, independent of the history length.
+    def __init__(self, rules, notifier=None, maxfired=1000):
+        self.rules = rules
+        self.notifier = notifier if notifier is not None else self.notify
+        self.checks = []    # [rule, card number, [(Plotsignal, compare, threshold)], since, fired]
+        self.fired = deque(maxlen=maxfired)     # (time, rule name, card number) of the last alerts
+
+    def start_recording(self, GPUs, GPUsignals):
+        for rule in self.rules:
+            for cardnr, Plotsignals in enumerate(GPUsignals):
+                if rule.cards is not None and cardnr not in rule.cards:
+                    continue
+                conditions = []
+                for condition in rule.conditions:
+                    signal = next((Plotsignal for Plotsignal in Plotsignals if condition.key in Plotsignal.get_keys()), None)
+                    if signal is None:
+                        print(f"Alert {rule.name} not used for {GPUs[cardnr].fancyname}, it has no signal {condition.key}")
+                        break
+                    conditions.append((signal, condition.compare, condition.threshold(signal)))
+                else:
+                    self.checks.append([rule, cardnr, conditions, None, False])
+        print(f"Checking {len(self.rules)} alert rule(s) on {len(GPUs)} card(s)")
+
+    def add_samples(self, timestamp, GPUsignals):
+        # timestamp: time.monotonic() of the samples
+        for check in self.checks:
+            rule, cardnr, conditions, since, fired = check
+            holds = True
+            for Plotsignal, compare, threshold in conditions:
+                value = Plotsignal.get_last_value()
+                # NaN (suspended card, value which cannot be computed) is unknown, != would hold
+                if value is None or math.isnan(value) or not compare(value, threshold):
+                    holds = False
+                    break
+            if not holds:
+                check[3] = None
+                check[4] = False
+                continue
+            if since is None:
+                check[3] = since = timestamp
+            if not fired and timestamp - since >= rule.duration:
+                check[4] = True
+                self.fire(timestamp, rule, cardnr, conditions)
+
+    def fire(self, timestamp, rule, cardnr, conditions):
+        values = ", ".join(f"{Plotsignal.name} {convert_to_si(Plotsignal.unit, Plotsignal.get_last_value())[1]:g}"
+                           f"{convert_to_si(Plotsignal.unit)[0].strip('[-]')}" for Plotsignal, _, _ in conditions)
+        message = f"{rule.name} on card {cardnr}: {' and '.join(condition.text for condition in rule.conditions)}" + \
+                  (f" for {rule.duration:g} s" if rule.duration > 0 else "") + f" ({values})"
+        self.fired.append((timestamp, rule.name, cardnr))
+        print(f"Alert: {message}")
+        if rule.log is not None:
+            try:
+                with open(rule.log, "a") as logfile:
+                    logfile.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}\n")
+            except OSError as error:
+                print(f"Cannot write alert to {rule.log}: {error.strerror}")
+        if rule.notify:
+            self.notifier(rule.name, message)
+
+    @staticmethod
+    def notify(title, message):
+        # Desktop notification, not waited for so sampling continues
+        try:
+            subprocess.Popen(["notify-send", "--app-name=WattmanGTK", "--urgency=critical", title, message])
+        except OSError as error:
+            print(f"Cannot send notification: {error.strerror}")
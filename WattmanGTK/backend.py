@@ -0,0 +1,362 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Sensor backends used by GPU to access the card files. Every backend provides
+# read, readlines, readbytes, listdir, isfile and write with the same behaviour as
+# the real sysfs files, so GPU, Plot and Handler can run unchanged on each of them.
+
+import os
+import re
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from WattmanGTK.util import read, write
+
+
+def normpath(path):
+    # sysfs accepts duplicate slashes, e.g. cardpath + "/" + "/gpu_busy_percent"
+    return re.sub("/+", "/", path)
+
+
+class SysfsBackend:
+    # Reads the real sysfs files of the card
+    def read(self, path):
+        return read(path)
+
+    def readlines(self, path):
+        with open(path) as origin_file:
+            return origin_file.readlines()
+
+    def readbytes(self, path):
+        # binary files like gpu_metrics
+        with open(path, "rb") as origin_file:
+            return origin_file.read()
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def write(self, path, value):
+        write(path, value)
+
+
+class ProfilingBackend:
+    # Wraps another backend and measures the time of every read, to find files
+    # which are slow to read (e.g. attributes which query the SMU firmware)
+    def __init__(self, backend, smoothing=0.2):
+        self.backend = backend
+        self.smoothing = smoothing  # weight of the last read in the recent read time
+        self.lock = threading.Lock()
+        self.stats = {}     # path -> [reads, total time, maximum time, recent time] [s]
+
+    def call(self, function, path):
+        path = normpath(path)
+        start = time.perf_counter()
+        try:
+            return function(path)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stats = self.stats.get(path)
+                if stats is None:
+                    self.stats[path] = [1, elapsed, elapsed, elapsed]
+                else:
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    stats[2] = max(stats[2], elapsed)
+                    stats[3] += self.smoothing * (elapsed - stats[3])
+
+    def latency(self, path):
+        # Recent read time [s] of path, None when it was not read yet
+        stats = self.stats.get(normpath(path))
+        return None if stats is None else stats[3]
+
+    def slowest(self, count=10):
+        with self.lock:
+            return sorted(((path, list(stats)) for path, stats in self.stats.items()), key=lambda item: -item[1][3])[:count]
+
+    def report(self, count=10):
+        # Prints the files with the highest recent read time
+        print(f"{'Slowest files':<60} {'Reads':>7} {'Mean [ms]':>9} {'Max [ms]':>9} {'Recent [ms]':>11}")
+        for path, (reads, total, maximum, recent) in self.slowest(count):
+            print(f"{path:<60} {reads:>7} {total / reads * 1000:>9.3f} {maximum * 1000:>9.3f} {recent * 1000:>11.3f}")
+
+    def read(self, path):
+        return self.call(self.backend.read, path)
+
+    def readlines(self, path):
+        return self.call(self.backend.readlines, path)
+
+    def readbytes(self, path):
+        return self.call(self.backend.readbytes, path)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def isfile(self, path):
+        return self.backend.isfile(path)
+
+    def write(self, path, value):
+        self.backend.write(path, value)
+
+
+class DeadlineBackend:
+    # Wraps another backend and gives every read a deadline [s]. A read which
+    # takes longer (e.g. during a GPU reset or runtime resume) does not block the
+    # caller: the last value is returned and the file is marked as stale until a
+    # read succeeds again. A file is not read again while its read still hangs.
+    def __init__(self, backend, deadline=0.25, workers=4):
+        self.backend = backend
+        self.deadline = deadline
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sysfs")
+        self.lock = threading.Lock()
+        self.pending = {}   # path -> read which did not finish in time
+        self.values = {}    # path -> last value read
+        self.stale = set()
+        self.hung = {}      # path -> number of reads which did not finish in time
+
+    def call(self, function, path):
+        path = normpath(path)
+        with self.lock:
+            if path in self.pending:
+                if not self.pending[path].done():
+                    return self.values.get(path)
+                del self.pending[path]
+            if len(self.pending) >= self.workers:
+                # all workers could be hanging, do not queue more reads
+                self.stale.add(path)
+                return self.values.get(path)
+        future = self.executor.submit(function, path)
+        try:
+            value = future.result(timeout=self.deadline)
+        except TimeoutError:
+            with self.lock:
+                self.pending[path] = future
+                self.stale.add(path)
+                self.hung[path] = self.hung.get(path, 0) + 1
+            print(f"Reading {path} takes longer than {self.deadline * 1000:.0f} ms ({self.hung[path]} times), using last value")
+            # outside the lock, the callback runs at once when the read finished in the meantime
+            future.add_done_callback(lambda future: self.finished(path, future))
+            return self.values.get(path)
+        with self.lock:
+            self.values[path] = value
+            self.stale.discard(path)
+        return value
+
+    def finished(self, path, future):
+        # A read which did not finish in time frees its worker slot when it is done, even when
+        # the file is not read again. It stays stale until a read finishes in time.
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+
+    def is_stale(self, path):
+        return normpath(path) in self.stale
+
+    def report(self):
+        # Prints the files which did not finish in time
+        for path, count in sorted(self.hung.items(), key=lambda item: -item[1]):
+            print(f"{path} did not respond within {self.deadline * 1000:.0f} ms {count} times")
+
+    def latency(self, path):
+        # Read time of the wrapped backend, when it is a ProfilingBackend
+        if hasattr(self.backend, "latency"):
+            return self.backend.latency(path)
+        return None
+
+    def read(self, path):
+        return self.call(self.backend.read, path)
+
+    def readlines(self, path):
+        lines = self.call(self.backend.readlines, path)
+        return [] if lines is None else lines
+
+    def readbytes(self, path):
+        return self.call(self.backend.readbytes, path)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def isfile(self, path):
+        return self.backend.isfile(path)
+
+    def write(self, path, value):
+        self.backend.write(path, value)
+
+
+def sine(phase):
+    return 0.5 + 0.5 * math.sin(2 * math.pi * phase)
+
+def square(phase):
+    return 1.0 if phase % 1 < 0.5 else 0.0
+
+def sawtooth(phase):
+    return phase % 1
+
+def triangle(phase):
+    return 1 - abs(2 * (phase % 1) - 1)
+
+def noise(phase):
+    # cheap deterministic pseudo random value in [0, 1)
+    return (math.sin(phase * 12.9898) * 43758.5453) % 1
+
+waveforms = {"sine": sine, "square": square, "sawtooth": sawtooth, "triangle": triangle, "noise": noise}
+
+
+class SyntheticBackend:
+    # Generates the files of one or more fake cards, used to load test without hardware
+    # cards: number of cards, sensors: number of hwmon input sensors per card (minimum 5)
+    # rate: sample rate [Hz] at which the values change, waveform: shape of the signals
+    sclk = [300, 600, 900, 1145, 1215, 1257, 1300, 1366]
+    mclk = [300, 1000, 2000]
+    extra_sensors = ["temp", "in", "power"]
+
+    def __init__(self, cards=1, sensors=5, rate=50, waveform="sine", clock=time.monotonic):
+        if waveform not in waveforms:
+            raise ValueError(f"Unknown waveform {waveform}, choose from {', '.join(waveforms)}")
+        self.rate = rate
+        self.waveform = waveforms[waveform]
+        self.clock = clock
+        self.start = clock()
+        self.files = {}
+        self.directories = {}
+        for card in range(cards):
+            self.add_card(card, max(sensors, 5))
+
+    def cardpaths(self):
+        return sorted((path for path in self.directories if path.endswith("/device")), key=lambda path: int(path.split("/")[-2][4:]))
+
+    def hwmonpath(self, cardpath):
+        return f"{cardpath}/hwmon/hwmon{cardpath.split('/')[-2][4:]}"
+
+    def add_file(self, path, value):
+        directory, filename = path.rsplit("/", 1)
+        self.directories.setdefault(directory, []).append(filename)
+        self.files[path] = value
+
+    def signal(self, number, low, high):
+        # Each signal gets its own period and phase, so not all signals are equal
+        period = 5 + number % 7
+        offset = number * 0.37
+        return lambda phase: int(low + (high - low) * self.waveform(phase / period + offset))
+
+    def add_card(self, card, sensors):
+        cardpath = f"/synthetic/card{card}/device"
+        hwmonpath = self.hwmonpath(cardpath)
+        self.directories[cardpath] = []
+        seed = card * 100
+
+        od = ["OD_SCLK:"] + [f"{i}:        {clock}MHz        {800 + 25 * i}mV" for i, clock in enumerate(self.sclk)]
+        od += ["OD_MCLK:"] + [f"{i}:        {clock}MHz        {800 + 50 * i}mV" for i, clock in enumerate(self.mclk)]
+        od += ["OD_RANGE:", "SCLK:     300MHz       2000MHz", "MCLK:     300MHz       2250MHz", "VDDC:     750mV        1150mV"]
+        self.add_file(cardpath + "/pp_od_clk_voltage", "\n".join(od))
+        sclk_state = self.signal(seed, 0, len(self.sclk))
+        mclk_state = self.signal(seed + 1, 0, len(self.mclk))
+        self.add_file(cardpath + "/pp_dpm_sclk", lambda phase: self.dpm_table(self.sclk, sclk_state(phase)))
+        self.add_file(cardpath + "/pp_dpm_mclk", lambda phase: self.dpm_table(self.mclk, mclk_state(phase)))
+        self.add_file(cardpath + "/gpu_busy_percent", self.signal(seed + 2, 0, 101))
+        self.add_file(cardpath + "/pp_sclk_od", 0)
+        self.add_file(cardpath + "/pp_mclk_od", 0)
+        self.add_file(cardpath + "/power_dpm_force_performance_level", "auto")
+        self.add_file(cardpath + "/power/runtime_status", "active")
+
+        self.add_file(hwmonpath + "/name", "amdgpu")
+        self.add_file(hwmonpath + "/temp1_input", self.signal(seed + 3, 30000, 90000))
+        self.add_file(hwmonpath + "/temp1_crit", 100000)
+        self.add_file(hwmonpath + "/fan1_input", self.signal(seed + 4, 0, 3200))
+        self.add_file(hwmonpath + "/fan1_min", 0)
+        self.add_file(hwmonpath + "/fan1_max", 3200)
+        self.add_file(hwmonpath + "/fan1_target", 1600)
+        self.add_file(hwmonpath + "/pwm1", self.signal(seed + 5, 0, 256))
+        self.add_file(hwmonpath + "/pwm1_enable", 2)
+        self.add_file(hwmonpath + "/pwm1_min", 0)
+        self.add_file(hwmonpath + "/pwm1_max", 255)
+        self.add_file(hwmonpath + "/power1_average", self.signal(seed + 6, 10000000, 150000000))
+        self.add_file(hwmonpath + "/power1_cap", 150000000)
+        self.add_file(hwmonpath + "/power1_cap_min", 0)
+        self.add_file(hwmonpath + "/power1_cap_max", 180000000)
+        self.add_file(hwmonpath + "/in0_input", self.signal(seed + 7, 750, 1150))
+        self.add_file(hwmonpath + "/in0_label", "vddgfx")
+
+        # Additional sensors, cycling through the subsystems
+        numbers = {"temp": 1, "in": 0, "power": 1}
+        for i in range(sensors - 5):
+            subsystem = self.extra_sensors[i % len(self.extra_sensors)]
+            numbers[subsystem] += 1
+            name = f"{subsystem}{numbers[subsystem]}"
+            if subsystem == "temp":
+                self.add_file(f"{hwmonpath}/{name}_input", self.signal(seed + 8 + i, 30000, 90000))
+                self.add_file(f"{hwmonpath}/{name}_crit", 100000)
+            elif subsystem == "in":
+                self.add_file(f"{hwmonpath}/{name}_input", self.signal(seed + 8 + i, 750, 1150))
+            elif subsystem == "power":
+                self.add_file(f"{hwmonpath}/{name}_average", self.signal(seed + 8 + i, 1000000, 50000000))
+            self.add_file(f"{hwmonpath}/{name}_label", f"synthetic{i}")
+
+    @staticmethod
+    def dpm_table(clocks, state):
+        state = min(state, len(clocks) - 1)
+        return "\n".join(f"{i}: {clock}Mhz" + (" *" if i == state else "") for i, clock in enumerate(clocks))
+
+    def phase(self):
+        # time since start [s], quantised to the sample rate
+        return math.floor((self.clock() - self.start) * self.rate) / self.rate
+
+    def get(self, path):
+        path = normpath(path)
+        if path not in self.files:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        value = self.files[path]
+        if callable(value):
+            return value(self.phase())
+        return value
+
+    def read(self, path):
+        value = self.get(path)
+        if type(value) is str:
+            value = value.split("\n")[0]
+            if value == "":
+                return None
+        return value
+
+    def readlines(self, path):
+        return [line + "\n" for line in str(self.get(path)).split("\n")]
+
+    def readbytes(self, path):
+        value = self.get(path)
+        return value if type(value) is bytes else str(value).encode()
+
+    def listdir(self, path):
+        if path not in self.directories:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        return list(self.directories[path])
+
+    def isfile(self, path):
+        return normpath(path) in self.files
+
+    def write(self, path, value):
+        path = normpath(path)
+        if path not in self.files:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        if path.endswith("/pp_od_clk_voltage"):
+            # P state commands are not emulated
+            return
+        self.files[path] = int(value) if type(value) is int or str(value).lstrip("-").isdigit() else str(value)
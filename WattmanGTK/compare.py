@@ -0,0 +1,239 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# A/B comparison of two recordings (--record) of the same workload, e.g. with
+# two overclock profiles:
+#
+#   python3 -m WattmanGTK.compare stock.wrec undervolt.wrec --marker "GPU Usage > 50" --plot ab.png
+#
+# Both sessions are aligned on their start, or with --marker on the first
+# sample where the condition holds (the workload starts) up to the last one.
+# For every signal the distributions of A and B are compared: mean, spread,
+# percentiles and the largest distance between their cumulative distributions
+# (0: the same, 1: no overlap). Recordings are memory mapped and only the
+# columns of the compared signals in the aligned window are read.
+
+import time
+from optparse import OptionParser
+import numpy as np
+from WattmanGTK.alerts import Condition
+from WattmanGTK.plotsignal import Plotsignal
+from WattmanGTK.telemetry import TelemetryFile
+from WattmanGTK.util import convert_to_si
+
+default_signals = ["GPU Clock", "MEM Clock", "power", "temp", "GPU Usage"]
+percentiles = [1, 5, 50, 95, 99]
+EFFICIENCY = "MHz per W"    # GPU Clock / power, computed per sample
+
+
+class Session:
+    # Recorded signals of one card, with the time window which is compared
+    def __init__(self, filename, card=0, marker=None):
+        self.filename = filename
+        self.recording = TelemetryFile(filename)
+        self.signals = {}   # signal number -> header entry, of the compared card
+        for signalnr, signal in enumerate(self.recording.header["signals"]):
+            if signal["card"] == card:
+                self.signals[signalnr] = signal
+        if len(self.signals) == 0:
+            raise ValueError(f"{filename} has no signals of card {card}")
+        self.first = 0
+        self.last = len(self.recording)
+        if marker is not None:
+            self.find_marker(marker)
+
+    def find(self, key):
+        # outputs: number of the first signal with key as name, sensor file or subsystem, None without
+        for signalnr, signal in self.signals.items():
+            if key in Plotsignal(signal["name"], signal["unit"], sensorpath=signal["path"] or "").get_keys():
+                return signalnr
+        return None
+
+    def find_marker(self, condition):
+        # Window from the first to the last sample where the condition holds
+        signalnr = self.find(condition.key)
+        if signalnr is None:
+            raise ValueError(f"{self.filename} has no signal {condition.key} for the marker")
+        try:
+            threshold = float(condition.value) / convert_to_si(self.signals[signalnr]["unit"], 1)[1]
+        except ValueError:
+            raise ValueError(f"Marker {condition.text} needs a number, not {condition.value}")
+        with np.errstate(invalid="ignore"):
+            holds = np.flatnonzero(condition.compare(self.recording.column(signalnr), threshold))
+        if len(holds) == 0:
+            raise ValueError(f"Marker {condition.text} never holds in {self.filename}")
+        self.first = int(holds[0])
+        self.last = int(holds[-1]) + 1
+
+    def limit(self, duration):
+        # Shortens the window to duration [s] after its start
+        times = self.recording.times
+        self.last = min(self.last, int(np.searchsorted(times, times[self.first] + duration, side="right")))
+
+    def duration(self):
+        times = self.recording.times
+        return float(times[self.last - 1] - times[self.first])
+
+    def times(self):
+        # Time since the start of the window [s]
+        times = self.recording.times[self.first:self.last]
+        return times - times[0]
+
+    def values(self, signalnr):
+        # Values in the window in the unit shown in the GUI (e.g. W instead of µW)
+        values = np.array(self.recording.column(signalnr)[self.first:self.last])
+        return convert_to_si(self.signals[signalnr]["unit"], values)
+
+    def signal(self, key):
+        # outputs: unit and values of a signal or of the efficiency, None when not recorded
+        if key == EFFICIENCY:
+            clock, power = self.find("GPU Clock"), self.find("power")
+            if clock is None or power is None:
+                return None
+            with np.errstate(all="ignore"):
+                values = self.values(clock)[1] / self.values(power)[1]
+            return "[MHz/W]", np.where(np.isfinite(values), values, np.nan)
+        signalnr = self.find(key)
+        if signalnr is None:
+            return None
+        return self.values(signalnr)
+
+
+def distribution(values):
+    # outputs: dict with the statistics of the values which are not NaN, None when there are none
+    values = np.sort(values[np.isfinite(values)])
+    if len(values) == 0:
+        return None
+    statistics = {"mean": values.mean(), "std": values.std(), "min": values[0], "max": values[-1]}
+    for percent, value in zip(percentiles, np.percentile(values, percentiles)):
+        statistics[f"p{percent}"] = value
+    statistics["sorted"] = values
+    return statistics
+
+
+def cdf_distance(a, b):
+    # Largest distance between the cumulative distributions of sorted a and b
+    points = np.concatenate((a, b))
+    return float(np.max(np.abs(np.searchsorted(a, points, side="right") / len(a) - np.searchsorted(b, points, side="right") / len(b))))
+
+
+def compare(A, B, keys):
+    # outputs: list of (key, unit, statistics A, statistics B, CDF distance, (times, values) of A and B)
+    results = []
+    timesA, timesB = A.times(), B.times()
+    for key in keys:
+        signalA, signalB = A.signal(key), B.signal(key)
+        if signalA is None or signalB is None:
+            print(f"Skipping {key}, it is not recorded in {A.filename if signalA is None else B.filename}")
+            continue
+        statsA, statsB = distribution(signalA[1]), distribution(signalB[1])
+        if statsA is None or statsB is None:
+            print(f"Skipping {key}, it has no values in the compared window")
+            continue
+        results.append((key, signalA[0], statsA, statsB, cdf_distance(statsA["sorted"], statsB["sorted"]),
+                        ((timesA, signalA[1]), (timesB, signalB[1]))))
+    return results
+
+
+def print_summary(A, B, results):
+    print(f"A: {A.filename}, {A.duration():.1f} s from {A.recording.times[A.first]:.1f} s")
+    print(f"B: {B.filename}, {B.duration():.1f} s from {B.recording.times[B.first]:.1f} s")
+    print(f"{'Signal':<24} {'':>5} {'A':>10} {'B':>10} {'B-A':>10} {'[%]':>7}")
+    for key, unit, statsA, statsB, distance, _ in results:
+        name = f"{key} {unit}"
+        for stat in ["mean", "std", "min"] + [f"p{percent}" for percent in percentiles] + ["max"]:
+            a, b = statsA[stat], statsB[stat]
+            relative = f"{(b - a) / abs(a) * 100:>+7.1f}" if a != 0 else f"{'':>7}"
+            print(f"{name:<24} {stat:>5} {a:>10.2f} {b:>10.2f} {b - a:>+10.2f} {relative}")
+            name = ""
+        print(f"{'':<24} {'CDF':>5} {'':>10} {'':>10} {distance:>10.3f}")
+
+
+def plot(results, filename, points=2000):
+    # Overlaid time series and cumulative distributions of A and B per signal
+    # imported here, so comparing without plots does not load matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(12, 2.5 * len(results)), dpi=100)
+    for row, (key, unit, statsA, statsB, distance, series) in enumerate(results):
+        timeplot = fig.add_subplot(len(results), 2, 2 * row + 1)
+        cdfplot = fig.add_subplot(len(results), 2, 2 * row + 2)
+        for label, color, (times, values), stats in [("A", "#1f77b4", series[0], statsA), ("B", "#ff7f0e", series[1], statsB)]:
+            # every step-th sample is enough for the screen, the statistics use all samples
+            step = max(1, len(times) // points)
+            timeplot.plot(times[::step], values[::step], color=color, linewidth=0.8, label=label)
+            quantiles = np.linspace(0, 1, min(points, len(stats["sorted"])))
+            cdfplot.plot(np.quantile(stats["sorted"], quantiles), quantiles * 100, color=color, label=label)
+        timeplot.set_ylabel(f"{key} {unit}")
+        cdfplot.set_ylabel("Samples below [%]")
+        cdfplot.set_title(f"CDF distance {distance:.3f}", fontsize="small")
+        if row == 0:
+            timeplot.legend(loc="upper right")
+    fig.axes[-2].set_xlabel("Time [s]")
+    fig.axes[-1].set_xlabel("Value")
+    fig.tight_layout()
+    FigureCanvasAgg(fig).print_figure(filename)
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] A B\nCompares two recordings of the same workload")
+    parser.add_option("-c", "--card", help="card number to compare", metavar="number", default=0, type="int")
+    parser.add_option("-s", "--signals", help=f"signals (name, sensor file or subsystem) to compare, default {','.join(default_signals)} and {EFFICIENCY}",
+                      metavar="list", type="str")
+    parser.add_option("-m", "--marker", help="align on the first sample where the condition holds and end at the last, e.g. \"GPU Usage > 50\"",
+                      metavar="condition", type="str")
+    parser.add_option("-d", "--duration", help="compare at most this time [s] after the start of both windows, default the shorter window",
+                      metavar="number", type="float")
+    parser.add_option("-p", "--plot", help="write overlaid plots of A and B to this image file, e.g. ab.png", metavar="file", type="str")
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Give two recordings")
+
+    started = time.perf_counter()
+    try:
+        marker = Condition(options.marker) if options.marker else None
+    except ValueError:
+        print(f"Cannot parse marker {options.marker}, use a signal, a comparison and a number e.g. \"GPU Usage > 50\"")
+        exit(2)
+    try:
+        A = Session(args[0], options.card, marker)
+        B = Session(args[1], options.card, marker)
+    except (OSError, ValueError) as error:
+        print(f"Cannot compare: {error}")
+        exit(1)
+    # the same length of both, so a longer tail after the workload does not count
+    duration = options.duration if options.duration is not None else min(A.duration(), B.duration())
+    A.limit(duration)
+    B.limit(duration)
+    keys = [key.strip() for key in options.signals.split(",")] if options.signals else default_signals + [EFFICIENCY]
+    results = compare(A, B, keys)
+    if len(results) == 0:
+        print("No signals to compare")
+        exit(1)
+    print_summary(A, B, results)
+    print(f"Compared {len(A.times()) + len(B.times())} samples in {(time.perf_counter() - started) * 1000:.0f} ms")
+    if options.plot:
+        try:
+            plot(results, options.plot)
+            print(f"Plots written to {options.plot}")
+        except (OSError, ValueError) as error:
+            print(f"Cannot write {options.plot}: {error}")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Derived signals are computed from other signals with an expression, e.g.
+#
+#   [MHz per W]
+#   expression = {GPU Clock} / {power1}
+#   unit = [MHz/W]
+#
+# {key} is a signal (name, sensor file or subsystem) of the same card,
+# {1:key} the signal of card 1 and {*:key} the signal of all cards, which
+# can be reduced with total, average, maximum and minimum. Signals are used
+# in the unit shown in the GUI (e.g. W instead of µW). Only arithmetic,
+# comparisons, numbers, signals and the functions below can be used.
+
+import ast
+import re
+import configparser
+import numpy as np
+from WattmanGTK.plotsignal import Plotsignal
+from WattmanGTK.util import convert_to_si
+
+# Used with --derived default
+default_definitions = [
+    {"name": "MHz per W", "expression": "{GPU Clock} / {power1}", "unit": "[MHz/W]"},
+    {"name": "Busy clock", "expression": "{GPU Clock} * {GPU Usage} / 100", "unit": "[MHz]"},
+    {"name": "Total power", "expression": "total({*:power1})", "unit": "[W]"},
+]
+
+functions = {"total": lambda values: np.sum(values, axis=0), "average": lambda values: np.mean(values, axis=0),
+             "maximum": lambda values: np.max(values, axis=0), "minimum": lambda values: np.min(values, axis=0),
+             "abs": np.abs, "sqrt": np.sqrt}
+placeholder_pattern = r"\{(?:(\d+|\*):)?([^}]+)\}"
+# operators allowed in an expression, anything else (attributes, subscripts, lambdas, ...) could escape eval
+operators = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+             ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+colors = ["#aec7e8", "#ffbb78", "#98df8a", "#ff9896", "#c5b0d5", "#c49c94", "#f7b6d2", "#dbdb8d"]
+
+
+def check_node(node):
+    # Raises ValueError for every node which is not allowed in an expression (see operators)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, operators):
+        children = [node.left, node.right]
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, operators):
+        children = [node.operand]
+    elif isinstance(node, ast.Compare) and all(isinstance(op, operators) for op in node.ops):
+        children = [node.left] + node.comparators
+    elif isinstance(node, ast.Constant) and type(node.value) in [int, float]:
+        children = []
+    elif isinstance(node, ast.Name) and re.fullmatch(r"x\d+", node.id):
+        children = []
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in functions and len(node.keywords) == 0:
+        children = node.args
+    elif isinstance(node, ast.Call):
+        raise ValueError(f"only {', '.join(functions)} can be called")
+    else:
+        raise ValueError(f"{type(node).__name__} is not allowed")
+    for child in children:
+        check_node(child)
+
+
+def parse_expression(expression, text):
+    # Parses text, the expression with its placeholders replaced by x0, x1, ...
+    # outputs: ast of text, only with the nodes allowed by check_node
+    try:
+        tree = ast.parse(text, mode="eval")
+        check_node(tree.body)
+    except SyntaxError as error:
+        raise ValueError(f"cannot parse {expression}: {error.msg}")
+    except ValueError as error:
+        raise ValueError(f"cannot use {expression}: {error}")
+    return tree
+
+
+def read_definitions(filename):
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    if len(config.read(filename)) == 0:
+        raise ValueError(f"Cannot read {filename}")
+    definitions = []
+    for name in config.sections():
+        if "expression" not in config[name]:
+            raise ValueError(f"Derived signal {name} in {filename} has no expression")
+        # checked when loading, the signals are only found later
+        try:
+            parse_expression(config[name]["expression"], re.sub(placeholder_pattern, "x0", config[name]["expression"]))
+        except ValueError as error:
+            raise ValueError(f"Derived signal {name} in {filename}: {error}")
+        definitions.append({"name": name, "expression": config[name]["expression"], "unit": config[name].get("unit", "[-]")})
+    return definitions
+
+
+def find_signal(Plotsignals, key):
+    return next((Plotsignal for Plotsignal in Plotsignals if not Plotsignal.derived and key in Plotsignal.get_keys()), None)
+
+
+class DerivedSignal(Plotsignal):
+    derived = True
+
+    def __init__(self, name, unit, expression, cardnr, GPUsignals, plotcolor):
+        super().__init__(name, unit, 0, 0, '', True, True, plotcolor, self.evaluate_last)
+        self.expression = expression
+        # Every placeholder becomes a variable x0, x1, ... with a Plotsignal or a list of Plotsignals (all cards)
+        self.inputs = []
+        self.per_card = False   # uses a signal of its own card, otherwise the same for every card
+        def replace(match):
+            card, key = match.groups()
+            self.per_card = self.per_card or card is None
+            if card == "*":
+                signal = [find_signal(Plotsignals, key) for Plotsignals in GPUsignals]
+                if any(Plotsignal is None for Plotsignal in signal):
+                    raise ValueError(f"not every card has a signal {key}")
+            else:
+                card = cardnr if card is None else int(card)
+                if card >= len(GPUsignals):
+                    raise ValueError(f"there is no card {card}")
+                signal = find_signal(GPUsignals[card], key)
+                if signal is None:
+                    raise ValueError(f"card {card} has no signal {key}")
+            self.inputs.append(signal)
+            return f"x{len(self.inputs) - 1}"
+        self.code = compile(parse_expression(expression, re.sub(placeholder_pattern, replace, expression)), name, "eval")
+
+    def input_signals(self):
+        # All Plotsignals used, to be sampled before this signal
+        return [signal for inputs in self.inputs for signal in (inputs if type(inputs) is list else [inputs])]
+
+    def evaluate(self, variables):
+        with np.errstate(all="ignore"):
+            return eval(self.code, {"__builtins__": {}, **functions}, variables)
+
+    def evaluate_last(self, sensorpath):
+        # Incremental update: the expression on the last value of every input
+        variables = {}
+        for i, inputs in enumerate(self.inputs):
+            values = [Plotsignal.get_last_value() for Plotsignal in (inputs if type(inputs) is list else [inputs])]
+            if any(value is None for value in values):
+                return None
+            values = [np.float64(convert_to_si(Plotsignal.unit, value)[1]) for Plotsignal, value in
+                      zip(inputs if type(inputs) is list else [inputs], values)]
+            variables[f"x{i}"] = np.array(values) if type(inputs) is list else values[0]
+        value = float(self.evaluate(variables))
+        return value if np.isfinite(value) else np.nan
+
+    def rebuild(self, maxpoints):
+        # Evaluates the expression on the whole history at once, the inputs are
+        # interpolated to the times of the input with the most samples
+        signals = self.input_signals()
+        reference = max(signals, key=lambda Plotsignal: len(Plotsignal.times))
+        times = reference.times[-maxpoints:]
+        def history(Plotsignal):
+            return np.interp(times, Plotsignal.times, convert_to_si(Plotsignal.unit, Plotsignal.get_values().astype(float))[1])
+        variables = {}
+        for i, inputs in enumerate(self.inputs):
+            if type(inputs) is list:
+                variables[f"x{i}"] = np.array([history(Plotsignal) for Plotsignal in inputs])
+            else:
+                variables[f"x{i}"] = history(inputs)
+        data = np.broadcast_to(np.asarray(self.evaluate(variables), dtype=float), times.shape)
+        self.data = np.where(np.isfinite(data), data, np.nan)
+        self.times = times.copy()
+
+
+def create_derived(definitions, GPUsignals):
+    # Adds the derived signals to the Plotsignals of every card, a signal which only uses
+    # given cards (e.g. {*:power1}) is created once and shared by all cards
+    # outputs: list with the new DerivedSignals of every card
+    derived = [[] for _ in GPUsignals]
+    shared = {}     # definition number -> DerivedSignal which does not depend on the card
+    for cardnr, Plotsignals in enumerate(GPUsignals):
+        for i, definition in enumerate(definitions):
+            if i in shared:
+                derived[cardnr].append(shared[i])
+                continue
+            try:
+                signal = DerivedSignal(definition["name"], definition["unit"], definition["expression"], cardnr, GPUsignals, colors[i % len(colors)])
+            except ValueError as error:
+                print(f"Cannot add {definition['name']} to card {cardnr}: {error}")
+                continue
+            if not signal.per_card:
+                shared[i] = signal
+            derived[cardnr].append(signal)
+    # added afterwards, so derived signals are not used as inputs
+    for Plotsignals, signals in zip(GPUsignals, derived):
+        Plotsignals.extend(signals)
+    return derived
@@ -0,0 +1,144 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Energy accounting per card: power is integrated over time to joules, and the
+# time, energy and clock of every interval are attributed to the GPU and memory
+# DPM state the card was in. MHz per W is the time averaged clock divided by
+# the average power. The power and state of the previous sample are held until
+# the next one, so every sample costs a few additions. This module must not
+# import GTK, see energyview.py for the window.
+
+import json
+import math
+import threading
+from WattmanGTK.util import convert_to_si
+
+power_keys = ["power1_average", "power1_input", "power"]
+
+
+def find_signal(Plotsignals, keys):
+    # First signal matching a key, keys from preferred to fallback
+    for key in keys:
+        signal = next((Plotsignal for Plotsignal in Plotsignals if not Plotsignal.derived and key in Plotsignal.get_keys()), None)
+        if signal is not None:
+            return signal
+    return None
+
+
+def si_value(Plotsignal):
+    # Last value in the unit shown in the GUI (W, MHz), None when there is none
+    if Plotsignal is None:
+        return None
+    value = Plotsignal.get_last_value()
+    if value is None or not math.isfinite(value):
+        return None
+    return convert_to_si(Plotsignal.unit, float(value))[1]
+
+
+class CardEnergy:
+    def __init__(self, name, signals):
+        self.name = name
+        self.signals = signals      # power, GPU state, GPU clock, MEM state, MEM clock Plotsignals (or None)
+        self.reset()
+
+    def reset(self):
+        self.previous = None        # (time, power, GPU state, GPU clock, MEM state, MEM clock) of the last sample
+        self.time = 0.0             # [s] with a known power
+        self.energy = 0.0           # [J]
+        self.clocktime = 0.0        # GPU clock integrated over time [MHz s]
+        # state -> [time, energy, clock integrated over time]
+        self.gpu_states = {}
+        self.mem_states = {}
+
+    def add(self, timestamp, maxgap):
+        sample = (timestamp,) + tuple(si_value(signal) for signal in self.signals)
+        previous = self.previous
+        self.previous = sample
+        if previous is None or previous[1] is None:
+            return
+        interval = timestamp - previous[0]
+        if interval <= 0 or interval > maxgap:
+            # e.g. sinks were not sampled for a while, the power in between is unknown
+            return
+        _, power, gpu_state, gpu_clock, mem_state, mem_clock = previous
+        energy = power * interval
+        self.time += interval
+        self.energy += energy
+        if gpu_clock is not None:
+            self.clocktime += gpu_clock * interval
+        for states, state, clock in [(self.gpu_states, gpu_state, gpu_clock), (self.mem_states, mem_state, mem_clock)]:
+            if state is None:
+                continue
+            totals = states.setdefault(int(state), [0.0, 0.0, 0.0])
+            totals[0] += interval
+            totals[1] += energy
+            if clock is not None:
+                totals[2] += clock * interval
+
+    def summary(self):
+        def figures(time, energy, clocktime):
+            return {"time": round(time, 3), "share": round(time / self.time * 100, 2) if self.time > 0 else 0,
+                    "energy": round(energy, 3), "power": round(energy / time, 3) if time > 0 else None,
+                    "clock": round(clocktime / time, 1) if time > 0 and clocktime > 0 else None,
+                    "mhz_per_w": round(clocktime / energy, 3) if energy > 0 and clocktime > 0 else None}
+        summary = {"card": self.name, **figures(self.time, self.energy, self.clocktime)}
+        del summary["share"]
+        summary["gpu_states"] = {state: figures(*totals) for state, totals in sorted(self.gpu_states.items())}
+        summary["mem_states"] = {state: figures(*totals) for state, totals in sorted(self.mem_states.items())}
+        return summary
+
+
+class EnergyMeter:
+    # Sink of Plot, accumulates the energy of every card with a power sensor since the
+    # start or the last reset. Intervals longer than maxgap [s] are not counted.
+    def __init__(self, maxgap=10):
+        self.maxgap = maxgap
+        self.cards = []
+        self.lock = threading.Lock()    # samples are added in the refresh thread, summaries read by the GUI
+
+    def start_recording(self, GPUs, GPUsignals):
+        for GPU, Plotsignals in zip(GPUs, GPUsignals):
+            signals = [find_signal(Plotsignals, keys) for keys in [power_keys, ["GPU State"], ["GPU Clock"], ["MEM State"], ["MEM Clock"]]]
+            if signals[0] is None:
+                print(f"{GPU.fancyname} has no power sensor, no energy is accounted")
+            self.cards.append(CardEnergy(GPU.fancyname, signals))
+
+    def add_samples(self, timestamp, GPUsignals):
+        # timestamp: time.monotonic() of the samples
+        with self.lock:
+            for card in self.cards:
+                card.add(timestamp, self.maxgap)
+
+    def reset(self):
+        with self.lock:
+            for card in self.cards:
+                card.reset()
+
+    def summary(self):
+        # outputs: list with a dict per card, energy in J, time in s, power in W and clock in MHz
+        with self.lock:
+            return [card.summary() for card in self.cards]
+
+    def export(self, filename):
+        with open(filename, "w") as outputfile:
+            json.dump(self.summary(), outputfile, separators=(",", ":"))
+
+    def report(self):
+        for card in self.summary():
+            if card["time"] > 0:
+                print(f"{card['card']}: {card['energy']:.1f} J in {card['time']:.0f} s, {card['power']:.1f} W average" +
+                      (f", {card['mhz_per_w']:.2f} MHz per W" if card["mhz_per_w"] is not None else ""))
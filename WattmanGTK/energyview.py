@@ -0,0 +1,97 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import gi                   # required for GTK3
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+
+def text(value, digits):
+    return "N/A" if value is None else f"{value:.{digits}f}"
+
+
+class EnergyView:
+    # Window with the energy per DPM state of every card, see energy.py. Accumulated by the
+    # EnergyMeter sink in the refresh thread, the table is refreshed in the GTK main thread.
+    columns = ["Card / state", "Clock [MHz]", "Time [s]", "Time [%]", "Energy [J]", "Power [W]", "MHz per W"]
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.visible = True     # table not refreshed while the window is closed
+        self.store = Gtk.TreeStore(str, str, str, str, str, str, str)
+        self.tree = Gtk.TreeView(model=self.store)
+        textrenderer = Gtk.CellRendererText()
+        for i, column in enumerate(self.columns):
+            self.tree.append_column(Gtk.TreeViewColumn(column, textrenderer, text=i))
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_vexpand(True)
+        scrolled.add(self.tree)
+        reset = Gtk.Button(label="Reset")
+        reset.connect("clicked", self.on_reset)
+        export = Gtk.Button(label="Export")
+        export.connect("clicked", self.on_export)
+        buttons = Gtk.Box(spacing=6)
+        buttons.pack_end(export, False, False, 0)
+        buttons.pack_end(reset, False, False, 0)
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        box.pack_start(scrolled, True, True, 0)
+        box.pack_start(buttons, False, False, 0)
+        self.window = Gtk.Window(title="Energy")
+        self.window.set_default_size(600, 300)
+        self.window.add(box)
+        self.window.connect("delete-event", self.on_delete)
+        self.window.show_all()
+
+    def on_delete(self, window, event):
+        # closing only hides the window, energy is still accumulated
+        self.visible = False
+        window.hide()
+        return True
+
+    def on_reset(self, button):
+        # starts a new session, e.g. before running the next job
+        self.meter.reset()
+        self.update()
+
+    def on_export(self, button):
+        dialog = Gtk.FileChooserDialog(title="Export energy summary", parent=self.window, action=Gtk.FileChooserAction.SAVE)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("energy.json")
+        if dialog.run() == Gtk.ResponseType.OK:
+            filename = dialog.get_filename()
+            try:
+                self.meter.export(filename)
+                print(f"Energy summary written to {filename}")
+            except OSError as error:
+                print(f"Cannot write {filename}: {error.strerror}")
+        dialog.destroy()
+
+    def row(self, name, figures):
+        return [name, text(figures["clock"], 0), text(figures["time"], 0), text(figures.get("share"), 1),
+                text(figures["energy"], 1), text(figures["power"], 1), text(figures["mhz_per_w"], 2)]
+
+    def update(self):
+        # rebuilt on every refresh, there are only a few rows per card
+        self.store.clear()
+        for card in self.meter.summary():
+            parent = self.store.append(None, self.row(card["card"], card))
+            for prefix, states in [("GPU", card["gpu_states"]), ("MEM", card["mem_states"])]:
+                for state, figures in states.items():
+                    self.store.append(parent, self.row(f"{prefix} state {state}", figures))
+        self.tree.expand_all()
+        return False
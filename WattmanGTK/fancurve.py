@@ -0,0 +1,168 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+import numpy as np
+from WattmanGTK.util import read, write
+
+# output -> file which selects the fan control mode, its manual and automatic value
+# (pwm1_enable: 1 manual, 2 automatic; fan1_enable: 1 manual, 0 automatic)
+outputs = {"pwm1": ("/pwm1_enable", 1, 2), "fan1_target": ("/fan1_enable", 1, 0)}
+
+
+class FanCurve:
+    # Piecewise linear curve which maps temperature [°C] to fan speed [%]
+    # hysteresis [°C]: temperature drop needed before the fan speed is lowered
+    # max_step [%/s]: maximum change of the fan speed per second
+    def __init__(self, points, hysteresis=3, max_step=10):
+        if len(points) == 0:
+            raise ValueError("A fan curve needs at least one point")
+        points = sorted(points)
+        self.temperatures = np.array([point[0] for point in points], dtype=float)
+        self.speeds = np.clip(np.array([point[1] for point in points], dtype=float), 0, 100)
+        self.hysteresis = hysteresis
+        self.max_step = max_step
+        self.reference = None   # temperature used to evaluate the curve
+        self.speed = None       # current (rate limited) fan speed [%]
+        self.last_time = None
+
+    @classmethod
+    def from_string(cls, curve, hysteresis=3, max_step=10):
+        # Parses curves like "40:20,60:40,80:100" (temperature:speed pairs)
+        try:
+            points = [tuple(float(value) for value in point.split(":")) for point in curve.split(",")]
+            if any(len(point) != 2 for point in points):
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Cannot parse fan curve \"{curve}\", use temperature:speed pairs e.g. 40:20,60:40,80:100")
+        return cls(points, hysteresis, max_step)
+
+    def evaluate(self, temperature):
+        return float(np.interp(temperature, self.temperatures, self.speeds))
+
+    def update(self, temperature, now):
+        # Returns new fan speed [%] for the given temperature [°C] at time now [s]
+        if self.reference is None or temperature >= self.reference:
+            self.reference = temperature
+        elif temperature <= self.reference - self.hysteresis:
+            self.reference = temperature + self.hysteresis
+        target = self.evaluate(self.reference)
+
+        if self.speed is None:
+            self.speed = target
+        else:
+            max_change = self.max_step * (now - self.last_time)
+            self.speed += np.clip(target - self.speed, -max_change, max_change)
+        self.last_time = now
+        return self.speed
+
+
+class FanController:
+    # Control loop which writes the fan curve output of temp1_input to pwm1 or fan1_target
+    # reader and writer can be replaced to run the loop against a simulated card
+    def __init__(self, hwmonpath, curve, tickrate=1, output="pwm1", reader=read, writer=write):
+        self.hwmonpath = hwmonpath
+        self.curve = curve
+        self.period = 1 / tickrate
+        self.output = output
+        self.read = reader
+        self.write = writer
+        self.enabled = False
+        self.next_tick = 0
+        self.written = None     # last value written to the output
+        self.writes = 0
+        self.lock = threading.Lock()    # ticks run in the refresh thread, stop in the main thread
+
+        if output not in outputs:
+            raise ValueError(f"Unknown fan output {output}, use pwm1 or fan1_target")
+        self.enable_file, self.manual, self.automatic = outputs[output]
+        if output == "pwm1":
+            self.output_range = [self.read_or_default("/pwm1_min", 0), self.read_or_default("/pwm1_max", 255)]
+        else:
+            # fan1_target is in RPM, without fan1_max the speed cannot be scaled
+            self.output_range = [self.read_or_default("/fan1_min", 0), self.read_or_default("/fan1_max", 0)]
+
+    def read_or_default(self, path, default):
+        try:
+            value = self.read(self.hwmonpath + path)
+        except OSError:
+            return default
+        return value if type(value) is int else default
+
+    def start(self, now=None):
+        # Switches the fan to manual mode, the loop is run by calling tick
+        # outputs: True when the fan is controlled, the card keeps its automatic control otherwise
+        if self.output_range[1] <= self.output_range[0]:
+            print(f"Cannot read the range of {self.hwmonpath}/{self.output}, not taking fan control")
+            return False
+        try:
+            if self.read(self.hwmonpath + self.enable_file) != self.manual:
+                self.write(self.hwmonpath + self.enable_file, self.manual)
+        except OSError as error:
+            print(f"Cannot enable manual fan control in {self.hwmonpath}: {error.strerror}")
+            return False
+        self.enabled = True
+        self.next_tick = time.monotonic() if now is None else now
+        return True
+
+    def stop(self):
+        # Gives control back to the automatic fan control of the card, can be called more than once
+        with self.lock:
+            if self.enabled:
+                self.restore()
+
+    def restore(self):
+        self.enabled = False
+        try:
+            self.write(self.hwmonpath + self.enable_file, self.automatic)
+        except OSError as error:
+            print(f"Cannot restore automatic fan control in {self.hwmonpath}: {error.strerror}")
+
+    def tick(self, now=None):
+        # Runs one iteration of the loop, only writes when the output changes
+        with self.lock:
+            if self.enabled:
+                self.control(time.monotonic() if now is None else now)
+
+    def control(self, now):
+        # One iteration at time now [s], called with the lock held
+        self.next_tick += self.period
+        if self.next_tick < now:
+            # loop could not keep up, do not try to catch up missed ticks
+            self.next_tick = now + self.period
+        try:
+            temperature = self.read(self.hwmonpath + "/temp1_input")
+        except OSError as error:
+            # e.g. the card was removed or its hwmon directory renumbered
+            print(f"Cannot read {self.hwmonpath}/temp1_input: {error.strerror}, disabling fan curve")
+            self.restore()
+            return
+        if type(temperature) is not int:
+            return
+        speed = self.curve.update(temperature / 1000, now)
+        value = int(round(self.output_range[0] + speed / 100 * (self.output_range[1] - self.output_range[0])))
+        if value == self.written:
+            return
+        try:
+            self.write(self.hwmonpath + "/" + self.output, value)
+        except OSError as error:
+            print(f"Cannot write {self.hwmonpath}/{self.output}: {error.strerror}, disabling fan curve")
+            self.restore()
+            return
+        self.written = value
+        self.writes += 1
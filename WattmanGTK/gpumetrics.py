@@ -0,0 +1,135 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Decoder for the gpu_metrics file of newer amdgpu kernels. The file is one
+# binary struct with temperatures, clocks, activity, power and fan speed, its
+# layout depends on the format and content revision in the header.
+# Source: drivers/gpu/drm/amd/include/kgd_pp_interface.h
+
+import time
+import numpy as np
+
+header = np.dtype([("structure_size", "<u2"), ("format_revision", "u1"), ("content_revision", "u1")])
+
+clocks_v1 = ["gfxclk", "socclk", "uclk", "vclk0", "dclk0", "vclk1", "dclk1"]
+temperatures_v1 = [("temperature_edge", "<u2"), ("temperature_hotspot", "<u2"), ("temperature_mem", "<u2"),
+                   ("temperature_vrgfx", "<u2"), ("temperature_vrsoc", "<u2"), ("temperature_vrmem", "<u2")]
+activity_v1 = [("average_gfx_activity", "<u2"), ("average_umc_activity", "<u2"), ("average_mm_activity", "<u2")]
+average_clocks_v1 = [(f"average_{clock}_frequency", "<u2") for clock in clocks_v1]
+current_clocks_v1 = [(f"current_{clock}", "<u2") for clock in clocks_v1]
+
+# The structs are not packed, align=True gives the same padding as the C compiler
+layouts = {
+    (1, 0): np.dtype(header.descr + [("system_clock_counter", "<u8")] + temperatures_v1 + activity_v1 +
+                     [("average_socket_power", "<u2"), ("energy_accumulator", "<u4")] +
+                     average_clocks_v1 + current_clocks_v1 +
+                     [("throttle_status", "<u4"), ("current_fan_speed", "<u2"),
+                      ("pcie_link_width", "u1"), ("pcie_link_speed", "u1")], align=True),
+    (1, 1): np.dtype(header.descr + temperatures_v1 + activity_v1 +
+                     [("average_socket_power", "<u2"), ("energy_accumulator", "<u8"), ("system_clock_counter", "<u8")] +
+                     average_clocks_v1 + current_clocks_v1 +
+                     [("throttle_status", "<u4"), ("current_fan_speed", "<u2"),
+                      ("pcie_link_width", "<u2"), ("pcie_link_speed", "<u2"), ("padding", "<u2"),
+                      ("gfx_activity_acc", "<u4"), ("mem_activity_acc", "<u4"), ("temperature_hbm", "<u2", (4,))], align=True),
+}
+layouts[(1, 2)] = np.dtype(layouts[(1, 1)].descr + [("firmware_timestamp", "<u8")], align=True)
+layouts[(1, 3)] = np.dtype(layouts[(1, 2)].descr +
+                           [("voltage_soc", "<u2"), ("voltage_gfx", "<u2"), ("voltage_mem", "<u2"), ("padding1", "<u2"),
+                            ("indep_throttle_status", "<u8")], align=True)
+clocks_v2 = ["gfxclk", "socclk", "uclk", "fclk", "vclk", "dclk"]
+temperatures_v2 = [("temperature_gfx", "<u2"), ("temperature_soc", "<u2"), ("temperature_core", "<u2", (8,)),
+                   ("temperature_l3", "<u2", (2,)), ("average_gfx_activity", "<u2"), ("average_mm_activity", "<u2")]
+power_clocks_v2 = ([("average_socket_power", "<u2"), ("average_cpu_power", "<u2"), ("average_soc_power", "<u2"),
+                    ("average_gfx_power", "<u2"), ("average_core_power", "<u2", (8,))] +
+                   [(f"average_{clock}_frequency", "<u2") for clock in clocks_v2] +
+                   [(f"current_{clock}", "<u2") for clock in clocks_v2] +
+                   [("current_coreclk", "<u2", (8,)), ("current_l3clk", "<u2", (2,)),
+                    ("throttle_status", "<u4"), ("fan_pwm", "<u2")])
+# v2_0 has the timestamp right after the header, v2_1 moved it behind the activity
+layouts[(2, 0)] = np.dtype(header.descr + [("system_clock_counter", "<u8")] + temperatures_v2 + power_clocks_v2 +
+                           [("padding", "<u2")], align=True)
+layouts[(2, 1)] = np.dtype(header.descr + temperatures_v2 + [("system_clock_counter", "<u8")] + power_clocks_v2 +
+                           [("padding", "<u2", (3,))], align=True)
+
+# Files which can be read from gpu_metrics per format revision, as field and scale to the unit of the file
+# format 1 (dGPU): temperatures in °C, power in W, activity in %
+# format 2 (APU): temperatures in centi °C, power in mW, activity in centi %
+sysfs_fields = {
+    1: {"/temp1_input": ("temperature_edge", 1000), "/temp2_input": ("temperature_hotspot", 1000),
+        "/temp3_input": ("temperature_mem", 1000), "/power1_average": ("average_socket_power", 1000000),
+        "/fan1_input": ("current_fan_speed", 1), "/in0_input": ("voltage_gfx", 1),
+        "/gpu_busy_percent": ("average_gfx_activity", 1), "/mem_busy_percent": ("average_umc_activity", 1),
+        "/pp_dpm_sclk": ("current_gfxclk", 1), "/pp_dpm_mclk": ("current_uclk", 1)},
+    2: {"/temp1_input": ("temperature_gfx", 10), "/power1_average": ("average_socket_power", 1000),
+        "/gpu_busy_percent": ("average_gfx_activity", 0.01),
+        "/pp_dpm_sclk": ("current_gfxclk", 1), "/pp_dpm_mclk": ("current_uclk", 1)},
+}
+
+
+def decode(blob):
+    # Decodes a gpu_metrics blob without copying it
+    # outputs: numpy record with the fields of the layout of its revision
+    if blob is None:
+        raise ValueError("gpu_metrics could not be read")
+    if len(blob) < header.itemsize:
+        raise ValueError(f"gpu_metrics too short ({len(blob)} bytes)")
+    revision = np.frombuffer(blob, header, count=1)[0]
+    key = (int(revision["format_revision"]), int(revision["content_revision"]))
+    if key not in layouts:
+        raise ValueError(f"unknown gpu_metrics revision v{key[0]}_{key[1]}")
+    layout = layouts[key]
+    if len(blob) < layout.itemsize or revision["structure_size"] < layout.itemsize:
+        raise ValueError(f"gpu_metrics v{key[0]}_{key[1]} has {len(blob)} bytes, expected {layout.itemsize}")
+    return np.frombuffer(blob, layout, count=1)[0]
+
+
+class GpuMetrics:
+    # Reads gpu_metrics at most once per max_age [s], so all signals sampled in one
+    # wakeup share a single read, and looks up sysfs files in it
+    def __init__(self, path, readbytes, max_age=0.005, clock=time.monotonic):
+        self.path = path
+        self.readbytes = readbytes
+        self.max_age = max_age
+        self.clock = clock
+        self.metrics = decode(readbytes(path))
+        self.read_time = clock()
+        self.revision = (int(self.metrics["format_revision"]), int(self.metrics["content_revision"]))
+        names = self.metrics.dtype.names
+        self.fields = {}    # file -> field, scale and value used by the firmware for an unsupported field
+        for filename, (field, scale) in sysfs_fields[self.revision[0]].items():
+            if field in names:
+                self.fields[filename] = (field, scale, np.iinfo(self.metrics.dtype.fields[field][0]).max)
+
+    def update(self):
+        now = self.clock()
+        if now - self.read_time > self.max_age:
+            self.metrics = decode(self.readbytes(self.path))
+            self.read_time = now
+
+    def read(self, filename):
+        # Value of filename (e.g. /temp1_input) in the unit of the file, None when not available
+        if filename not in self.fields:
+            return None
+        field, scale, unsupported = self.fields[filename]
+        try:
+            self.update()
+        except (OSError, ValueError):
+            return None
+        value = int(self.metrics[field])
+        if value == unsupported:
+            return None
+        return int(value * scale)
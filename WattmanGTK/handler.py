@@ -17,9 +17,11 @@
 
 import gi                   # required for GTK3
 import math
+import threading
 gi.require_version("Gtk", "3.0")
 from gi.repository import GLib, Gtk
 from WattmanGTK.plot import Plot
+from WattmanGTK.persistence import save_profile, validate_profile, PROFILEFILE
 
 class Handler:
     # Handles all interaction with the GUI and Functions
@@ -30,17 +32,22 @@ class Handler:
     # TODO BUG: sometimes main window has different tints of grey?
     # TODO proper scrollbars
     # TODO implement POLKIT for writing as root, for now --> export bash script
-    # TODO implement reboot persistance
     # TODO decrease number of typecastings used
     def __init__(self, builder, GPUs):
         self.builder = builder
         self.GPUs = GPUs
         self.GPU = GPUs[0]
+        self.cardnr = 0
+        # slider ranges of every card are read at startup, so changing cards does not read sysfs,
+        # the current values come with the snapshots of the refresh thread (see GPU.snapshot)
+        self.card_settings = [self.read_card_settings(GPU) for GPU in GPUs]
+        self.refresh_requested = threading.Event()  # set by the GUI to wake the refresh thread
+        self.values_pending = False     # set_initial_values again with the next snapshot of this card
         self.init_state = {}
+        self.update_gui()
         self.set_maximum_values()
-        self.set_initial_values()
+        self.set_initial_values(self.GPU.snapshot())
         self.init_state = self.create_state_dict()
-        self.update_gui()
 
         # initialise GPU selection combobox
         textrenderer = Gtk.CellRendererText()
@@ -62,44 +69,55 @@ class Handler:
         selected_GPU = combo.get_active()
         print(f"Changing GPU to {selected_GPU+1} : {self.GPUs[selected_GPU].fancyname}")
         self.GPU = self.GPUs[selected_GPU]
-        self.set_maximum_values()
-        self.set_initial_values()
-        self.update_gui()
+        self.cardnr = selected_GPU
         self.plot.change_GPU(selected_GPU)
+        # sysfs is only read by the refresh thread, until its next update the last values of the card are shown
+        with self.plot.lock:
+            snapshot = self.GPU.snapshot()
+        self.set_maximum_values()
+        self.set_initial_values(snapshot)
+        self.update_labels(snapshot)
+        self.values_pending = True
+        self.refresh_requested.set()
 
-    def init_plot(self, cardnr, maxpoints, precision, linux_kernelmain, linux_kernelsub):
+    def init_plot(self, cardnr, maxpoints, precision, linux_kernelmain, linux_kernelsub, renderer="matplotlib", refreshtime=1, periods=None, bursts=None, percentiles=None, history=0, plot_span=0):
         # Initialise plot
-        self.plot = Plot(self.builder, self.GPUs, maxpoints, precision, linux_kernelmain, linux_kernelsub)
+        self.plot = Plot(self.builder, self.GPUs, maxpoints, precision, linux_kernelmain, linux_kernelsub, renderer, refreshtime, periods, bursts, percentiles, history, plot_span)
         return self.plot
 
-    def set_maximum_values(self):
-        # Sets maximum values for all elements and shows relevant sliders
-        if self.GPU.pstate:
-            for i,_ in enumerate(self.GPU.pstate_clock):
+    def read_card_settings(self, GPU):
+        # Slider ranges and shown widgets of a card
+        settings = {"shown": [], "ranges": {}}
+        if GPU.pstate:
+            for i,_ in enumerate(GPU.pstate_clock):
                 # GPU
-                self.builder.get_object(f"GPU state {i}").show()
-                self.builder.get_object(f"Pstate voltage {i}").show()
-                self.builder.get_object(f"GPU P Frequency {i}").set_lower(self.GPU.pstate_clockrange[0])
-                self.builder.get_object(f"GPU P Frequency {i}").set_upper(self.GPU.pstate_clockrange[1])
-            for i,_ in enumerate(self.GPU.pmem_clock):
+                settings["shown"] += [f"GPU state {i}", f"Pstate voltage {i}"]
+                settings["ranges"][f"GPU P Frequency {i}"] = (GPU.pstate_clockrange[0], GPU.pstate_clockrange[1])
+            for i,_ in enumerate(GPU.pmem_clock):
                 # MEMORY
-                self.builder.get_object(f"MEM state {i}").show()
-                self.builder.get_object(f"MPstate voltage {i}").show()
-                self.builder.get_object(f"MEM P Frequency {i}").set_lower(self.GPU.pmem_clockrange[0])
-                self.builder.get_object(f"MEM P Frequency {i}").set_upper(self.GPU.pmem_clockrange[1])
+                settings["shown"] += [f"MEM state {i}", f"MPstate voltage {i}"]
+                settings["ranges"][f"MEM P Frequency {i}"] = (GPU.pmem_clockrange[0], GPU.pmem_clockrange[1])
+        if GPU.power_cap is not None:
+            settings["ranges"]["Pow Target Slider"] = (GPU.power_cap_min, GPU.power_cap_max)
+        if not None in GPU.fan_target:
+            for target in ["Min", "Target"]:
+                settings["ranges"][f"FAN RPM {target}"] = (GPU.fan_target_range[0], GPU.fan_target_range[1])
+        return settings
 
+    def set_maximum_values(self):
+        # Sets maximum values for all elements and shows relevant sliders
+        settings = self.card_settings[self.cardnr]
+        for name in settings["shown"]:
+            self.builder.get_object(name).show()
+        for name, (lower, upper) in settings["ranges"].items():
+            self.builder.get_object(name).set_lower(lower)
+            self.builder.get_object(name).set_upper(upper)
         if self.GPU.power_cap is not None:
-            self.builder.get_object("Pow Target Slider").set_upper(self.GPU.power_cap_max)
-            self.builder.get_object("Pow Target Slider").set_lower(self.GPU.power_cap_min)
             self.builder.get_object("POW percent switch").set_sensitive(True)
             self.builder.get_object("POW percent label").set_sensitive(True)
-        if not None in self.GPU.fan_target:
-            for target in ["Min", "Target"]:
-                self.builder.get_object(f"FAN RPM {target}").set_lower(self.GPU.fan_target_range[0])
-                self.builder.get_object(f"FAN RPM {target}").set_upper(self.GPU.fan_target_range[1])
 
-    def set_initial_values(self):
-        # Sets values in program as read currently in the system
+    def set_initial_values(self, snapshot):
+        # Sets values in program as read in the system, snapshot is created by GPU.snapshot
         if self.GPU.pstate:
             for i,_ in enumerate(self.GPU.pstate_clock):
                 # GPU
@@ -113,8 +131,8 @@ class Handler:
                 self.builder.get_object(f"MPstate voltage {i}").set_text(str(self.GPU.pmem_voltage[i]))
 
         # Frequency sliders
-        self.builder.get_object("GPU Target").set_value(self.GPU.read_sensor("pp_sclk_od"))
-        self.builder.get_object("MEM Target").set_value(self.GPU.read_sensor("pp_mclk_od"))
+        self.builder.get_object("GPU Target").set_value(snapshot["sclk_od"])
+        self.builder.get_object("MEM Target").set_value(snapshot["mclk_od"])
 
         if self.GPU.power_cap is not None:
             self.builder.get_object("Pow Target").set_value(self.GPU.power_cap)
@@ -125,7 +143,7 @@ class Handler:
 
         # Manual/auto switches and run associated functions
         # TODO: possible to read manual states separately?
-        manual_mode = self.GPU.read_sensor("power_dpm_force_performance_level") == "manual"
+        manual_mode = snapshot["manual_mode"]
 
 
         if self.GPU.pstate:
@@ -210,20 +228,28 @@ class Handler:
         return state
 
     def update_gui(self):
-        # Update gui with new GPU values
+        # Update gui with new GPU values, only used at startup before the refresh thread runs
         self.GPU.get_currents()
-        self.builder.get_object("Current GPU Speed").set_text(f"Current speed\n {self.GPU.gpu_clock} MHz\n(State: {self.GPU.gpu_state})")
-        self.builder.get_object("Current MEM Speed").set_text(f"Current speed\n {self.GPU.mem_clock} MHz\n(State: {self.GPU.mem_state})")
-        self.builder.get_object("Current FAN Speed").set_text(f"Current speed\n {self.GPU.fan_speed} RPM")
-        if self.GPU.temperature != 'N/A':
-            self.builder.get_object("Current TEMP").set_text("Current temperature\n %.1f °C" % self.GPU.temperature)
+        self.update_labels(self.GPU.snapshot())
+
+    def update_labels(self, snapshot):
+        # Only updates the widgets, snapshot is created by GPU.snapshot (in the refresh thread)
+        if self.values_pending and snapshot["cardpath"] == self.GPU.cardpath:
+            # first snapshot after changing cards or reverting, the settings may have changed since the last one
+            self.values_pending = False
+            self.set_initial_values(snapshot)
+        self.builder.get_object("Current GPU Speed").set_text(f"Current speed\n {snapshot['gpu_clock']} MHz\n(State: {snapshot['gpu_state']})")
+        self.builder.get_object("Current MEM Speed").set_text(f"Current speed\n {snapshot['mem_clock']} MHz\n(State: {snapshot['mem_state']})")
+        self.builder.get_object("Current FAN Speed").set_text(f"Current speed\n {snapshot['fan_speed']} RPM")
+        if snapshot['temperature'] != 'N/A':
+            self.builder.get_object("Current TEMP").set_text("Current temperature\n %.1f °C" % snapshot['temperature'])
         else:
             self.builder.get_object("Current TEMP").set_text("Current temperature\n N/A °C")
 
-        self.builder.get_object("GPU utilisation").set_fraction(self.GPU.gpu_clock_utilisation)
-        self.builder.get_object("MEM utilisation").set_fraction(self.GPU.mem_utilisation)
-        self.builder.get_object("FAN utilisation").set_fraction(self.GPU.fan_speed_utilisation)
-        self.builder.get_object("Temp utilisation").set_fraction(self.GPU.temp_utilisation)
+        self.builder.get_object("GPU utilisation").set_fraction(snapshot['gpu_clock_utilisation'])
+        self.builder.get_object("MEM utilisation").set_fraction(snapshot['mem_utilisation'])
+        self.builder.get_object("FAN utilisation").set_fraction(snapshot['fan_speed_utilisation'])
+        self.builder.get_object("Temp utilisation").set_fraction(snapshot['temp_utilisation'])
 
     def set_Slider(self, slider):
         # Run after user used a slider for GPU/MEM states
@@ -477,11 +503,14 @@ class Handler:
         print("You can find the settings that would be written in \"Set_WattmanGTK_Settings.sh\" file. ")
         print("To apply this file you first have to make it executable, by using \"chmod +x Set_WattmanGTK_Settings.sh\" (without quotes)")
         print("Then to actually apply the settings type in the terminal here \"sudo ./Set_WattmanGTK_Settings.sh\" (without quotes) ")
+        print(f"The settings are also stored in \"{PROFILEFILE}\", which can be restored at boot by running")
+        print(f"\"sudo wattmanGTK-restore {PROFILEFILE}\" (without quotes), only values that differ are written")
         print("Please note that this may damage your graphics card, so use at your own risk!")
         print("------------------ CAUTION ---------------")
         print("\n\n\n\n")
         outputfile = open("Set_WattmanGTK_Settings.sh","w+")
         outputfile.write("#!/bin/bash\n")
+        profile = {"hwmon": {}}
         if self.new_state['manual_mode']:
             mode = "manual"
         else:
@@ -489,6 +518,7 @@ class Handler:
 
         # Powermode
         outputfile.write(f"echo \"{mode}\" > {self.GPU.cardpath}/power_dpm_force_performance_level\n" )
+        profile["power_dpm_force_performance_level"] = mode
 
         # Powercap
         if self.new_state['POW auto switch']:
@@ -497,6 +527,7 @@ class Handler:
             else:
                 new_power_cap = self.new_state['Pow Target Slider']
             outputfile.write(f"echo {new_power_cap * 1000000} > {self.GPU.hwmonpath}{self.GPU.sensors['power']['1']['cap']['path']} \n")
+            profile["hwmon"][self.GPU.sensors['power']['1']['cap']['path']] = new_power_cap * 1000000
 
         # GPU P states
         sclocks = []
@@ -537,25 +568,31 @@ class Handler:
                 #   "s state clock voltage"
                 # echo "s 0 300 750" > /sys/class/drm/card0/device/pp_od_clk_voltage
                 outputfile.write(f"echo \"s {i} {clock} {voltage}\" > {self.GPU.cardpath}/pp_od_clk_voltage \n")
+            profile["pstates"] = [[clock, voltage] for clock, voltage in zip(sclocks, svoltages)]
 
         if write_new_pmemstates:
             for i, clock, voltage in zip(range(len(self.GPU.pmem_clock)), mclocks, mvoltages):
                 #   "m state clock voltage"
                 # echo "m 0 300 750" > /sys/class/drm/card0/device/pp_od_clk_voltage
                 outputfile.write(f"echo \"m {i} {clock} {voltage}\" > {self.GPU.cardpath}/pp_od_clk_voltage \n")
+            profile["pmemstates"] = [[clock, voltage] for clock, voltage in zip(mclocks, mvoltages)]
 
         if write_new_pstates or write_new_pmemstates:
             outputfile.write(f"echo \"c\" > {self.GPU.cardpath}/pp_od_clk_voltage\n")
 
         # GPU % overclock
         SCLK_OD = self.new_state['GPU Target']
-        if not self.builder.get_object("GPU Frequency auto switch").get_state() and (SCLK_OD != self.GPU.read_sensor("pp_sclk_od")):
-            outputfile.write(f"echo {SCLK_OD} > {self.GPU.cardpath}/pp_sclk_od\n")
+        if not self.builder.get_object("GPU Frequency auto switch").get_state():
+            profile["pp_sclk_od"] = SCLK_OD
+            if SCLK_OD != self.GPU.read_sensor("pp_sclk_od"):
+                outputfile.write(f"echo {SCLK_OD} > {self.GPU.cardpath}/pp_sclk_od\n")
 
         # MEM % overclock
         MCLK_OD = self.new_state['MEM Target']
-        if not self.builder.get_object("MEM Frequency auto switch").get_state() and (MCLK_OD != self.GPU.read_sensor("pp_mclk_od")):
-            outputfile.write(f"echo {MCLK_OD} > {self.GPU.cardpath}/pp_mclk_od\n")
+        if not self.builder.get_object("MEM Frequency auto switch").get_state():
+            profile["pp_mclk_od"] = MCLK_OD
+            if MCLK_OD != self.GPU.read_sensor("pp_mclk_od"):
+                outputfile.write(f"echo {MCLK_OD} > {self.GPU.cardpath}/pp_mclk_od\n")
 
         # Fan mode
         Fan_mode = "manual" if self.new_state['FAN auto switch'] else "auto"
@@ -563,14 +600,38 @@ class Handler:
             [outputfile.write(f"echo 2 > {self.GPU.hwmonpath}{self.GPU.sensors['pwm'][k]['enable']['path']}\n") for k in self.GPU.sensors['pwm'].keys()]
         elif Fan_mode == "manual" and not all(self.GPU.fan_control_value[:] == 1):
             [outputfile.write(f"echo 1 > {self.GPU.hwmonpath}{self.GPU.sensors['pwm'][k]['enable']['path']}\n") for k in self.GPU.sensors['pwm'].keys()]
-
+        if not None in self.GPU.fan_control_value:
+            for k in self.GPU.sensors['pwm'].keys():
+                profile["hwmon"][self.GPU.sensors['pwm'][k]['enable']['path']] = 1 if Fan_mode == "manual" else 2
 
         outputfile.close()
+        save_profile(PROFILEFILE, self.GPU.cardpath, profile)
+        if len(self.GPUs) > 1:
+            # Same settings on the other cards, written in parallel by wattmanGTK-restore
+            others = []
+            for i, card in enumerate(self.GPUs):
+                if card is self.GPU:
+                    continue
+                power_cap_range = [card.power_cap_min * 1000000, card.power_cap_max * 1000000] if card.power_cap is not None else []
+                errors = validate_profile(profile, {"pstate_clockrange": card.pstate_clockrange, "pmem_clockrange": card.pmem_clockrange,
+                                                    "volt_range": card.volt_range, "power_cap_range": power_cap_range},
+                                          {"pstates": card.pstate_clock, "pmemstates": card.pmem_clock})
+                if len(errors) == 0:
+                    others.append(card.cardpath)
+                else:
+                    print(f"These settings cannot be used for card {i+1} ({card.fancyname}): {', '.join(errors)}")
+            if len(others) > 0:
+                valid = [self.GPU.cardpath] + others
+                print(f"To apply these settings to all valid cards at once, run \"sudo wattmanGTK-restore --card {self.GPU.cardpath} --apply-to {','.join(valid)} {PROFILEFILE}\" (without quotes)")
         exit()
 
     def revert(self, button):
         # On pressing revert button
-        self.set_initial_values()
+        with self.plot.lock:
+            snapshot = self.GPU.snapshot()
+        self.set_initial_values(snapshot)
+        self.values_pending = True
+        self.refresh_requested.set()
 
     def on_menu_about_clicked(self, menuitem):
         # On pressing about menu item
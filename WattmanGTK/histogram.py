@@ -0,0 +1,73 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import numpy as np
+
+
+class Histogram:
+    # Fixed number of equal bins which grows its range when a value falls outside,
+    # by merging pairs of bins, so memory stays the same for any session length.
+    # Adding a value is O(1) (a range doubling is O(bins), but happens at most a
+    # few dozen times per session), percentiles are O(bins).
+    def __init__(self, bins=1024):
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.low = None     # lower edge of the first bin
+        self.width = None   # width of a bin
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        if value is None or not math.isfinite(value):
+            return
+        if self.low is None:
+            # start with a resolution of about 1/1000 of the first value, centred on it
+            exponent = math.floor(math.log2(abs(value))) - 10 if value != 0 else -10
+            self.width = 2.0 ** exponent
+            self.low = math.floor(value / self.width) * self.width - len(self.counts) // 2 * self.width
+        while value < self.low or value >= self.low + self.width * len(self.counts):
+            self.grow(value < self.low)
+        # clamped, the division can round a value just below the upper edge up to the next bin
+        self.counts[min(int((value - self.low) / self.width), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def grow(self, downwards):
+        # Doubles the bin width, the old range becomes the upper (downwards) or lower half
+        bins = len(self.counts)
+        merged = self.counts.reshape(-1, 2).sum(axis=1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        if downwards:
+            self.counts[bins // 2:] = merged
+            self.low -= self.width * bins
+        else:
+            self.counts[:bins // 2] = merged
+        self.width *= 2
+
+    def percentile(self, percent):
+        # Value below which percent of the values are, interpolated within the bin
+        if self.count == 0:
+            return None
+        target = percent / 100 * self.count
+        cumulative = np.cumsum(self.counts)
+        index = min(int(np.searchsorted(cumulative, target)), len(self.counts) - 1)
+        before = cumulative[index - 1] if index > 0 else 0
+        fraction = (target - before) / self.counts[index] if self.counts[index] > 0 else 0
+        # clipped, so a signal which only has a few discrete values gives exactly those
+        return min(max(self.low + (index + fraction) * self.width, self.minimum), self.maximum)
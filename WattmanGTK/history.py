@@ -0,0 +1,226 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Lossless compressed history of a signal, for retention windows of millions
+# of samples. Samples are appended to an uncompressed chunk, full chunks are
+# encoded with the smallest of:
+#
+#   int     values in the smallest integer dtype which holds them
+#   delta   first value and the differences, e.g. timestamps or slow temperatures
+#   rle     value and length of each run, e.g. DPM states or a fixed fan speed
+#   float   float32 when that is exact, otherwise float64 (fallback)
+#
+# Values with up to 6 decimals (e.g. 45.123 W) are stored as integers times
+# 10^-decimals, which is only used when decoding gives exactly the same floats.
+# Run "python3 -m WattmanGTK.history" to see the bytes per sample of typical signals.
+#
+# The GUI only uses stats() for the min, mean and max in the table. They are
+# copied with the rest of a signal in Plot.snapshot under the plot lock, so the
+# refresh thread does not append while they are computed. The plot itself still
+# draws the points of its own window, get() decodes the samples for other uses.
+
+import time
+from optparse import OptionParser
+import numpy as np
+
+int_dtypes = [np.int8, np.int16, np.int32, np.int64]
+
+
+def compact(values):
+    # values (integers) in the smallest signed dtype which holds them
+    if len(values) == 0:
+        return values.astype(np.int8)
+    low, high = values.min(), values.max()
+    for dtype in int_dtypes:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+
+
+def nbytes(encoded):
+    return sum(part.nbytes for part in encoded[2:] if isinstance(part, np.ndarray))
+
+
+def run_starts(changed):
+    # outputs: index of the first value of every run, changed[i] is True when value i+1 differs from value i
+    return np.concatenate(([0], np.flatnonzero(changed) + 1))
+
+
+def encode_ints(values, decimals=0):
+    # outputs: smallest encoding of integer values as (kind, decimals, arrays...)
+    candidates = [("int", decimals, compact(values)),
+                  ("delta", decimals, int(values[0]), compact(np.diff(values)))]
+    starts = run_starts(values[1:] != values[:-1])
+    if len(starts) < len(values) // 2:
+        candidates.append(("rle", decimals, compact(values[starts]), compact(np.diff(np.append(starts, len(values))))))
+    return min(candidates, key=nbytes)
+
+
+def find_decimals(values):
+    # outputs: smallest number of decimals which represents all values exactly, None if there is none up to 6
+    if not np.all(np.isfinite(values)):
+        return None
+    for decimals in range(7):
+        scaled = np.round(values * 10.0 ** decimals)
+        if np.max(np.abs(scaled), initial=0) >= 2 ** 53:
+            return None
+        if np.array_equal(scaled / 10.0 ** decimals, values):
+            return decimals
+    return None
+
+
+def encode(values):
+    # outputs: smallest lossless encoding of float64 values
+    decimals = find_decimals(values)
+    if decimals is not None:
+        return encode_ints(np.round(values * 10.0 ** decimals).astype(np.int64), decimals)
+    with np.errstate(over="ignore"):
+        # values out of the float32 range become inf and are then not exact
+        single = values.astype(np.float32)
+    exact = np.all((single == values) | np.isnan(values))
+    candidates = [("float", None, single if exact else values.copy())]
+    # NaN runs, e.g. while the card is suspended, NaN is not equal to itself
+    changed = (values[1:] != values[:-1]) & ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+    starts = run_starts(changed)
+    if len(starts) < len(values) // 2:
+        runs = values[starts]
+        candidates.append(("rle", None, runs.astype(np.float32) if exact else runs, compact(np.diff(np.append(starts, len(values))))))
+    return min(candidates, key=nbytes)
+
+
+def decode(encoded):
+    kind, decimals = encoded[:2]
+    if kind == "int" or kind == "float":
+        values = encoded[2].astype(np.float64)
+    elif kind == "delta":
+        values = encoded[2] + np.concatenate(([0], np.cumsum(encoded[3], dtype=np.int64))).astype(np.float64)
+    else:
+        values = np.repeat(encoded[2], encoded[3].astype(np.int64)).astype(np.float64)
+    if decimals:
+        values /= 10.0 ** decimals
+    return values
+
+
+def decode_times(encoded):
+    # timestamps are integer ns, decoded without going through float64
+    kind = encoded[0]
+    if kind == "int":
+        return encoded[2].astype(np.int64)
+    elif kind == "delta":
+        return encoded[2] + np.concatenate(([0], np.cumsum(encoded[3], dtype=np.int64)))
+    return np.repeat(encoded[2].astype(np.int64), encoded[3].astype(np.int64))
+
+
+def chunk_stats(values):
+    # outputs: [minimum, maximum, sum, count] of the values which are not NaN
+    finite = values[~np.isnan(values)]
+    if len(finite) == 0:
+        return [np.nan, np.nan, 0.0, 0]
+    return [finite.min(), finite.max(), finite.sum(), len(finite)]
+
+
+class History:
+    # Keeps at least maxsamples samples (None for the whole session), whole chunks are dropped
+    # when older. The statistics of a chunk are computed when it is encoded, so stats() does
+    # not decode anything.
+    def __init__(self, maxsamples=None, chunksize=4096):
+        self.maxsamples = maxsamples
+        self.chunksize = chunksize
+        self.chunks = []    # (encoded times, encoded values, stats, length), oldest first
+        self.times = np.empty(chunksize, dtype=np.int64)    # newest chunk, not encoded
+        self.values = np.empty(chunksize, dtype=np.float64)
+        self.count = 0      # samples in the newest chunk
+        self.length = 0     # samples in the encoded chunks
+
+    def __len__(self):
+        return self.length + self.count
+
+    def append(self, timestamp, value):
+        self.times[self.count] = timestamp
+        self.values[self.count] = np.nan if value is None else value
+        self.count += 1
+        if self.count == self.chunksize:
+            self.chunks.append((encode_ints(self.times), encode(self.values), chunk_stats(self.values), self.count))
+            self.length += self.count
+            self.count = 0
+            while self.maxsamples is not None and len(self.chunks) > 0 and self.length - self.chunks[0][3] >= self.maxsamples:
+                self.length -= self.chunks.pop(0)[3]
+
+    def nbytes(self):
+        # memory used by the samples, the newest chunk counts as full
+        return sum(nbytes(times) + nbytes(values) for times, values, _, _ in self.chunks) + self.times.nbytes + self.values.nbytes
+
+    def get(self, last=None):
+        # outputs: timestamps (time.monotonic_ns()) and values of the last samples, all when last is None
+        last = len(self) if last is None else min(last, len(self))
+        times = [self.times[:self.count]]
+        values = [self.values[:self.count]]
+        needed = last - self.count
+        for chunk in reversed(self.chunks):
+            if needed <= 0:
+                break
+            times.insert(0, decode_times(chunk[0]))
+            values.insert(0, decode(chunk[1]))
+            needed -= chunk[3]
+        skip = sum(len(part) for part in times) - last
+        return np.concatenate(times)[skip:], np.concatenate(values)[skip:]
+
+    def stats(self):
+        # outputs: minimum, mean and maximum of all kept samples without NaN, NaN when there are none
+        stats = [chunk[2] for chunk in self.chunks] + [chunk_stats(self.values[:self.count])]
+        count = sum(stat[3] for stat in stats)
+        if count == 0:
+            return np.nan, np.nan, np.nan
+        minimum = min(stat[0] for stat in stats if stat[3] > 0)
+        maximum = max(stat[1] for stat in stats if stat[3] > 0)
+        return minimum, sum(stat[2] for stat in stats) / count, maximum
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--samples", help="samples per signal", metavar="number", default=1000000, type="int")
+    parser.add_option("--chunk", help="samples per chunk", metavar="number", default=4096, type="int")
+    (options, _) = parser.parse_args()
+
+    # typical signals at 1 Hz with some jitter on the timestamps
+    rng = np.random.default_rng(0)
+    n = options.samples
+    times = np.cumsum(1_000_000_000 + rng.integers(-200_000, 200_000, n))
+    states = np.repeat(rng.integers(0, 8, n // 20 + 1), 20)[:n]
+    signals = {"DPM state": states.astype(float),
+               "GPU clock [MHz]": np.array([300, 600, 900, 1200, 1350, 1500, 1600, 1700], dtype=float)[states],
+               "Fan PWM": np.repeat(rng.integers(60, 256, n // 300 + 1), 300)[:n].astype(float),
+               "Temperature [°C]": np.round(60 + 10 * np.sin(np.arange(n) / 600) + rng.normal(0, 0.3, n)),
+               "Power [W]": np.round(120 + 60 * np.sin(np.arange(n) / 60) + rng.normal(0, 2, n), 3),
+               "Noise (float64)": rng.normal(0, 1, n)}
+    print(f"{'Signal':<18} {'Bytes/sample':>12} {'MB':>8} {'Raw MB':>8} {'Append [us]':>12} {'Decode [ms]':>12}")
+    for name, values in signals.items():
+        history = History(chunksize=options.chunk)
+        start = time.perf_counter()
+        for timestamp, value in zip(times.tolist(), values.tolist()):
+            history.append(timestamp, value)
+        append = (time.perf_counter() - start) / n * 1e6
+        start = time.perf_counter()
+        decoded_times, decoded = history.get()
+        decodetime = (time.perf_counter() - start) * 1000
+        if not (np.array_equal(decoded_times, times) and np.array_equal(decoded, values)):
+            print(f"{name} is not decoded exactly")
+            exit(1)
+        print(f"{name:<18} {history.nbytes() / n:>12.2f} {history.nbytes() / 2 ** 20:>8.2f} {16 * n / 2 ** 20:>8.2f} {append:>12.2f} {decodetime:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Saving and restoring of overclock profiles, used for reboot persistance.
+# This module must not import GTK or matplotlib, so it can run from a boot
+# script (e.g. a systemd unit) as fast as possible.
+
+import re
+import os
+import glob
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+from WattmanGTK.util import read, write
+
+PROFILEFILE = "WattmanGTK_profile.json"
+CARDPATH = "/sys/class/drm/card?/device"
+
+# A card profile is a dict with the following (all optional) keys:
+#   "power_dpm_force_performance_level": "manual" or "auto"
+#   "pstates":     [[clock, voltage], ...]  GPU P states written with "s"
+#   "pmemstates":  [[clock, voltage], ...]  Memory P states written with "m"
+#   "pp_sclk_od":  GPU percentage overclock
+#   "pp_mclk_od":  Memory percentage overclock
+#   "hwmon":       {"/power1_cap": value, "/pwm1_enable": value, ...}
+# A profile file maps the cardpath to its card profile.
+
+
+def read_od_states(cardpath):
+    # Reads the current P states from pp_od_clk_voltage
+    # outputs: {"pstates": [[clock, voltage], ...], "pmemstates": [[clock, voltage], ...]}
+    states = {"pstates": [], "pmemstates": []}
+    state_pattern = r"^(\d):\s{1,}(\d{1,})(MHz|Mhz)\s{1,}(\d{1,})mV$"
+    try:
+        with open(cardpath + "/pp_od_clk_voltage") as pp_od_clk_voltage:
+            current = None
+            for line in pp_od_clk_voltage:
+                line = line.strip()
+                if line == "OD_SCLK:":
+                    current = "pstates"
+                elif line == "OD_MCLK:":
+                    current = "pmemstates"
+                elif line.endswith(":"):
+                    current = None
+                elif current is not None:
+                    match = re.match(state_pattern, line)
+                    if match:
+                        states[current].append([int(match.group(2)), int(match.group(4))])
+    except OSError:
+        pass
+    return states
+
+
+def read_od_ranges(cardpath):
+    # Reads the allowed ranges from the OD_RANGE section of pp_od_clk_voltage
+    # outputs: {"pstate_clockrange": [min, max], "pmem_clockrange": [min, max], "volt_range": [min, max]}
+    #          as the same attributes of GPU, empty lists when not available
+    ranges = {"pstate_clockrange": [], "pmem_clockrange": [], "volt_range": []}
+    names = {"SCLK": "pstate_clockrange", "MCLK": "pmem_clockrange", "VDDC": "volt_range"}
+    range_pattern = r"^(SCLK|MCLK|VDDC):\s{1,}(\d{1,})(MHz|Mhz|mV)\s{1,}(\d{1,})(MHz|Mhz|mV)$"
+    try:
+        with open(cardpath + "/pp_od_clk_voltage") as pp_od_clk_voltage:
+            reading = False
+            for line in pp_od_clk_voltage:
+                line = line.strip()
+                if line.endswith(":"):
+                    reading = line == "OD_RANGE:"
+                elif reading:
+                    match = re.match(range_pattern, line)
+                    if match:
+                        ranges[names[match.group(1)]] = [int(match.group(2)), int(match.group(4))]
+    except OSError:
+        pass
+    return ranges
+
+
+def read_power_cap_range(hwmonpath):
+    # outputs: [min, max] of power1_cap in microwatt, empty list when not available
+    if hwmonpath == '':
+        return []
+    try:
+        return [read(hwmonpath + "/power1_cap_min"), read(hwmonpath + "/power1_cap_max")]
+    except OSError:
+        return []
+
+
+def validate_profile(cardprofile, ranges, states=None):
+    # Checks the P states of a profile against the ranges of a card (see read_od_ranges)
+    # and, when states is given, against its number of P states
+    # The power cap is checked against ranges["power_cap_range"] (see read_power_cap_range)
+    # outputs: list of errors, empty when the profile can be applied
+    errors = []
+    for key, clockrange in [("pstates", "pstate_clockrange"), ("pmemstates", "pmem_clockrange")]:
+        profilestates = cardprofile.get(key, [])
+        if len(profilestates) == 0:
+            continue
+        if len(ranges[clockrange]) != 2 or len(ranges["volt_range"]) != 2:
+            errors.append(f"{key}: card reports no OD_RANGE to check against")
+            continue
+        if states is not None and len(profilestates) > len(states[key]):
+            errors.append(f"{key}: profile has {len(profilestates)} states, card has {len(states[key])}")
+        for i, (clock, voltage) in enumerate(profilestates):
+            if not ranges[clockrange][0] <= clock <= ranges[clockrange][1]:
+                errors.append(f"{key} {i}: {clock} MHz outside {ranges[clockrange][0]}-{ranges[clockrange][1]} MHz")
+            if not ranges["volt_range"][0] <= voltage <= ranges["volt_range"][1]:
+                errors.append(f"{key} {i}: {voltage} mV outside {ranges['volt_range'][0]}-{ranges['volt_range'][1]} mV")
+    power_cap = cardprofile.get("hwmon", {}).get("/power1_cap")
+    if power_cap is not None:
+        power_cap_range = ranges.get("power_cap_range", [])
+        if len(power_cap_range) != 2:
+            errors.append("power1_cap: card reports no power cap range to check against")
+        elif not power_cap_range[0] <= power_cap <= power_cap_range[1]:
+            errors.append(f"power1_cap: {power_cap / 1000000:g} W outside {power_cap_range[0] / 1000000:g}-{power_cap_range[1] / 1000000:g} W")
+    return errors
+
+
+def find_cards():
+    # Resolved sysfs paths of all cards with overdrive, as used in profiles
+    cardpaths = [os.path.realpath(cardpath) for cardpath in sorted(glob.glob(CARDPATH))]
+    return [cardpath for cardpath in cardpaths if os.path.isfile(cardpath + "/pp_od_clk_voltage")]
+
+
+def find_hwmonpath(cardpath):
+    hwmonpaths = glob.glob(cardpath + "/hwmon/hwmon*")
+    if len(hwmonpaths) == 0:
+        return ''
+    return hwmonpaths[0]
+
+
+def load_profiles(filename):
+    with open(filename) as profilefile:
+        return json.load(profilefile)
+
+
+def save_profile(filename, cardpath, cardprofile):
+    # Stores the profile of one card, keeps profiles of other cards in the file
+    profiles = {}
+    if os.path.isfile(filename):
+        profiles = load_profiles(filename)
+    profiles[cardpath] = cardprofile
+    with open(filename, "w") as profilefile:
+        json.dump(profiles, profilefile, indent=4, sort_keys=True)
+
+
+def read_current(path):
+    try:
+        return read(path)
+    except OSError:
+        return None
+
+
+def restore_card(cardpath, cardprofile, dry_run=False):
+    # Restores a single card, only writes values which differ from the current state
+    # Nothing is written when the profile does not fit the card (see validate_profile)
+    # outputs: dict with cardpath, writes, skipped, errors and time [s]
+    start = time.perf_counter()
+    result = {"cardpath": cardpath, "writes": [], "skipped": 0, "errors": [], "time": 0}
+    current_states = read_od_states(cardpath)
+    hwmonpath = find_hwmonpath(cardpath)
+    ranges = read_od_ranges(cardpath)
+    ranges["power_cap_range"] = read_power_cap_range(hwmonpath)
+    result["errors"] = validate_profile(cardprofile, ranges, current_states)
+    if len(result["errors"]) > 0:
+        result["time"] = time.perf_counter() - start
+        return result
+
+    def write_if_changed(path, value, current):
+        if current == value:
+            result["skipped"] += 1
+            return False
+        result["writes"].append(f"\"{value}\" > {path}")
+        if not dry_run:
+            try:
+                write(path, value)
+            except OSError as error:
+                result["errors"].append(f"{path}: {error.strerror}")
+        return True
+
+    level = cardprofile.get("power_dpm_force_performance_level")
+    if level is not None:
+        path = cardpath + "/power_dpm_force_performance_level"
+        write_if_changed(path, level, read_current(path))
+
+    if "pstates" in cardprofile or "pmemstates" in cardprofile:
+        changed = False
+        for key, prefix in [("pstates", "s"), ("pmemstates", "m")]:
+            for i, (clock, voltage) in enumerate(cardprofile.get(key, [])):
+                current_line = None
+                if i < len(current_states[key]):
+                    current_line = f"{prefix} {i} {current_states[key][i][0]} {current_states[key][i][1]}"
+                if write_if_changed(cardpath + "/pp_od_clk_voltage", f"{prefix} {i} {clock} {voltage}", current_line):
+                    changed = True
+        if changed:
+            # Commit the new P states
+            write_if_changed(cardpath + "/pp_od_clk_voltage", "c", None)
+
+    for od in ["pp_sclk_od", "pp_mclk_od"]:
+        if od in cardprofile:
+            path = f"{cardpath}/{od}"
+            write_if_changed(path, cardprofile[od], read_current(path))
+
+    hwmon = cardprofile.get("hwmon", {})
+    if len(hwmon) > 0:
+        if hwmonpath == '':
+            result["errors"].append(f"{cardpath}: cannot find hwmon folder")
+        else:
+            for path, value in sorted(hwmon.items()):
+                write_if_changed(hwmonpath + path, value, read_current(hwmonpath + path))
+
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def restore_profiles(profiles, workers=None, dry_run=False):
+    # Restores all cards in parallel, one worker per card
+    if len(profiles) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or len(profiles)) as executor:
+        futures = [executor.submit(restore_card, cardpath, cardprofile, dry_run)
+                   for cardpath, cardprofile in profiles.items()]
+        return [future.result() for future in futures]
+
+
+def apply_profile(cardpaths, cardprofile, workers=None, dry_run=False):
+    # Applies one profile to many cards in parallel, one worker per card, so the
+    # total time is about that of the slowest card
+    if len(cardpaths) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=workers or len(cardpaths)) as executor:
+        futures = [executor.submit(restore_card, cardpath, cardprofile, dry_run) for cardpath in cardpaths]
+        return [future.result() for future in futures]
+
+
+def print_results(results, total_time):
+    print(f"{'Card':<45} {'Writes':>6} {'Skipped':>7} {'Time [ms]':>9}")
+    for result in results:
+        print(f"{result['cardpath']:<45} {len(result['writes']):>6} {result['skipped']:>7} {result['time']*1000:>9.1f}")
+        for error in result["errors"]:
+            print(f"    Error: {error}")
+    failed = sum(len(result["errors"]) > 0 for result in results)
+    print(f"Restored {len(results)} card(s) in {total_time*1000:.1f} ms" + (f", {failed} with errors" if failed > 0 else ""))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [profile]")
+    parser.add_option("-c", "--card", help="only restore the card with this sysfs path", metavar="path", type="str")
+    parser.add_option("-a", "--apply-to", help="apply the profile of --card (or the only profile in the file) to these cards, "
+                      "comma separated sysfs paths or card numbers, or all", metavar="cards", type="str")
+    parser.add_option("-w", "--workers", help="number of cards restored in parallel", metavar="number", type="int")
+    parser.add_option("-n", "--dry-run", help="only show the values that would be written", action="store_true", default=False)
+    parser.add_option("-v", "--verbose", help="show every value written", action="store_true", default=False)
+    (options, args) = parser.parse_args()
+    filename = args[0] if len(args) > 0 else PROFILEFILE
+
+    try:
+        profiles = load_profiles(filename)
+    except (OSError, ValueError) as error:
+        print(f"Cannot read profile {filename}: {error}")
+        exit(1)
+    if options.card:
+        profiles = {cardpath: cardprofile for cardpath, cardprofile in profiles.items() if cardpath == options.card}
+        if len(profiles) == 0:
+            print(f"No profile for {options.card} in {filename}")
+            exit(1)
+
+    if options.apply_to:
+        if len(profiles) != 1:
+            print(f"{filename} has {len(profiles)} profiles, choose one with --card")
+            exit(1)
+        cardprofile = next(iter(profiles.values()))
+        if options.apply_to == "all":
+            cardpaths = find_cards()
+        else:
+            cardpaths = [os.path.realpath(f"/sys/class/drm/card{card}/device") if card.isdigit() else card
+                         for card in options.apply_to.split(",")]
+        if len(cardpaths) == 0:
+            print("No cards found to apply the profile to")
+            exit(1)
+
+    start = time.perf_counter()
+    if options.apply_to:
+        results = apply_profile(cardpaths, cardprofile, options.workers, options.dry_run)
+    else:
+        results = restore_profiles(profiles, options.workers, options.dry_run)
+    total_time = time.perf_counter() - start
+    if options.verbose or options.dry_run:
+        for result in results:
+            for written in result["writes"]:
+                print(f"echo {written}")
+    print_results(results, total_time)
+    if any(len(result["errors"]) > 0 for result in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,23 +15,29 @@
 # You should have received a copy of the GNU General Public License
 # along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
 
-from matplotlib.figure import Figure        # required for plot
-from matplotlib.ticker import AutoLocator
-from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas # required for GTK3 integration
 import numpy as np  # required for matplotlib data types
+import time
+import threading
 import gi                   # required for GTK3
 gi.require_version("Gtk", "3.0")
 from gi.repository import GLib, Gtk, Gdk
 from WattmanGTK.plotsignal import Plotsignal
-from WattmanGTK.util import read, convert_to_si
+from WattmanGTK.renderer import get_renderer
+from WattmanGTK.derived import create_derived
+from WattmanGTK.histogram import Histogram
+from WattmanGTK.history import History
+from WattmanGTK.sampling import JitterStats
+from WattmanGTK.util import convert_to_si
 
+# period: default sampling period in s, temperatures change slowly and power1_average is averaged by the firmware
 subsystem_unit_color = \
-    {"in": {"unit": "[mV]", "color": "#8c564b"},
-     "fan": {"unit": "[RPM]", "color": "#e377c2"},
-     "temp": {"unit": "[m°C]", "color": "#7f7f7f"},
-     "power": {"unit": "[µW]", "color": "#bcbd22"},
-     "pwm": {"unit":"[0-255]", "color": "#17becf"}}
+    {"in": {"unit": "[mV]", "color": "#8c564b", "period": 0.5},
+     "fan": {"unit": "[RPM]", "color": "#e377c2", "period": 1},
+     "temp": {"unit": "[m°C]", "color": "#7f7f7f", "period": 1},
+     "power": {"unit": "[µW]", "color": "#bcbd22", "period": 1},
+     "pwm": {"unit":"[0-255]", "color": "#17becf", "period": 1}}
 sensors_to_plot = ["pwm", "input", "average"] #sensors to plot if string is subset, examples: temp1_input power1_average
+sample_tolerance = 0.002 # s, signals due within this time are sampled together
 disable_plots_if_scaling_error = False #True: Disable plots when scaling has errors False: keeps unnormalised plots
 
 
@@ -40,7 +46,7 @@ class Plot:
     # TODO tighter fit of plot
     # TODO BUG: weird redrawing issue on changing panes, probably should not redraw graph on changing panes
     # Plot object used GUI
-    def __init__(self,builder,GPUs,maxpoints,precision,linux_kernelmain,linux_kernelsub):
+    def __init__(self,builder,GPUs,maxpoints,precision,linux_kernelmain,linux_kernelsub,renderer="matplotlib",refreshtime=1,periods=None,bursts=None,percentiles=None,history=0,plot_span=0):
         # Can used for kernel specific workarounds
         self.linux_kernelmain = linux_kernelmain
         self.linux_kernelsub = linux_kernelsub
@@ -50,12 +56,33 @@ class Plot:
         self.GPUs = GPUs
         self.GPU = GPUs[0]
         self.maxpoints = maxpoints
-        self.fig = Figure(figsize=(1000, 150), dpi=100, facecolor="#00000000")
-        self.fig.set_tight_layout(True)
-        self.ax = self.fig.add_subplot(111)
+        # Every signal has its own sampling period, the plot shows the same time span of maxpoints refreshes for all
+        self.refreshtime = refreshtime
+        self.periods = periods or {}    # overrides by signal name, sensor file or subsystem
+        self.bursts = bursts or {}      # burst periods by signal name, sensor file or subsystem
+        self.next_sample = 0            # time.monotonic() at which the next signal is due
         # enable, name, unit, mean, max, current
-        self.signalstore = Gtk.ListStore(bool, bool, bool, str, str, str, str, str, str, str)
-        self.Plotsignals = self.init_signals(self.GPU)
+        # percentile columns follow, e.g. [5, 50, 99], computed from a histogram of the whole session
+        self.percentiles = percentiles or []
+        self.history = history  # samples kept per signal in a compressed history, 0 for none
+        self.plot_span = plot_span  # time span [s] plotted from the history, 0 for maxpoints refreshes
+        self.sinks = []     # e.g. recorders, which receive the samples of all cards
+        self.lock = threading.Lock()    # sampling in the refresh thread vs changing GPU
+        self.jitter = None  # sampling jitter summary shown below the plot
+        self.scheduled = set()  # signals sampled by the last wakeup, only their reads are on schedule for the jitter
+        # Set from GTK signals and read by the refresh thread, nothing is drawn or sampled for the screen when hidden
+        self.iconified = False
+        self.window_visible = True  # window is mapped and not minimised
+        self.plot_visible = True    # plot area is mapped and not collapsed
+        self.lanes_changed = [None] * len(GPUs)     # GPU.lanes_changed when the periods of the card were set
+        self.suspended_spans = [[] for _ in GPUs]  # [start, end] in time.monotonic_ns() per card, end None while suspended
+        # Signals and models of every card are created at startup, changing cards only swaps them,
+        # so the GTK main thread never reads sysfs of a card which was not shown yet
+        self.GPUsignals = [self.create_signals(cardnr) for cardnr in range(len(GPUs))]
+        self.signalstores = [self.create_signalstore(cardnr) for cardnr in range(len(GPUs))]
+        self.Plotsignals = self.GPUsignals[0]
+        self.signalstore = self.signalstores[0]
+        self.view = self.snapshot()  # copy of the shown signals, drawn by the GTK main thread
 
         # Set top panel height in accordance to number of signals (with saturation)
         height_top_panel = len(self.Plotsignals)*32.5
@@ -68,19 +95,106 @@ class Plot:
 
         self.init_treeview()
         self.update_signals()
-        self.canvas = FigureCanvas(self.fig)
-        self.canvas.set_size_request(1000, 150)
+        self.renderer = get_renderer(renderer)()
         self.object = self.builder.get_object("matplot")
-        self.object.add(self.canvas)
+        self.object.add(self.renderer.widget)
         self.object.show_all()
 
+        self.window = self.builder.get_object("Wattman")
+        self.window.connect("window-state-event", self.on_window_state)
+        for widget in [self.window, self.object]:
+            widget.connect("map", self.on_visibility_changed)
+            widget.connect("unmap", self.on_visibility_changed)
+        self.object.connect("size-allocate", self.on_visibility_changed)
+
     def change_GPU(self,cardnr):
         print(f"Changing plot to GPU {self.GPUs[cardnr].fancyname}")
-        self.GPU = self.GPUs[cardnr]
-        self.Plotsignals = self.init_signals(self.GPU)
-        self.init_treeview()
+        with self.lock:
+            self.GPU = self.GPUs[cardnr]
+            self.Plotsignals = self.GPUsignals[cardnr]
+            self.signalstore = self.signalstores[cardnr]
+        self.view = self.snapshot()
+        self.tree.set_model(self.signalstore)
         self.update_signals()
 
+    def create_signals(self, cardnr):
+        # Plotsignals of a card are only created once, so history is kept when changing cards
+        self.GPUs[cardnr].get_currents()
+        Plotsignals = self.init_signals(self.GPUs[cardnr])
+        self.lanes_changed[cardnr] = self.GPUs[cardnr].lanes_changed
+        for Plotsignal in Plotsignals:
+            Plotsignal.cardnr = cardnr
+            self.set_period(Plotsignal)
+            Plotsignal.burst = self.get_burst(Plotsignal)
+            Plotsignal.jitter = JitterStats(Plotsignal.burst or Plotsignal.period)
+            if len(self.percentiles) > 0:
+                Plotsignal.histogram = Histogram()
+            if self.history > 0:
+                Plotsignal.history = History(self.history)
+        return Plotsignals
+
+    def create_signalstore(self, cardnr):
+        # Like the Plotsignals, the model of a card is created once and kept when changing cards
+        signalstore = Gtk.ListStore(*[bool, bool, bool, str, str, str, str, str, str, str] + [str] * len(self.percentiles))
+        for plotsignal in self.GPUsignals[cardnr]:
+            signalstore.append(self.signal_row(plotsignal))
+        return signalstore
+
+    def get_period(self, Plotsignal):
+        # Overrides by signal name, sensor file or subsystem, otherwise the subsystem default
+        # Defaults are never faster than the refresh rate
+        keys = Plotsignal.get_keys()
+        for key in keys:
+            if key in self.periods:
+                return self.periods[key]
+        if keys[-1] is not None:
+            return max(subsystem_unit_color[keys[-1]]["period"], self.refreshtime)
+        return self.refreshtime
+
+    def set_period(self, Plotsignal):
+        # Period of get_period, slow_period times longer while the sensor file is in the slow lane of its card
+        GPU = self.GPUs[Plotsignal.cardnr]
+        period = self.get_period(Plotsignal)
+        slow = GPU.signal_path(Plotsignal.sensorpath) in GPU.slow_paths
+        if slow:
+            period *= GPU.slow_period()
+        if period != Plotsignal.period and (slow or Plotsignal.period is not None):
+            print(f"{Plotsignal.name} is {'slow' if slow else 'fast again'} to read, sampled every {period:g} s")
+        Plotsignal.period = period
+
+    def update_periods(self):
+        # Follows the lanes of the cards, which are updated every slow_lane refreshes (see GPU.update_lanes)
+        for cardnr, GPU in enumerate(self.GPUs):
+            if self.lanes_changed[cardnr] != GPU.lanes_changed:
+                self.lanes_changed[cardnr] = GPU.lanes_changed
+                for Plotsignal in self.GPUsignals[cardnr]:
+                    if not Plotsignal.derived:
+                        self.set_period(Plotsignal)
+
+    def get_burst(self, Plotsignal):
+        # Burst period of the signal, None when not selected or not faster than its period
+        for key in Plotsignal.get_keys():
+            if key in self.bursts:
+                return self.bursts[key] if self.bursts[key] < Plotsignal.period else None
+        return None
+
+    def history_points(self, Plotsignal):
+        # Number of samples of a signal which span maxpoints refreshes
+        return max(2, int(round(self.maxpoints * self.refreshtime / Plotsignal.period)))
+
+    def plot_points(self, Plotsignal):
+        # outputs: timestamps and values to plot and the envelope, the last plot_span s are decoded from the
+        # compressed history, which only has the mean of burst periods
+        if self.plot_span > 0 and Plotsignal.history is not None and len(Plotsignal.history) > 0:
+            times, data = Plotsignal.history.get(max(2, int(round(self.plot_span / Plotsignal.period))))
+            return times, data, None
+        envelope = Plotsignal.get_envelope()
+        return Plotsignal.times.copy(), Plotsignal.get_values().copy(), None if envelope is None else (envelope[0].copy(), envelope[1].copy())
+
+    def add_sink(self, sink):
+        # Sinks receive the samples of all cards after each refresh
+        sink.start_recording(self.GPUs, self.GPUsignals)
+        self.sinks.append(sink)
 
     def init_signals(self,GPU):
         Plotsignals = []
@@ -97,7 +211,7 @@ class Plot:
             Plotsignals.append(Plotsignal("MEM State", "[-]", len(GPU.pmem_clock)-1, 0,
                                           "/pp_dpm_mclk", True, True, "#9467bd",GPU.get_current_clock,1))
 
-        self.add_available_signal(GPU.sensors, Plotsignals, hwmonpath=GPU.hwmonpath)
+        self.add_available_signal(GPU, GPU.sensors, Plotsignals, hwmonpath=GPU.hwmonpath)
 
         # GPU busy percent only properly available in linux version 4.19+
         if (self.linux_kernelmain == 4 and self.linux_kernelsub > 18) or (self.linux_kernelmain >= 5):
@@ -111,12 +225,12 @@ class Plot:
              else:
                  print(f"Removing {signal.name} from plotsignals, returning Nonetype")
 
-        if len(checked_plotlist) == 0:
+        if len(checked_plotlist) == 0 and GPU is self.GPU:
             print("Nothing to plot! Hiding the plot pane.")
             self.builder.get_object("Plot").hide()
         return checked_plotlist
 
-    def add_available_signal(self, signals, Plotsignals, hwmonpath= "", subsystem = "", stop_recursion = False):
+    def add_available_signal(self, GPU, signals, Plotsignals, hwmonpath= "", subsystem = "", stop_recursion = False):
         for key, value in signals.items():
             if key in subsystem_unit_color:
                 subsystem = key
@@ -140,8 +254,8 @@ class Plot:
                         stop_recursion = True
                     if "label" in signals:
                         signallabel = signals["label"]["value"]
-                        if signallabel == "vddgfx" and len(self.GPU.volt_range) > 0:
-                            signalmax = self.GPU.volt_range[1]
+                        if signallabel == "vddgfx" and len(GPU.volt_range) > 0:
+                            signalmax = GPU.volt_range[1]
                             signalmin = 0
                         stop_recursion = True
                     if "cap" in signals:
@@ -152,14 +266,15 @@ class Plot:
                         signallabel = "(fan)" + signallabel
                     Plotsignals.append(Plotsignal(signallabel, subsystem_unit_color[subsystem]["unit"],
                                                   signalmax,signalmin, signalpath, True, True,
-                                                  subsystem_unit_color[subsystem]["color"], read))
+                                                  subsystem_unit_color[subsystem]["color"], GPU.read))
             else:
                 if not stop_recursion:
-                    self.add_available_signal(value, Plotsignals, hwmonpath=hwmonpath, subsystem=subsystem, stop_recursion = stop_recursion)
+                    self.add_available_signal(GPU, value, Plotsignals, hwmonpath=hwmonpath, subsystem=subsystem, stop_recursion = stop_recursion)
                 else:
                     continue
 
     def init_treeview(self):
+        # Columns are created once, changing cards only swaps the model
         textrenderer = Gtk.CellRendererText()
         self.plotrenderer = Gtk.CellRendererToggle()
         self.plotrenderer.connect("toggled", self.on_plot_toggled)
@@ -170,18 +285,139 @@ class Plot:
         self.tree.append_column(Gtk.TreeViewColumn("Scale", self.normaliserenderer, active=1, activatable=2))
         columnnames=["Name","Unit","min","mean","max","current"]
         for i,column in enumerate(columnnames):
+            if column == "current":
+                for j,percent in enumerate(self.percentiles):
+                    self.tree.append_column(Gtk.TreeViewColumn(f"p{percent:g}",textrenderer,text=10+j,foreground=9))
             tcolumn = Gtk.TreeViewColumn(column,textrenderer,text=i+3,foreground=9)
             self.tree.append_column(tcolumn)
-
-        for plotsignal in self.Plotsignals:
-            self.signalstore.append([plotsignal.plotenable, plotsignal.plotnormalise, True, plotsignal.name, convert_to_si(plotsignal.unit)[0], '0', '0', '0', '0', plotsignal.plotcolor])
         self.tree.set_model(self.signalstore)
 
+    def signal_row(self, plotsignal):
+        return [plotsignal.plotenable, plotsignal.plotnormalise, True, plotsignal.name, convert_to_si(plotsignal.unit)[0], '0', '0', '0', '0', plotsignal.plotcolor] + ['0'] * len(self.percentiles)
+
+    def add_derived(self, definitions):
+        # Adds signals computed from other signals (see derived.py) to every card
+        with self.lock:
+            derived = create_derived(definitions, self.GPUsignals)
+            # signals shared by the cards (e.g. total power) are set up once
+            for Plotsignal in dict.fromkeys(Plotsignal for signals in derived for Plotsignal in signals):
+                Plotsignal.period = min(signal.period for signal in Plotsignal.input_signals())
+                Plotsignal.rebuild(self.history_points(Plotsignal))
+                Plotsignal.jitter = JitterStats(Plotsignal.period)
+                if len(self.percentiles) > 0:
+                    Plotsignal.histogram = Histogram()
+                if self.history > 0:
+                    Plotsignal.history = History(self.history)
+            for signalstore, signals in zip(self.signalstores, derived):
+                for Plotsignal in signals:
+                    signalstore.append(self.signal_row(Plotsignal))
+
+    def on_window_state(self, window, event):
+        self.iconified = bool(event.new_window_state & Gdk.WindowState.ICONIFIED)
+        self.on_visibility_changed(window)
+
+    def on_visibility_changed(self, widget, *args):
+        was_visible = self.plot_visible
+        self.window_visible = self.window.get_mapped() and not self.iconified
+        self.plot_visible = self.window_visible and self.object.get_mapped() and self.object.get_allocated_height() > 1
+        if self.plot_visible and not was_visible:
+            # catch up with the samples taken while hidden
+            self.update_view()
+
+    def sampled_signals(self):
+        # Signals read for the screen: only plotted signals, and none when the window is hidden
+        if not self.window_visible:
+            return []
+        Plotsignals = [Plotsignal for Plotsignal in self.Plotsignals if Plotsignal.plotenable]
+        for Plotsignal in Plotsignals:
+            if Plotsignal.derived:
+                # inputs of plotted derived signals, also from other cards
+                Plotsignals += [signal for signal in Plotsignal.input_signals() if signal not in Plotsignals]
+        return Plotsignals
+
+    def sample(self, now=None):
+        # Reads the signals which are due, run in the refresh thread so the GUI never waits on sysfs
+        # Sinks log every signal of every card, so their history continues while signals are hidden
+        now = time.monotonic() if now is None else now
+        start = time.perf_counter()
+        with self.lock:
+            self.update_periods()
+            if len(self.sinks) > 0:
+                # derived signals shared by the cards are sampled once
+                Plotsignals = list(dict.fromkeys(Plotsignal for Plotsignals in self.GPUsignals for Plotsignal in Plotsignals))
+            else:
+                Plotsignals = self.sampled_signals()
+            # signals which were not sampled for a while (hidden or not sampled yet) are not late
+            scheduled = self.scheduled
+            self.scheduled = set(Plotsignals)
+            # signals due within the tolerance are read in the same wakeup
+            due = [Plotsignal for Plotsignal in Plotsignals if Plotsignal.next_sample <= now + sample_tolerance]
+            # derived signals last, so they use the samples of their inputs of this wakeup
+            due.sort(key=lambda Plotsignal: Plotsignal.derived)
+            suspended = self.update_runtime_status({Plotsignal.cardnr for Plotsignal in due if not Plotsignal.derived})
+            added = False
+            for Plotsignal in due:
+                Plotsignal.suspended = not Plotsignal.derived and Plotsignal.cardnr in suspended
+                if Plotsignal.suspended:
+                    # one marker per period, the card is not touched until it is active again
+                    Plotsignal.add_suspended(self.history_points(Plotsignal))
+                    interval = Plotsignal.period
+                    added = True
+                elif Plotsignal.burst is None:
+                    if Plotsignal in scheduled:
+                        self.add_jitter(Plotsignal, Plotsignal.period, now + time.perf_counter() - start)
+                    Plotsignal.retrieve_data(self.history_points(Plotsignal))
+                    interval = Plotsignal.period
+                    added = True
+                else:
+                    # reduced to an envelope at the end of each period
+                    if Plotsignal in scheduled:
+                        self.add_jitter(Plotsignal, Plotsignal.burst, now + time.perf_counter() - start)
+                    added = Plotsignal.retrieve_burst(self.history_points(Plotsignal), now) or added
+                    interval = Plotsignal.burst
+                # all periods count from the same start, so signals with related periods share wakeups
+                Plotsignal.next_sample += interval
+                if Plotsignal.next_sample < now:
+                    # not sampled for a while or cannot keep up, skip missed samples
+                    Plotsignal.next_sample = now + interval
+            for Plotsignal in self.Plotsignals:
+                if Plotsignal in due:
+                    Plotsignal.stale = self.GPU.is_stale(self.GPU.signal_path(Plotsignal.sensorpath))
+            if len(self.sinks) > 0 and added:
+                self.sample_sinks()
+            self.next_sample = min([Plotsignal.next_sample for Plotsignal in Plotsignals], default=now + self.refreshtime)
+
+    @staticmethod
+    def add_jitter(Plotsignal, interval, actual):
+        # Deviation of a read from the time the signal was due, against its own period which
+        # changes with the lanes; actual counts the reads before it in the same wakeup
+        Plotsignal.jitter.period = interval
+        Plotsignal.jitter.add(Plotsignal.next_sample, actual)
+
+    def update_runtime_status(self, cardnrs):
+        # Checks runtime_status of the cards before their signals are read
+        # outputs: set with the card numbers which are suspended
+        suspended = set()
+        for cardnr in cardnrs:
+            GPU = self.GPUs[cardnr]
+            was_suspended = GPU.suspended
+            if GPU.update_runtime_status():
+                suspended.add(cardnr)
+            if GPU.suspended and not was_suspended:
+                print(f"{GPU.fancyname} is suspended, not sampled until it is active")
+                self.suspended_spans[cardnr].append([time.monotonic_ns(), None])
+            elif was_suspended and not GPU.suspended:
+                print(f"{GPU.fancyname} is active, sampling resumed")
+                if len(self.suspended_spans[cardnr]) > 0:
+                    self.suspended_spans[cardnr][-1][1] = time.monotonic_ns()
+        return suspended
+
     def update_signals(self):
-        # Retrieve signal and set appropriate values in signalstore to update left pane in GUI
-        for i,Plotsignal in enumerate(self.Plotsignals):
-            Plotsignal.retrieve_data(self.maxpoints)
-            disable_scaling = len(Plotsignal.get_values()) > 3 and Plotsignal.all_equal() and Plotsignal.plotnormalise and (Plotsignal.max == Plotsignal.min)
+        # Set appropriate values in signalstore to update left pane in GUI, from the last view
+        if self.view is None or self.view["cardnr"] != self.GPUs.index(self.GPU):
+            return
+        for i,(Plotsignal,signal) in enumerate(zip(self.Plotsignals, self.view["signals"])):
+            disable_scaling = len(signal["data"]) > 3 and signal["all_equal"] and Plotsignal.plotnormalise and (Plotsignal.max == Plotsignal.min)
             self.signalstore[i][2] = not disable_scaling
             if disable_scaling:
                 print(f"cannot scale values of {self.signalstore[i][3]} disabling scaling")
@@ -189,10 +425,18 @@ class Plot:
                 if disable_plots_if_scaling_error:
                     print(f"disabling {self.signalstore[i][3]} plot since disable_plots_if_scaling_error is set")
                     self.on_plot_toggled(self.plotrenderer,i)
-            self.signalstore[i][5]=str(np.around(convert_to_si(Plotsignal.unit, Plotsignal.get_min())[1], self.precision))
-            self.signalstore[i][6]=str(np.around(convert_to_si(Plotsignal.unit,Plotsignal.get_mean())[1],self.precision))
-            self.signalstore[i][7]=str(np.around(convert_to_si(Plotsignal.unit,Plotsignal.get_max())[1],self.precision))
-            self.signalstore[i][8]=str(np.around(convert_to_si(Plotsignal.unit,Plotsignal.get_last_value())[1],self.precision))
+            # over the compressed history when kept, otherwise over the points in the plot
+            stats = signal["stats"]
+            self.signalstore[i][5]=str(np.around(convert_to_si(Plotsignal.unit, stats[0])[1], self.precision))
+            self.signalstore[i][6]=str(np.around(convert_to_si(Plotsignal.unit,stats[1])[1],self.precision))
+            self.signalstore[i][7]=str(np.around(convert_to_si(Plotsignal.unit,stats[2])[1],self.precision))
+            self.signalstore[i][8]=str(np.around(convert_to_si(Plotsignal.unit,signal["last"])[1],self.precision))
+            if signal["suspended"]:
+                self.signalstore[i][8] = "suspended"
+            elif signal["stale"]:
+                self.signalstore[i][8] += " (stale)"
+            for j,value in enumerate(signal["percentiles"]):
+                self.signalstore[i][10+j] = 'N/A' if value is None else str(np.around(convert_to_si(Plotsignal.unit,value)[1],self.precision))
 
     def on_plot_toggled(self, widget, path, disable_refresh=False):
         self.signalstore[path][0] = not self.signalstore[path][0]
@@ -207,24 +451,29 @@ class Plot:
             self.update_plot()
 
     def update_plot(self):
-        if len(self.Plotsignals) == 0:
+        # Draws the last view, never the arrays the refresh thread is changing
+        if len(self.Plotsignals) == 0 or self.view is None or self.view["cardnr"] != self.GPUs.index(self.GPU):
             return
-        self.ax.clear()
-        for Plotsignal in self.Plotsignals:
+        # x axis is the time of each sample in s before now, so gaps and jitter are visible
+        now = time.monotonic_ns()
+        oldest = None
+        lines = []
+        for Plotsignal, signal in zip(self.Plotsignals, self.view["signals"]):
             if Plotsignal.plotenable:
+                times = (signal["times"] - now) / 1e9
+                # the signal with the most recent start sets the range, older samples of signals which were not sampled are cut
+                oldest = times[0] if oldest is None else max(oldest, times[0])
+                envelope = signal["envelope"]
                 if Plotsignal.plotnormalise:
-                    data = Plotsignal.get_normalised_values()*100
-                    self.ax.plot(data, color=Plotsignal.plotcolor)
+                    data = Plotsignal.normalise(signal["data"], signal["window"])*100
+                    if envelope is not None:
+                        envelope = [Plotsignal.normalise(values, signal["window"])*100 for values in envelope]
                 else:
-                    data = Plotsignal.get_values()
-                    self.ax.plot(convert_to_si(Plotsignal.unit,data)[1], color=Plotsignal.plotcolor)
-
+                    data = convert_to_si(Plotsignal.unit,signal["data"])[1]
+                    if envelope is not None:
+                        envelope = [convert_to_si(Plotsignal.unit,values)[1] for values in envelope]
+                lines.append((times, data, Plotsignal.plotcolor, envelope))
 
-        self.ax.grid(True)
-        self.ax.get_yaxis().tick_right()
-        self.ax.get_yaxis().set_label_position("right")
-        self.ax.get_yaxis().set_visible(True)
-        self.ax.get_xaxis().set_visible(False)
         all_normalised = True
         all_same_unit = True
         unit = ""
@@ -241,18 +490,55 @@ class Plot:
                 break
             iter = self.signalstore.iter_next(iter)
         if all_normalised:
-            self.ax.set_yticks(np.arange(0, 101, step=25))
-            self.ax.set_ylabel('Percent [%]')
+            ylabel = 'Percent [%]'
+        elif all_same_unit:
+            ylabel = unit
         else:
-            self.ax.yaxis.set_major_locator(AutoLocator())
-            if all_same_unit:
-                self.ax.set_ylabel(unit)
-            else:
-                self.ax.set_ylabel("")
-        self.canvas.draw()
-        self.canvas.flush_events()
+            ylabel = ""
+        if self.jitter is not None:
+            xlabel = f"Time [s] ({self.jitter})"
+        else:
+            xlabel = "Time [s]"
+        # suspended periods of the shown card are shaded
+        xmin = min(oldest or 0, 0)
+        spans = [((start - now) / 1e9, 0 if end is None else (end - now) / 1e9) for start, end in self.view["spans"]]
+        self.renderer.draw(lines, (xmin, 0), ylabel, xlabel, all_normalised, spans)
+
+    def sample_sinks(self):
+        # Sinks receive the last value of every signal of every card, slower signals are repeated
+        timestamp = time.monotonic()
+        for sink in self.sinks:
+            sink.add_samples(timestamp, self.GPUsignals)
+
+    def snapshot(self):
+        # Copies everything shown of the current card under the lock, so the GTK main thread
+        # never sees arrays which sample is changing. Taken in the refresh thread.
+        with self.lock:
+            cardnr = self.GPUs.index(self.GPU)
+            signals = []
+            for Plotsignal in self.Plotsignals:
+                times, data, envelope = self.plot_points(Plotsignal)
+                window = (Plotsignal.get_min(), Plotsignal.get_max())
+                stats = Plotsignal.get_history_stats()
+                signals.append({"times": times, "data": data, "envelope": envelope, "window": window, "stats": stats if stats is not None else (window[0], Plotsignal.get_mean(), window[1]),
+                                "last": Plotsignal.get_last_value(), "all_equal": Plotsignal.all_equal(),
+                                "percentiles": [Plotsignal.get_percentile(percent) for percent in self.percentiles],
+                                "stale": Plotsignal.stale, "suspended": Plotsignal.suspended})
+            # suspended periods older than all samples are not shown anymore
+            oldest = min((signal["times"][0] for signal in signals), default=0)
+            self.suspended_spans[cardnr] = [span for span in self.suspended_spans[cardnr] if span[1] is None or span[1] > oldest]
+            spans = [tuple(span) for span in self.suspended_spans[cardnr]]
+        return {"cardnr": cardnr, "signals": signals, "spans": spans}
+
+    def update_view(self, view=None):
+        # Only updates the widgets with the last view (see snapshot), skipped when they are not on screen
+        if view is not None:
+            self.view = view
+        if self.window_visible:
+            self.update_signals()
+        if self.plot_visible:
+            self.update_plot()
 
     def refresh(self):
-        # This is run in thread
-        self.update_signals()
-        self.update_plot()
+        self.sample()
+        self.update_view(self.snapshot())
@@ -15,10 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import re
 import numpy as np
+import time
 
 
 class Plotsignal:
+    derived = False     # computed from other signals, see derived.py
+
     def __init__(self, name, unit, max=1, min=0, sensorpath='', plotenable=False, plotnormalise=False, plotcolor='#000000', parser=None, outputnr=None):
         self.name = name
         self.unit = unit
@@ -31,40 +36,149 @@ class Plotsignal:
         self.parser = parser
         self.outputnr = outputnr
         self.data = None
+        self.times = None   # time.monotonic_ns() of each value in data
+        self.period = None      # sampling period [s], None samples on every refresh
+        self.next_sample = 0    # time.monotonic() at which the next sample is due
+        self.stale = False  # last read did not finish in time, value is the previous one
+        self.suspended = False  # card is runtime suspended, NaN is added instead of reading the signal
+        self.cardnr = None      # card of the signal, set by Plot
+        # Burst mode: sampled every burst [s], the samples of each period are reduced to the mean in data
+        # and the minimum and maximum in low and high, so the history has the same length as without bursts.
+        # A point then takes 24 bytes (timestamp, mean and two float32) instead of 16.
+        self.burst = None
+        self.burstvalues = None     # [min, max, sum, count] of the burst samples of the current period
+        self.next_point = 0         # time.monotonic() at which the current period ends
+        self.low = None
+        self.high = None
+        self.histogram = None   # percentiles over the whole session, see histogram.py
+        self.history = None     # compressed history longer than the plot, see history.py
+        self.jitter = None      # deviation of the reads from their due time, see sampling.py
+
+    def get_keys(self):
+        # Keys to select the signal with, from specific to general: name, sensor file, hwmon sensor (e.g. temp1)
+        # and hwmon subsystem
+        sensorfile = os.path.basename(self.sensorpath)
+        match = re.match(r"^((in|fan|temp|power|pwm)\d+)", sensorfile)
+        return [self.name, sensorfile] + ([match.group(1), match.group(2)] if match else [None, None])
+
+    def read_value(self):
+        if self.outputnr is None:
+            return self.parser(self.sensorpath)
+        return self.parser(self.sensorpath)[self.outputnr]
 
     def retrieve_data(self,maxpoints):
         if self.parser is None:
             print(f"No parser for {self.name} cannot retrieve signal")
             return
         else:
-            if self.outputnr is None:
-                self.add_value(self.parser(self.sensorpath),maxpoints)
+            value = self.read_value()
+            if self.histogram is not None:
+                self.histogram.add(value)
+            self.add_value(value,maxpoints,time.monotonic_ns())
+
+    def retrieve_burst(self,maxpoints,now):
+        # Adds one burst sample, at the end of the period the envelope is added to the history
+        # outputs: True when a point was added
+        value = self.read_value()
+        if self.histogram is not None:
+            # every burst sample, so short drops show in the low percentiles
+            self.histogram.add(value)
+        if value is not None:
+            if self.burstvalues is None:
+                self.burstvalues = [value, value, value, 1]
             else:
-                self.add_value(self.parser(self.sensorpath)[self.outputnr],maxpoints)
+                self.burstvalues[0] = min(self.burstvalues[0], value)
+                self.burstvalues[1] = max(self.burstvalues[1], value)
+                self.burstvalues[2] += value
+                self.burstvalues[3] += 1
+        if now < self.next_point or self.burstvalues is None:
+            return False
+        low, high, total, count = self.burstvalues
+        self.add_envelope(total / count, low, high, maxpoints, time.monotonic_ns())
+        self.burstvalues = None
+        self.next_point += self.period
+        if self.next_point < now:
+            self.next_point = now + self.period
+        return True
 
+    def add_suspended(self,maxpoints):
+        # NaN marker for a sample which is not read because the card is suspended, the plot shows a gap
+        self.burstvalues = None
+        if self.low is not None:
+            self.add_envelope(np.nan,np.nan,np.nan,maxpoints,time.monotonic_ns())
+        else:
+            self.add_value(np.nan,maxpoints,time.monotonic_ns())
+
+    # Statistics skip NaN, used for values which cannot be computed (e.g. division by zero)
     def get_max(self):
-        return np.max(self.get_values())
+        if self.high is not None:
+            return np.nanmax(self.high)
+        return np.nanmax(self.get_values())
 
     def get_mean(self):
-        return np.mean(self.get_values())
+        return np.nanmean(self.get_values())
 
     def get_min(self):
-        return np.min(self.get_values())
+        if self.low is not None:
+            return np.nanmin(self.low)
+        return np.nanmin(self.get_values())
 
-    def add_value(self,value,maxpoints):
+    def add_value(self,value,maxpoints,timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+        if self.history is not None:
+            self.history.append(timestamp, value)
         if self.data is None:
             self.data = np.array([value])
+            self.times = np.array([timestamp], dtype=np.int64)
             return
         if len(self.data) < maxpoints:
             self.data = np.append(self.data,value)
+            self.times = np.append(self.times,timestamp)
         else:
             self.data = np.append(self.data[-maxpoints:],value)
+            self.times = np.append(self.times[-maxpoints:],timestamp)
+
+    def add_envelope(self,value,low,high,maxpoints,timestamp):
+        # low and high are kept as float32, they only need the precision of the plot
+        self.add_value(value,maxpoints,timestamp)
+        if self.low is None:
+            # samples added before the first envelope get an envelope of their own value
+            self.low = self.data[:-1].astype(np.float32)
+            self.high = self.data[:-1].astype(np.float32)
+        self.low = np.append(self.low, np.float32(low))[-len(self.data):]
+        self.high = np.append(self.high, np.float32(high))[-len(self.data):]
+
+    def get_envelope(self):
+        # outputs: minimum and maximum of each value in data, None without burst samples
+        if self.low is None:
+            return None
+        return self.low, self.high
+
+    def get_times(self, now=None):
+        # Time of each value in s relative to now (in time.monotonic_ns()), so the last value is close to 0
+        if self.times is None:
+            return None
+        if now is None:
+            now = time.monotonic_ns()
+        return (self.times - now) / 1e9
 
     def get_values(self):
         if self.data is not None:
             return self.data
         return None
 
+    def get_history_stats(self):
+        # outputs: minimum, mean and maximum over the compressed history, None without history
+        if self.history is None:
+            return None
+        return self.history.stats()
+
+    def get_percentile(self, percent):
+        if self.histogram is None:
+            return None
+        return self.histogram.percentile(percent)
+
     def get_last_value(self):
         if self.data is not None:
             if len(self.data) > 1:
@@ -77,14 +191,20 @@ class Plotsignal:
 
     def get_normalised_values(self):
         if self.data is not None:
-            if (self.max - self.min) != 0:
-                return (self.get_values() - self.min) / (self.max - self.min)
-            else:
-                # cannot divide by zero, returning scaled values by currents
-                with np.errstate(divide='raise',invalid='raise'):
-                    try:
-                        return (self.get_values() - self.get_min()) / (self.get_max() - self.get_min())
-                    except FloatingPointError:
-                        # cannot divide 0 by 0, return 0
-                        return self.get_values() * 0
+            return self.normalise(self.get_values())
         return None
+
+    def normalise(self, values, window=None):
+        # Scales values (e.g. data or its envelope) in the same way
+        # window: (min, max) of the values when copied from another thread, otherwise taken from data
+        if (self.max - self.min) != 0:
+            return (values - self.min) / (self.max - self.min)
+        else:
+            # cannot divide by zero, returning scaled values by currents
+            low, high = window if window is not None else (self.get_min(), self.get_max())
+            with np.errstate(divide='raise',invalid='raise'):
+                try:
+                    return (values - low) / (high - low)
+                except FloatingPointError:
+                    # cannot divide 0 by 0, return 0
+                    return values * 0
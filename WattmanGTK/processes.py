@@ -0,0 +1,199 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# GPU usage per process from the DRM fdinfo of amdgpu (kernel 5.14+), e.g.
+# /proc/<pid>/fdinfo/<fd>:
+#
+#   drm-driver:     amdgpu
+#   drm-pdev:       0000:03:00.0
+#   drm-client-id:  42
+#   drm-memory-vram:        1024 KiB
+#   drm-memory-gtt:         512 KiB
+#   drm-engine-gfx: 1234567 ns
+#
+# The engine times are summed since the client opened the card, the usage is
+# the increase per time between two scans. This module must not import GTK, so
+# it can run on a fake /proc tree.
+# Run "python3 -m WattmanGTK.processes" for a top like view in the terminal.
+
+import os
+import time
+from optparse import OptionParser
+
+engines = ["gfx", "compute", "dec", "enc", "dma"]
+
+
+def parse_fdinfo(text):
+    # outputs: dict with pdev, client, engines {name: ns} and memory {name: KiB}, None if not an amdgpu file
+    info = {"pdev": None, "client": None, "engines": {}, "memory": {}}
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        value = value.strip()
+        if key == "drm-driver" and value != "amdgpu":
+            return None
+        elif key == "drm-pdev":
+            info["pdev"] = value
+        elif key == "drm-client-id":
+            info["client"] = value
+        elif key.startswith("drm-engine-") and value.endswith("ns"):
+            info["engines"][key[11:]] = int(value[:-2])
+        elif key.startswith("drm-memory-") and value.endswith("KiB"):
+            info["memory"][key[11:]] = int(value[:-3])
+    if info["client"] is None:
+        return None
+    return info
+
+
+class ProcessScanner:
+    # Keeps per process the fds which are DRM clients, so after the first scan of a
+    # process only its known fdinfo files are read. New processes are searched by
+    # their fd links (readlink is cheaper than reading every fdinfo), known
+    # processes are searched again every rescan [s] for fds they opened since.
+    # A pid can be used again after its process exited, the start time of the
+    # process tells them apart.
+    def __init__(self, proc="/proc", rescan=10, clock=time.monotonic):
+        self.proc = proc
+        self.rescan = rescan
+        self.clock = clock
+        self.fds = {}       # pid -> fds which are DRM clients, empty for processes without
+        self.starts = {}    # pid -> start time of the process
+        self.names = {}     # (pid, start time) -> command name
+        self.scanned = {}   # pid -> time of the last search for DRM fds
+        self.previous = {}  # (pid, client id) -> (time, engine times) of the last scan
+
+    def find_fds(self, pid):
+        # fds of pid which point to a DRM device, [] when not allowed to look at them
+        fds = []
+        try:
+            for fd in os.listdir(f"{self.proc}/{pid}/fd"):
+                try:
+                    if os.readlink(f"{self.proc}/{pid}/fd/{fd}").startswith("/dev/dri/"):
+                        fds.append(fd)
+                except OSError:
+                    continue
+        except OSError:
+            pass
+        return fds
+
+    def read_name(self, pid):
+        try:
+            with open(f"{self.proc}/{pid}/comm") as comm:
+                return comm.readline().strip()
+        except OSError:
+            return str(pid)
+
+    def read_start(self, pid):
+        # Start time of the process in clock ticks after boot (field 22 of stat), None when it exited
+        try:
+            with open(f"{self.proc}/{pid}/stat") as stat:
+                # the command name in field 2 can contain spaces and parentheses
+                return int(stat.read().rpartition(")")[2].split()[19])
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def forget(self, pid):
+        del self.fds[pid], self.scanned[pid]
+        self.names.pop((pid, self.starts.pop(pid)), None)
+
+    def read_clients(self, pid):
+        # outputs: client id -> parsed fdinfo, fds sharing a client (e.g. after dup) are counted once
+        clients = {}
+        for fd in list(self.fds[pid]):
+            try:
+                with open(f"{self.proc}/{pid}/fdinfo/{fd}") as fdinfo:
+                    info = parse_fdinfo(fdinfo.read())
+            except OSError:
+                info = None
+            if info is None:
+                # closed, or the fd number is used for another file now
+                self.fds[pid].remove(fd)
+                continue
+            clients[info["client"]] = info
+        return clients
+
+    def scan(self):
+        # outputs: list of dicts with pid, name, pdev, usage {engine: %} and memory {name: KiB} per process and card
+        now = self.clock()
+        pids = set(entry for entry in os.listdir(self.proc) if entry.isdigit())
+        for pid in set(self.fds) - pids:
+            self.forget(pid)
+        for pid in pids:
+            due = pid not in self.fds or now - self.scanned[pid] >= self.rescan
+            start = None
+            if pid in self.fds and (due or len(self.fds[pid]) > 0):
+                # checked for every DRM client and every search, a reused pid without DRM fds waits for its search
+                start = self.read_start(pid)
+                if start != self.starts[pid]:
+                    self.forget(pid)
+                    due = True
+            if pid not in self.fds:
+                self.starts[pid] = self.read_start(pid) if start is None else start
+                self.names[(pid, self.starts[pid])] = self.read_name(pid)
+            if due:
+                self.fds[pid] = self.find_fds(pid)
+                self.scanned[pid] = now
+
+        usage = {}      # (pid, pdev) -> row
+        current = {}    # like previous, only with the clients of this scan, so closed clients are dropped
+        for pid, fds in self.fds.items():
+            if len(fds) == 0:
+                continue
+            for client, info in self.read_clients(pid).items():
+                command = self.names[(pid, self.starts[pid])]
+                row = usage.setdefault((pid, info["pdev"]), {"pid": int(pid), "name": command, "pdev": info["pdev"],
+                                                             "usage": {}, "memory": {}})
+                previous = self.previous.get((pid, client))
+                current[(pid, client)] = (now, info["engines"])
+                for engine, nanoseconds in info["engines"].items():
+                    if previous is not None and now > previous[0] and engine in previous[1]:
+                        percent = (nanoseconds - previous[1][engine]) / ((now - previous[0]) * 1e9) * 100
+                        row["usage"][engine] = row["usage"].get(engine, 0) + max(percent, 0)
+                for name, kib in info["memory"].items():
+                    row["memory"][name] = row["memory"].get(name, 0) + kib
+        self.previous = current
+        return sorted(usage.values(), key=lambda row: -sum(row["usage"].values()))
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-i", "--interval", help="time between scans [s]", metavar="number", default=1, type="float")
+    parser.add_option("-n", "--count", help="number of scans, 0 to run until interrupted", metavar="number", default=0, type="int")
+    parser.add_option("--proc", help="proc file system to scan", metavar="path", default="/proc", type="str")
+    (options, _) = parser.parse_args()
+
+    scanner = ProcessScanner(options.proc)
+    scans = 0
+    try:
+        while options.count == 0 or scans < options.count:
+            start = time.perf_counter()
+            rows = scanner.scan()
+            scantime = time.perf_counter() - start
+            scans += 1
+            if scans > 1:
+                print(f"{'PID':>7} {'Name':<16} {'Card':<13} " + " ".join(f"{engine:>7}" for engine in engines) + f" {'VRAM [MiB]':>10} {'GTT [MiB]':>9}")
+                for row in rows:
+                    print(f"{row['pid']:>7} {row['name'][:16]:<16} {row['pdev'] or '?':<13} " +
+                          " ".join(f"{row['usage'].get(engine, 0):>6.1f}%" for engine in engines) +
+                          f" {row['memory'].get('vram', 0) / 1024:>10.1f} {row['memory'].get('gtt', 0) / 1024:>9.1f}")
+                print(f"{len(scanner.fds)} processes, {sum(len(fds) for fds in scanner.fds.values())} DRM fds, scanned in {scantime * 1000:.1f} ms\n")
+            time.sleep(options.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+import gi                   # required for GTK3
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+from WattmanGTK.processes import ProcessScanner
+
+
+class ProcessView:
+    # Window with the GPU usage per process of the selected card. /proc is scanned
+    # in the refresh thread by sample, the GTK main thread only fills the table in update.
+    columns = ["PID", "Name", "GFX [%]", "Compute [%]", "VRAM [MiB]", "GTT [MiB]"]
+
+    def __init__(self, Handler, proc="/proc"):
+        self.Handler = Handler
+        self.scanner = ProcessScanner(proc)
+        self.rows = []
+        self.lock = threading.Lock()
+        self.visible = True     # not scanned while the window is closed
+        self.store = Gtk.ListStore(int, str, str, str, str, str)
+        tree = Gtk.TreeView(model=self.store)
+        textrenderer = Gtk.CellRendererText()
+        for i, column in enumerate(self.columns):
+            tree.append_column(Gtk.TreeViewColumn(column, textrenderer, text=i))
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(tree)
+        self.window = Gtk.Window(title="GPU processes")
+        self.window.set_default_size(500, 300)
+        self.window.add(scrolled)
+        self.window.connect("delete-event", self.on_delete)
+        self.window.show_all()
+
+    def on_delete(self, window, event):
+        # closing only hides the window and stops scanning, the main window keeps running
+        self.visible = False
+        window.hide()
+        return True
+
+    def sample(self):
+        rows = self.scanner.scan()
+        with self.lock:
+            self.rows = rows
+
+    def update(self):
+        # rows of the card shown in the main window, its sysfs path ends with the PCI address,
+        # sorted by usage by the scanner
+        pdev = os.path.basename(self.Handler.GPU.cardpath)
+        with self.lock:
+            rows = [row for row in self.rows if row["pdev"] == pdev]
+        self.store.clear()
+        for row in rows:
+            self.store.append([row["pid"], row["name"], f"{row['usage'].get('gfx', 0):.1f}", f"{row['usage'].get('compute', 0):.1f}",
+                               f"{row['memory'].get('vram', 0) / 1024:.1f}", f"{row['memory'].get('gtt', 0) / 1024:.1f}"])
+        return False
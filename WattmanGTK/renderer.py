@@ -0,0 +1,301 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Renderers draw the plot of Plot. Every renderer provides a GTK widget and
+#   draw(lines, xlim, ylabel, xlabel, normalised, spans)
+# with lines a list of (times [s], values, color, envelope), xlim the time range [s]
+# and normalised True when all lines are in percent. envelope is None or the
+# (low, high) values of each point, drawn as a band around the line. NaN values
+# are not drawn, spans are (start, end) time ranges [s] shaded in the background,
+# e.g. when the card was suspended.
+# Run "python3 -m WattmanGTK.renderer" to compare the frame time and memory use.
+
+import math
+import time
+import resource
+import subprocess
+import sys
+from optparse import OptionParser
+import numpy as np
+import cairo
+import gi                   # required for GTK3
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+WIDTH = 1000
+HEIGHT = 150
+
+
+def nice_ticks(low, high, count=5):
+    # Returns about count ticks on round numbers (1, 2 or 5 times a power of 10) covering low to high
+    if high <= low:
+        high = low + 1
+    step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(step))
+    for multiplier in [1, 2, 5, 10]:
+        if multiplier * magnitude >= step:
+            step = multiplier * magnitude
+            break
+    return np.arange(math.floor(low / step) * step, high + step, step)[:count + 2]
+
+
+def finite_runs(*values):
+    # Start and end index of every run of points which are finite in all values
+    finite = np.all([np.isfinite(value) for value in values], axis=0)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], finite.astype(np.int8), [0]))))
+    return zip(edges[::2], edges[1::2])
+
+
+def hex_to_rgb(color):
+    return tuple(int(color[i:i + 2], 16) / 255 for i in (1, 3, 5))
+
+
+class MatplotlibRenderer:
+    # The figure is sized in pixels, the canvas resizes it to the allocation of the widget
+    # (times the scale factor on HiDPI screens). The tight layout is only computed when the
+    # size or the space needed by the labels changes, not on every frame.
+    dpi = 100
+
+    def __init__(self, width=WIDTH, height=HEIGHT):
+        # imported here, so matplotlib is not loaded when using another renderer
+        from matplotlib.figure import Figure        # required for plot
+        from matplotlib.ticker import AutoLocator
+        from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas # required for GTK3 integration
+        self.AutoLocator = AutoLocator
+        self.fig = Figure(figsize=(width / self.dpi, height / self.dpi), dpi=self.dpi, facecolor="#00000000")
+        self.ax = self.fig.add_subplot(111)
+        self.canvas = FigureCanvas(self.fig)
+        self.canvas.set_size_request(-1, height)
+        self.widget = self.canvas
+        self.layout_key = None  # everything the layout depends on
+
+    def draw(self, lines, xlim, ylabel, xlabel, normalised, spans=()):
+        self.ax.clear()
+        for start, end in spans:
+            self.ax.axvspan(start, end, color="#808080", alpha=0.2, linewidth=0)
+        for times, values, color, envelope in lines:
+            self.ax.plot(times, values, color=color)
+            if envelope is not None:
+                self.ax.fill_between(times, envelope[0], envelope[1], color=color, alpha=0.25, linewidth=0)
+        self.ax.grid(True)
+        self.ax.get_yaxis().tick_right()
+        self.ax.get_yaxis().set_label_position("right")
+        self.ax.get_yaxis().set_visible(True)
+        self.ax.get_xaxis().set_visible(True)
+        if xlim[0] < xlim[1]:
+            self.ax.set_xlim(*xlim)
+        self.ax.set_xlabel(xlabel)
+        if normalised:
+            self.ax.set_yticks(np.arange(0, 101, step=25))
+        else:
+            self.ax.yaxis.set_major_locator(self.AutoLocator())
+        self.ax.set_ylabel(ylabel)
+        # the jitter in the x label changes every frame, but not the space the label needs
+        ticklength = max((len(f"{tick:g}") for tick in self.ax.get_yticks()), default=0)
+        key = (self.canvas.get_width_height(), getattr(self.canvas, "device_pixel_ratio", 1), xlabel != "", ylabel != "", ticklength)
+        if key != self.layout_key:
+            self.fig.tight_layout()
+            self.layout_key = key
+        self.canvas.draw()
+        self.canvas.flush_events()
+
+
+class CairoRenderer:
+    # Draws the lines directly with cairo. The grid, ticks and y label only
+    # change when the size or axis ranges change, so they are drawn once on a
+    # cached surface and every frame only strokes the lines and the x label,
+    # which contains the sampling jitter and changes on every refresh.
+    margin = {"left": 5, "right": 55, "top": 5, "bottom": 30}
+
+    def __init__(self, width=WIDTH, height=HEIGHT):
+        self.widget = Gtk.DrawingArea()
+        self.widget.set_size_request(-1, height)
+        self.widget.connect("draw", self.on_draw)
+        self.lines = []
+        self.spans = []
+        self.xticks = self.yticks = np.array([0, 1])
+        self.ylabel = self.xlabel = ""
+        self.grid = None        # cached surface with grid, ticks and labels
+        self.grid_key = None    # everything the cached surface depends on
+
+    def draw(self, lines, xlim, ylabel, xlabel, normalised, spans=()):
+        self.lines = lines
+        self.spans = spans
+        if normalised:
+            self.yticks = np.arange(0, 101, step=25)
+        elif len(lines) > 0:
+            low = min(np.nanmin(values if envelope is None else envelope[0]) for _, values, _, envelope in lines)
+            high = max(np.nanmax(values if envelope is None else envelope[1]) for _, values, _, envelope in lines)
+            if np.isfinite(low) and np.isfinite(high):
+                self.yticks = nice_ticks(low, high)
+        # rounded to whole ticks, so the cached grid is reused while the time range slides
+        self.xticks = nice_ticks(xlim[0], xlim[1]) if xlim[0] < xlim[1] else np.array([-1, 0])
+        self.ylabel = ylabel
+        self.xlabel = xlabel
+        self.widget.queue_draw()
+
+    def transform(self, width, height):
+        # Returns scale and offset, so pixel = offset + value * scale for x and y
+        plotwidth = width - self.margin["left"] - self.margin["right"]
+        plotheight = height - self.margin["top"] - self.margin["bottom"]
+        xscale = plotwidth / (self.xticks[-1] - self.xticks[0])
+        yscale = -plotheight / (self.yticks[-1] - self.yticks[0])
+        xoffset = self.margin["left"] - self.xticks[0] * xscale
+        yoffset = self.margin["top"] + plotheight - self.yticks[0] * yscale
+        return xscale, xoffset, yscale, yoffset
+
+    def draw_grid(self, widget, width, height, scale):
+        # in device pixels on HiDPI screens, so the cached grid is as sharp as the lines
+        self.grid = cairo.ImageSurface(cairo.FORMAT_ARGB32, width * scale, height * scale)
+        self.grid.set_device_scale(scale, scale)
+        context = cairo.Context(self.grid)
+        color = widget.get_style_context().get_color(Gtk.StateFlags.NORMAL)
+        xscale, xoffset, yscale, yoffset = self.transform(width, height)
+        left, right = self.margin["left"], width - self.margin["right"]
+        top, bottom = self.margin["top"], height - self.margin["bottom"]
+
+        context.set_line_width(1)
+        context.set_source_rgba(color.red, color.green, color.blue, 0.2)
+        for tick in self.xticks:
+            x = round(xoffset + tick * xscale) + 0.5
+            context.move_to(x, top)
+            context.line_to(x, bottom)
+        for tick in self.yticks:
+            y = round(yoffset + tick * yscale) + 0.5
+            context.move_to(left, y)
+            context.line_to(right, y)
+        context.stroke()
+        context.set_source_rgba(color.red, color.green, color.blue, 0.8)
+        context.rectangle(left + 0.5, top + 0.5, right - left - 1, bottom - top - 1)
+        context.stroke()
+
+        context.set_font_size(10)
+        for tick in self.yticks:
+            context.move_to(right + 4, yoffset + tick * yscale + 4)
+            context.show_text(f"{tick:g}")
+        for tick in self.xticks:
+            text = f"{tick:g}"
+            context.move_to(xoffset + tick * xscale - context.text_extents(text).width / 2, bottom + 12)
+            context.show_text(text)
+        context.save()
+        context.move_to(width - 4, (top + bottom + context.text_extents(self.ylabel).width) / 2)
+        context.rotate(-math.pi / 2)
+        context.show_text(self.ylabel)
+        context.restore()
+
+    def on_draw(self, widget, context):
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        scale = widget.get_scale_factor()
+        key = (width, height, scale, tuple(self.xticks), tuple(self.yticks), self.ylabel)
+        if key != self.grid_key:
+            self.draw_grid(widget, width, height, scale)
+            self.grid_key = key
+        context.set_source_surface(self.grid, 0, 0)
+        context.paint()
+        color = widget.get_style_context().get_color(Gtk.StateFlags.NORMAL)
+        context.set_source_rgba(color.red, color.green, color.blue, 0.8)
+        context.set_font_size(10)
+        context.move_to((width + self.margin["left"] - self.margin["right"] - context.text_extents(self.xlabel).width) / 2, height - 4)
+        context.show_text(self.xlabel)
+
+        xscale, xoffset, yscale, yoffset = self.transform(width, height)
+        context.rectangle(self.margin["left"], self.margin["top"], width - self.margin["left"] - self.margin["right"],
+                          height - self.margin["top"] - self.margin["bottom"])
+        context.clip()
+        context.set_source_rgba(0.5, 0.5, 0.5, 0.2)
+        for start, end in self.spans:
+            context.rectangle(xoffset + start * xscale, 0, (end - start) * xscale, height)
+        context.fill()
+        context.set_line_width(1.5)
+        # NaN values are gaps, so every run of finite values is its own path
+        for times, values, color, envelope in self.lines:
+            x = xoffset + times * xscale
+            if envelope is not None:
+                low = yoffset + envelope[0] * yscale
+                high = yoffset + envelope[1] * yscale
+                context.set_source_rgba(*hex_to_rgb(color), 0.25)
+                for first, last in finite_runs(low, high):
+                    context.move_to(x[first], low[first])
+                    for point in zip(x[first + 1:last], low[first + 1:last]):
+                        context.line_to(*point)
+                    for point in zip(x[first:last][::-1], high[first:last][::-1]):
+                        context.line_to(*point)
+                    context.close_path()
+                context.fill()
+            y = yoffset + values * yscale
+            context.set_source_rgb(*hex_to_rgb(color))
+            for first, last in finite_runs(y):
+                context.move_to(x[first], y[first])
+                for point in zip(x[first + 1:last], y[first + 1:last]):
+                    context.line_to(*point)
+            context.stroke()
+        return False
+
+
+renderers = {"matplotlib": MatplotlibRenderer, "cairo": CairoRenderer}
+
+
+def get_renderer(name):
+    if name not in renderers:
+        raise ValueError(f"Unknown renderer {name}, choose from {', '.join(renderers)}")
+    return renderers[name]
+
+
+def benchmark(name, frames, signals, points):
+    # Draws frames in an offscreen window, outputs mean frame time [s] and maximum RSS [kB]
+    renderer = get_renderer(name)()
+    renderer.widget.set_size_request(WIDTH, HEIGHT)
+    window = Gtk.OffscreenWindow()
+    window.add(renderer.widget)
+    window.show_all()
+    colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f"]
+    times = np.linspace(-points / 5, 0, points)
+    start = time.perf_counter()
+    for frame in range(frames):
+        lines = [(times, 50 + 50 * np.sin(times + frame / 10 + i), colors[i % len(colors)], None) for i in range(signals)]
+        renderer.draw(lines, (times[0], 0), "Percent [%]", "Time [s]", True)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+    frametime = (time.perf_counter() - start) / frames
+    return frametime, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--frames", help="number of frames drawn per renderer", metavar="number", default=200, type="int")
+    parser.add_option("-s", "--signals", help="number of plotted signals", metavar="number", default=8, type="int")
+    parser.add_option("-p", "--points", help="number of points per signal", metavar="number", default=25, type="int")
+    parser.add_option("--renderer", help="only benchmark this renderer in this process", metavar="name", type="str")
+    (options, _) = parser.parse_args()
+
+    if options.renderer:
+        frametime, rss = benchmark(options.renderer, options.frames, options.signals, options.points)
+        print(f"{options.renderer} {frametime} {rss}")
+        return
+
+    # every renderer runs in its own process, so the RSS only contains what that renderer loads
+    print(f"{'Renderer':<12} {'Frame [ms]':>10} {'fps':>8} {'RSS [MB]':>9}")
+    for name in renderers:
+        output = subprocess.check_output([sys.executable, "-m", "WattmanGTK.renderer", "--renderer", name,
+                                          "-n", str(options.frames), "-s", str(options.signals), "-p", str(options.points)])
+        _, frametime, rss = output.decode().split()[-3:]
+        print(f"{name:<12} {float(frametime) * 1000:>10.2f} {1 / float(frametime):>8.0f} {int(rss) / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
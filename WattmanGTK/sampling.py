@@ -0,0 +1,89 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import configparser
+import numpy as np
+
+
+class JitterStats:
+    # Keeps the deviation [s] of the last size samples from their target time
+    # period [s]: target time between samples, used to count skipped samples
+    def __init__(self, period, size=1000):
+        self.period = period
+        self.deviations = np.zeros(size)
+        self.count = 0
+        self.skipped = 0
+
+    def add(self, target, actual):
+        # target and actual are monotonic times [s] of one sample
+        deviation = actual - target
+        self.deviations[self.count % len(self.deviations)] = deviation
+        self.count += 1
+        if deviation > self.period:
+            self.skipped += int(deviation // self.period)
+
+    def percentiles(self):
+        # outputs: p50 and p99 of the deviation [s], None without samples
+        if self.count == 0:
+            return None
+        p50, p99 = np.percentile(self.deviations[:min(self.count, len(self.deviations))], [50, 99])
+        return p50, p99
+
+    def summary(self):
+        percentiles = self.percentiles()
+        if percentiles is None:
+            return "no samples"
+        return f"jitter p50 {percentiles[0] * 1000:.2f} ms, p99 {percentiles[1] * 1000:.2f} ms, {self.skipped} of {self.count + self.skipped} samples skipped"
+
+
+def jitter_report(Plotsignals, count=10):
+    # Prints the signals with the highest p99 deviation from their own period (see Plotsignal.jitter)
+    stats = [(Plotsignal.name, Plotsignal.jitter) for Plotsignal in Plotsignals
+             if Plotsignal.jitter is not None and Plotsignal.jitter.count > 0]
+    stats.sort(key=lambda item: -item[1].percentiles()[1])
+    print(f"{'Signal jitter':<30} {'Period [s]':>10} {'p50 [ms]':>9} {'p99 [ms]':>9} {'Skipped':>8}")
+    for name, jitter in stats[:count]:
+        p50, p99 = jitter.percentiles()
+        print(f"{name:<30} {jitter.period:>10g} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f} {jitter.skipped:>8}")
+
+
+def parse_periods(spec):
+    # Parses sampling periods like "temp=2,power1_average=0.5,GPU Usage=0.1"
+    # keys are a signal name, sensor file or hwmon subsystem, values the period [s]
+    periods = {}
+    for item in spec.split(","):
+        key, _, value = item.partition("=")
+        try:
+            period = float(value)
+        except ValueError:
+            raise ValueError(f"Cannot parse sampling period \"{item}\", use name=seconds e.g. temp=2")
+        if not math.isfinite(period) or period <= 0:
+            raise ValueError(f"Sampling period of {key.strip()} must be a number larger than 0")
+        periods[key.strip()] = period
+    return periods
+
+
+def read_periods(filename):
+    # Reads sampling periods from the [periods] section of an ini file, with the keys of parse_periods
+    config = configparser.ConfigParser()
+    config.optionxform = str    # keep signal names like "GPU Usage" as is
+    if len(config.read(filename)) == 0:
+        raise ValueError(f"Cannot read {filename}")
+    if not config.has_section("periods"):
+        raise ValueError(f"No [periods] section in {filename}")
+    return parse_periods(",".join(f"{key}={value}" for key, value in config.items("periods")))
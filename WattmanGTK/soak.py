@@ -0,0 +1,246 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Soak test: runs the GUI offscreen on synthetic cards for hours or days of
+# simulated time and fails when memory, Python objects or the time per tick
+# grow. Time is a virtual clock which jumps to the next wakeup, so a day at
+# 1 Hz takes as long as 86400 refreshes take to compute.
+# Run "python3 -m WattmanGTK.soak --hours 72" (exit code 1 on growth), with
+# --switches the card is first changed that often back to back.
+# Plotsignal timestamps use the real clock, this only compresses the time
+# axis of the plot and does not change the work done per tick. Sampling runs
+# on every refresh, drawing can be limited with --draw-every so long runs are
+# not dominated by the plot.
+
+import gc
+import os
+import csv
+import time
+import threading
+from optparse import OptionParser
+import numpy as np
+import gi                   # required for GTK3
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+from WattmanGTK.handler import Handler
+from WattmanGTK.renderer import renderers
+from WattmanGTK.wattman import synthetic_GPUs, get_data_path, update_gui
+
+
+class VirtualClock:
+    # Only advances when set by the soak loop, used by the synthetic backend
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+def rss():
+    # Current resident set size [kB], ru_maxrss only gives the peak
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def growth(times, values, warmup=0.2):
+    # Relative growth of a linear fit over the run, skipping the first warmup fraction
+    # outputs: e.g. 0.1 when the fit ends 10% higher than it starts
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    keep = times >= times[0] + warmup * (times[-1] - times[0])
+    if np.count_nonzero(keep) < 3:
+        return 0.0
+    slope, intercept = np.polyfit(times[keep], values[keep], 1)
+    start = slope * times[keep][0] + intercept
+    if start == 0:
+        return 0.0
+    return slope * (times[keep][-1] - times[keep][0]) / abs(start)
+
+
+def check(records, names, tolerance, warmup):
+    # Prints the growth of the measured columns of records over the run
+    # outputs: True when any of them grows more than tolerance [%]
+    failed = False
+    times = [record[0] for record in records]
+    for i, name in enumerate(names):
+        relative = growth(times, [record[i + 1] for record in records], warmup) * 100
+        result = "FAIL" if relative > tolerance else "ok"
+        failed = failed or relative > tolerance
+        print(f"{name:<10} {relative:>+7.1f}% {result}")
+    return failed
+
+
+def start_gui(GPUs, refreshtime, renderer, maxpoints):
+    # outputs: handler, plot, card selection and offscreen window of the GUI
+    builder = Gtk.Builder()
+    builder.add_from_file(get_data_path("wattman.ui"))
+    handler = Handler(builder, GPUs)
+    builder.connect_signals(handler)
+    plot = handler.init_plot(0, maxpoints, 2, 0, 0, renderer, refreshtime)
+
+    # the content of the main window is drawn in an offscreen window, so it does not need a screen
+    window = builder.get_object("Wattman")
+    content = window.get_child()
+    window.remove(content)
+    offscreen = Gtk.OffscreenWindow()
+    offscreen.add(content)
+    offscreen.show_all()
+    plot.window = offscreen
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    plot.on_visibility_changed(offscreen)
+    return handler, plot, builder.get_object("GPU Selection"), offscreen
+
+
+def switch_cards(GPUs, clock, refreshtime, renderer, maxpoints, switches, interval=50):
+    # Changes the card switches times back to back, with one refresh after each change
+    # outputs: list of (switch, RSS [kB], Python objects, maximum switch time [ms]) every interval switches
+    handler, plot, combobox, offscreen = start_gui(GPUs, refreshtime, renderer, maxpoints)
+    pending = threading.Event()
+    times = []
+    records = []
+    for switch in range(1, switches + 1):
+        clock.now += refreshtime
+        plot.sample(clock.now)
+        start = time.perf_counter()
+        combobox.set_active((combobox.get_active() + 1) % len(GPUs))
+        GPU = handler.GPU
+        GPU.get_currents()
+        pending.set()
+        update_gui(handler, plot, GPU.snapshot(), plot.snapshot(), None, pending)
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+        times.append(time.perf_counter() - start)
+        if switch % interval == 0:
+            gc.collect()
+            records.append((switch, rss(), len(gc.get_objects()), max(times) * 1000))
+            print(f"{switch:>8} {records[-1][1] / 1024:>9.1f} {records[-1][2]:>9} {records[-1][3]:>9.3f}")
+            times = []
+    offscreen.destroy()
+    return records
+
+
+def soak(GPUs, clock, hours, refreshtime, interval, renderer, maxpoints, switch_every, draw_every=0):
+    # Runs the GUI offscreen until hours of virtual time passed, sampling every refresh and
+    # drawing every draw_every virtual seconds (0 on every refresh)
+    # outputs: list of (virtual time [s], RSS [kB], Python objects, median sampling tick time [ms],
+    # median draw time [ms]) every interval
+    handler, plot, combobox, offscreen = start_gui(GPUs, refreshtime, renderer, maxpoints)
+
+    pending = threading.Event()
+    end = clock.now + hours * 3600
+    next_refresh = clock.now
+    next_draw = clock.now
+    next_record = clock.now + interval
+    refreshes = 0
+    ticks = []
+    draws = []
+    records = []
+    while clock.now < end:
+        clock.now = min(next_refresh, plot.next_sample)
+        start = time.perf_counter()
+        if clock.now >= plot.next_sample:
+            plot.sample(clock.now)
+        if clock.now >= next_refresh:
+            refreshes += 1
+            if switch_every > 0 and refreshes % switch_every == 0:
+                combobox.set_active((combobox.get_active() + 1) % len(GPUs))
+            GPU = handler.GPU
+            GPU.get_currents()
+            next_refresh += refreshtime
+            ticks.append(time.perf_counter() - start)
+            if clock.now >= next_draw:
+                start = time.perf_counter()
+                pending.set()
+                update_gui(handler, plot, GPU.snapshot(), plot.snapshot(), None, pending)
+                while Gtk.events_pending():
+                    Gtk.main_iteration()
+                draws.append(time.perf_counter() - start)
+                next_draw = max(next_draw + draw_every, clock.now)
+        else:
+            ticks.append(time.perf_counter() - start)
+        if clock.now >= next_record:
+            gc.collect()
+            records.append((clock.now, rss(), len(gc.get_objects()), np.median(ticks) * 1000, np.median(draws) * 1000))
+            print(f"{clock.now / 3600:>8.1f} {records[-1][1] / 1024:>9.1f} {records[-1][2]:>9} {records[-1][3]:>9.3f} {records[-1][4]:>9.3f}")
+            ticks = []
+            draws = []
+            next_record += interval
+    offscreen.destroy()
+    return records
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--hours", help="simulated time", metavar="number", default=24, type="float")
+    parser.add_option("-f", "--frequency", help="refreshes per simulated second", metavar="number", default=1, type="float")
+    parser.add_option("--synthetic", help="synthetic cards as cards,sensors,rate,waveform", metavar="spec", default="4,25,50,sine", type="str")
+    parser.add_option("--renderer", help=f"plot renderer: {', '.join(renderers)}", metavar="name", default="matplotlib", type="str")
+    parser.add_option("-p", "--plotpoints", help="number of points in plot", metavar="number", default=25, type="int")
+    parser.add_option("--interval", help="simulated time between measurements [s]", metavar="number", default=900, type="float")
+    parser.add_option("--draw-every", help="simulated time between draws [s], 0 to draw on every refresh", metavar="number", default=0, type="float")
+    parser.add_option("--switch-every", help="change card every number of refreshes, 0 to never change", metavar="number", default=300, type="int")
+    parser.add_option("--switches", help="first change the card this many times back to back and check the memory and switch time", metavar="number", default=0, type="int")
+    parser.add_option("--max-switch-time", help="allowed time of one card change [ms]", metavar="number", default=100, type="float")
+    parser.add_option("--tolerance", help="allowed growth of memory, objects and tick time over the run [%]", metavar="number", default=10, type="float")
+    parser.add_option("--warmup", help="fraction of the run not used to check growth", metavar="number", default=0.2, type="float")
+    parser.add_option("-o", "--output", help="write the measurements to a csv file", metavar="file", type="str")
+    (options, _) = parser.parse_args()
+
+    if options.renderer not in renderers:
+        print(f"Unknown renderer {options.renderer}, choose from {', '.join(renderers)}")
+        exit(2)
+    clock = VirtualClock()
+    GPUs = synthetic_GPUs(options.synthetic, 0, 0, clock)
+    failed = False
+    if options.switches > 0:
+        print(f"{'Switch':>8} {'RSS [MB]':>9} {'Objects':>9} {'Max [ms]':>9}")
+        records = switch_cards(GPUs, clock, 1 / options.frequency, options.renderer, options.plotpoints, options.switches)
+        if len(records) < 3:
+            print("Too few measurements to check growth, use at least 150 switches")
+            exit(2)
+        failed = check(records, ["RSS", "Objects"], options.tolerance, options.warmup)
+        slowest = max(record[3] for record in records)
+        result = "FAIL" if slowest > options.max_switch_time else "ok"
+        failed = failed or slowest > options.max_switch_time
+        print(f"{'Switch':<10} {slowest:>7.1f} ms {result}")
+        if options.hours <= 0:
+            exit(1 if failed else 0)
+
+    if options.draw_every > options.interval:
+        print("--draw-every must not be longer than --interval, every measurement needs a draw")
+        exit(2)
+    print(f"{'Hour':>8} {'RSS [MB]':>9} {'Objects':>9} {'Tick [ms]':>9} {'Draw [ms]':>9}")
+    started = time.perf_counter()
+    records = soak(GPUs, clock, options.hours, 1 / options.frequency, options.interval, options.renderer,
+                   options.plotpoints, options.switch_every, options.draw_every)
+    wall = time.perf_counter() - started
+    print(f"Simulated {options.hours:g} h in {wall / 60:.1f} min, {options.hours * 3600 / wall:.0f}x real time")
+    if options.output:
+        with open(options.output, "w", newline="") as outputfile:
+            writer = csv.writer(outputfile)
+            writer.writerow(["time", "rss", "objects", "tick", "draw"])
+            writer.writerows(records)
+    if len(records) < 3:
+        print("Too few measurements to check growth, use a longer run or a shorter interval")
+        exit(2)
+    if check(records, ["RSS", "Objects", "Tick time", "Draw time"], options.tolerance, options.warmup) or failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
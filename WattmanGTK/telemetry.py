@@ -0,0 +1,462 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Recording and replaying of telemetry.
+#
+# A recording starts with MAGIC, a little endian uint32 with the length of a
+# JSON header and the header itself, padded to a multiple of 8 bytes. The
+# header describes the recorded cards (including a snapshot of their static
+# files) and the recorded signals. After the header follow records of
+# float64 values: the time since the start of the recording [s] followed by
+# one value per signal. NaN means no value. Since all records have the same
+# size the data can be memory mapped, so recordings do not need to fit in RAM.
+#
+# For long term logging TelemetryLog writes the same header (with LOGMAGIC)
+# followed by compressed blocks of samples, in segments which are rotated on
+# size and age. Each block starts with two little endian uint32, the number of
+# rows and the size of the zlib compressed data. The data holds one type byte
+# per column followed by the columns: integer columns are stored as the first
+# value (int64) and the differences to the next rows, in the smallest integer
+# size that fits (type is the size in bytes), other columns are stored as
+# float64 (type 0). Time is stored in µs. Logs with LOGMAGIC_V1 have no
+# separate first value, their differences start from 0. Logs can be converted
+# to a recording with: python3 -m WattmanGTK.telemetry output log...
+
+import os
+import glob
+import json
+import math
+import time
+import zlib
+import queue
+import struct
+import threading
+import numpy as np
+from optparse import OptionParser
+from WattmanGTK.backend import normpath
+
+MAGIC = b"WGTKREC1"
+LOGMAGIC = b"WGTKLOG2"
+LOGMAGIC_V1 = b"WGTKLOG1"
+cardfiles = ["pp_od_clk_voltage", "pp_dpm_sclk", "pp_dpm_mclk", "pp_sclk_od", "pp_mclk_od",
+             "power_dpm_force_performance_level", "gpu_busy_percent"]
+
+
+def snapshot(GPU):
+    # Contents of all readable files of the card, used to recreate the card on replay
+    files = {}
+    paths = [GPU.cardpath + "/" + filename for filename in cardfiles]
+    if GPU.hwmonpath != '':
+        paths += [GPU.hwmonpath + "/" + filename for filename in sorted(GPU.backend.listdir(GPU.hwmonpath))]
+    for path in paths:
+        try:
+            files[path] = "".join(GPU.backend.readlines(path))
+        except (OSError, UnicodeDecodeError):
+            continue
+    return files
+
+
+def create_header(GPUs, GPUsignals):
+    # GPUsignals: list with the Plotsignals of every card
+    header = {"version": 1, "start": time.time(), "cards": [], "signals": []}
+    for cardnr, (GPU, Plotsignals) in enumerate(zip(GPUs, GPUsignals)):
+        header["cards"].append({"cardpath": GPU.cardpath, "hwmonpath": GPU.hwmonpath,
+                                "fancyname": GPU.fancyname, "files": snapshot(GPU)})
+        for Plotsignal in Plotsignals:
+            header["signals"].append({"card": cardnr, "name": Plotsignal.name, "unit": Plotsignal.unit,
+                                      "path": GPU.signal_path(Plotsignal.sensorpath), "outputnr": Plotsignal.outputnr})
+    return header
+
+
+def encode_header(header, magic=MAGIC):
+    data = json.dumps(header).encode()
+    data += b" " * (-(len(magic) + 4 + len(data)) % 8)
+    return magic + struct.pack("<I", len(data)) + data
+
+
+def read_header(inputfile, magic=MAGIC, oldmagic=None):
+    # outputs: header and offset of the data after the header, and when oldmagic is given
+    # whether the file starts with oldmagic (an older format) instead of magic
+    found = inputfile.read(len(magic))
+    if found != magic and (oldmagic is None or found != oldmagic):
+        raise ValueError(f"{inputfile.name} is not a WattmanGTK {'recording' if magic == MAGIC else 'log'}")
+    (length,) = struct.unpack("<I", inputfile.read(4))
+    header = json.loads(inputfile.read(length).decode())
+    if oldmagic is None:
+        return header, len(magic) + 4 + length
+    return header, len(magic) + 4 + length, found == oldmagic
+
+
+def sample_row(timestamp, GPUsignals):
+    # Time followed by the last value of every Plotsignal of every card
+    row = [timestamp]
+    for Plotsignals in GPUsignals:
+        for Plotsignal in Plotsignals:
+            value = Plotsignal.get_last_value()
+            row.append(np.nan if value is None else value)
+    return row
+
+
+def encode_block(block):
+    # Compresses a block of samples (rows x columns), see the description at the top
+    block = block.copy()
+    block[:, 0] = np.round(block[:, 0] * 1000000)
+    types = bytearray()
+    columns = []
+    for column in block.T:
+        if np.all(np.isfinite(column)) and np.all(column == np.round(column)) and np.all(np.abs(column) < 2**53):
+            # the first value separately, so e.g. the time does not need 8 bytes for every difference
+            column = column.astype(np.int64)
+            delta = np.diff(column)
+            size = 8
+            for candidate in [1, 2, 4]:
+                if np.all(np.abs(delta) < 2**(8 * candidate - 1)):
+                    size = candidate
+                    break
+            types.append(size)
+            columns.append(column[:1].astype("<i8").tobytes() + delta.astype(f"<i{size}").tobytes())
+        else:
+            types.append(0)
+            columns.append(column.astype("<f8").tobytes())
+    data = zlib.compress(bytes(types) + b"".join(columns), 6)
+    return struct.pack("<II", block.shape[0], len(data)) + data
+
+
+def decode_block(rows, data, ncolumns, first_value=True):
+    # first_value: False for blocks of LOGMAGIC_V1 logs
+    data = zlib.decompress(data)
+    block = np.empty((rows, ncolumns))
+    offset = ncolumns
+    for i, size in enumerate(data[:ncolumns]):
+        if size == 0:
+            block[:, i] = np.frombuffer(data, dtype="<f8", count=rows, offset=offset)
+            offset += 8 * rows
+        elif first_value:
+            first = np.frombuffer(data, dtype="<i8", count=1, offset=offset)
+            delta = np.frombuffer(data, dtype=f"<i{size}", count=rows - 1, offset=offset + 8)
+            block[:, i] = np.cumsum(np.concatenate((first, delta)), dtype=np.int64)
+            offset += 8 + size * (rows - 1)
+        else:
+            block[:, i] = np.cumsum(np.frombuffer(data, dtype=f"<i{size}", count=rows, offset=offset), dtype=np.int64)
+            offset += size * rows
+    block[:, 0] /= 1000000
+    return block
+
+
+class Recorder:
+    # Writes the samples of all cards to a recording which can be replayed
+    def __init__(self, filename):
+        self.filename = filename
+        self.outputfile = None
+        self.start = None
+
+    def start_recording(self, GPUs, GPUsignals):
+        self.header = create_header(GPUs, GPUsignals)
+        self.outputfile = open(self.filename, "wb")
+        self.outputfile.write(encode_header(self.header))
+        self.start = time.monotonic()
+        print(f"Recording {len(self.header['signals'])} signals of {len(GPUs)} card(s) to {self.filename}")
+
+    def add_samples(self, timestamp, GPUsignals):
+        # timestamp: time.monotonic() of the samples
+        row = sample_row(timestamp - self.start, GPUsignals)
+        self.outputfile.write(np.array(row, dtype=np.float64).tobytes())
+
+    def stop(self):
+        if self.outputfile is not None:
+            self.outputfile.close()
+            self.outputfile = None
+
+
+class TelemetryLog:
+    # Long term log of all cards, samples are buffered in memory and written in
+    # compressed blocks by a background thread, so the caller never waits on disk I/O
+    # max_size [bytes] and max_age [s]: rotation of the segments
+    # retention [s]: segments older than this are removed
+    def __init__(self, directory, max_size=64000000, max_age=86400, retention=28 * 86400, block_rows=600, block_age=60):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.retention = retention
+        self.block_rows = block_rows
+        self.block_age = block_age
+        self.blocks = queue.Queue()
+        self.thread = None
+        self.segment = None
+
+    def start_recording(self, GPUs, GPUsignals):
+        self.header = create_header(GPUs, GPUsignals)
+        self.columns = 1 + len(self.header["signals"])
+        self.start = time.monotonic()
+        self.new_block()
+        self.thread = threading.Thread(target=self.write_blocks, daemon=True)
+        self.thread.start()
+        print(f"Logging {len(self.header['signals'])} signals of {len(GPUs)} card(s) to {self.directory}")
+
+    def new_block(self):
+        self.block = np.empty((self.block_rows, self.columns))
+        self.rows = 0
+        self.block_start = time.monotonic()
+
+    def add_samples(self, timestamp, GPUsignals):
+        # Only copies the samples, blocks are handed to the writer thread when full or old enough
+        self.block[self.rows] = sample_row(timestamp - self.start, GPUsignals)
+        self.rows += 1
+        if self.rows == self.block_rows or timestamp - self.block_start > self.block_age:
+            self.blocks.put(self.block[:self.rows])
+            self.new_block()
+
+    def stop(self):
+        # Writes the remaining samples and waits for the writer thread
+        if self.thread is None:
+            return
+        if self.rows > 0:
+            self.blocks.put(self.block[:self.rows])
+        self.blocks.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def write_blocks(self):
+        # Run in the writer thread
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            try:
+                if self.segment is None or self.segment.tell() > self.max_size or time.time() - self.segment_start > self.max_age:
+                    self.rotate()
+                self.segment.write(encode_block(block))
+                self.segment.flush()
+            except OSError as error:
+                print(f"Cannot write telemetry log: {error}")
+        if self.segment is not None:
+            self.segment.close()
+
+    def rotate(self):
+        if self.segment is not None:
+            self.segment.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment_start = time.time()
+        filename = os.path.join(self.directory, time.strftime("WattmanGTK-%Y%m%d-%H%M%S.wlog", time.localtime(self.segment_start)))
+        self.segment = open(filename, "wb")
+        self.segment.write(encode_header(self.header, LOGMAGIC))
+        for segment in glob.glob(os.path.join(self.directory, "WattmanGTK-*.wlog")):
+            if self.segment_start - os.path.getmtime(segment) > self.retention:
+                print(f"Removing old telemetry log {segment}")
+                os.remove(segment)
+
+
+class TelemetryLogFile:
+    # Reads a segment written by TelemetryLog block by block, so it does not have to fit in RAM
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as inputfile:
+            self.header, self.offset, self.v1 = read_header(inputfile, LOGMAGIC, LOGMAGIC_V1)
+
+    def blocks(self):
+        columns = 1 + len(self.header["signals"])
+        with open(self.filename, "rb") as inputfile:
+            inputfile.seek(self.offset)
+            while True:
+                blockheader = inputfile.read(8)
+                if len(blockheader) < 8:
+                    return
+                rows, size = struct.unpack("<II", blockheader)
+                data = inputfile.read(size)
+                if len(data) < size:
+                    # log was not closed properly
+                    return
+                yield decode_block(rows, data, columns, not self.v1)
+
+
+def convert(outputname, lognames):
+    # Converts log segments (with the same signals) to a recording which can be memory mapped
+    logs = [TelemetryLogFile(logname) for logname in sorted(lognames)]
+    rows = 0
+    with open(outputname, "wb") as outputfile:
+        outputfile.write(encode_header(logs[0].header))
+        for log in logs:
+            if log.header["signals"] != logs[0].header["signals"]:
+                print(f"Skipping {log.filename}, it contains other signals")
+                continue
+            for block in log.blocks():
+                outputfile.write(block.astype("<f8").tobytes())
+                rows += block.shape[0]
+    return rows
+
+
+class TelemetryFile:
+    # Read only, memory mapped access to a recording
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as inputfile:
+            self.header, offset = read_header(inputfile)
+        columns = 1 + len(self.header["signals"])
+        # A recording which was not closed properly can end with a partial record
+        records = (os.path.getsize(filename) - offset) // (8 * columns)
+        if records == 0:
+            raise ValueError(f"{filename} does not contain any samples")
+        self.data = np.memmap(filename, dtype=np.float64, mode="r", offset=offset, shape=(records, columns))
+        self.times = self.data[:, 0]
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def duration(self):
+        return float(self.times[-1])
+
+    def index(self, t):
+        # Index of the last record at or before time t, binary search only touches a few pages
+        return max(int(np.searchsorted(self.times, t, side="right")) - 1, 0)
+
+    def column(self, signalnr):
+        return self.data[:, 1 + signalnr]
+
+
+class ReplayClock:
+    # Position in a recording, which runs at speed times real time and can be paused and moved
+    # speed is limited to 1-100, like the refresh frequency of a replay
+    min_speed = 1
+    max_speed = 100
+
+    def __init__(self, duration, speed=1, position=0):
+        self.duration = duration
+        self.speed = self.limit_speed(speed)
+        self.paused = False
+        self.seek(position)
+
+    def limit_speed(self, speed):
+        if not speed >= self.min_speed:
+            # also NaN
+            return self.min_speed
+        return min(speed, self.max_speed)
+
+    def now(self):
+        if self.paused:
+            return self.position
+        return min(self.position + (time.monotonic() - self.started) * self.speed, self.duration)
+
+    def seek(self, position):
+        self.position = min(max(position, 0), self.duration)
+        self.started = time.monotonic()
+
+    def set_speed(self, speed):
+        self.seek(self.now())
+        self.speed = self.limit_speed(speed)
+
+    def toggle_pause(self):
+        self.seek(self.now())
+        self.paused = not self.paused
+
+
+class ReplayBackend:
+    # Backend (see backend.py) which serves the files of the recorded cards at the time of the replay clock
+    def __init__(self, recording, speed=1, position=0):
+        self.recording = recording
+        self.clock = ReplayClock(recording.duration(), speed, position)
+        self.files = {}
+        self.directories = {}
+        for card in recording.header["cards"]:
+            self.directories[card["cardpath"]] = []
+            self.directories[card["hwmonpath"]] = []
+            for path, content in card["files"].items():
+                directory, filename = path.rsplit("/", 1)
+                self.directories.setdefault(directory, []).append(filename)
+                self.files[path] = content
+        self.signals = {}   # path -> column of the signal read directly from this file
+        self.states = {}    # path -> column of the state of a pp_dpm_* file
+        for signalnr, signal in enumerate(recording.header["signals"]):
+            if signal["outputnr"] is None:
+                self.signals[signal["path"]] = signalnr
+            elif signal["outputnr"] == 1:
+                self.states[signal["path"]] = signalnr
+        self.last_time = None
+        self.last_index = 0
+
+    def cards(self):
+        return self.recording.header["cards"]
+
+    def index(self):
+        t = self.clock.now()
+        if t != self.last_time:
+            self.last_time = t
+            self.last_index = self.recording.index(t)
+        return self.last_index
+
+    def value(self, signalnr):
+        value = float(self.recording.column(signalnr)[self.index()])
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+
+    def read(self, path):
+        path = normpath(path)
+        if path in self.signals:
+            return self.value(self.signals[path])
+        if path in self.states:
+            return self.readlines(path)[0].rstrip()
+        if path not in self.files:
+            return None
+        value = self.files[path].split("\n")[0]
+        if value == "":
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    def readlines(self, path):
+        path = normpath(path)
+        if path not in self.files:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        lines = self.files[path].splitlines(True)
+        if path in self.states:
+            # move the * to the recorded state
+            state = self.value(self.states[path])
+            lines = [line.replace(" *", "").rstrip() + (" *" if i == state else "") + "\n" for i, line in enumerate(lines)]
+        return lines
+
+    def readbytes(self, path):
+        return "".join(self.readlines(path)).encode()
+
+    def listdir(self, path):
+        if path not in self.directories:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        return list(self.directories[path])
+
+    def isfile(self, path):
+        return normpath(path) in self.files
+
+    def write(self, path, value):
+        raise PermissionError(1, "Cannot write to a replayed card", path)
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog output log [log ...]\nConverts telemetry log segments to a recording")
+    (_, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error("Give an output file and at least one log segment")
+    try:
+        rows = convert(args[0], args[1:])
+    except (OSError, ValueError) as error:
+        print(f"Cannot convert: {error}")
+        exit(1)
+    print(f"Wrote {rows} samples to {args[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,10 @@ def read(path):
         except OSError:
             return None
 
+def write(path, value):
+    with open(path, "w") as origin_file:
+        origin_file.write(f"{value}\n")
+
 def convert_to_si(unit, value=0):
     # First char in unit should have prefix
     # https://en.wikipedia.org/wiki/Metric_prefix
@@ -1,11 +1,12 @@
 import gi                   # required for GTK3
 gi.require_version("Gtk", "3.0")
-from gi.repository import GLib, Gtk
+from gi.repository import GLib, Gtk, Gdk
 import threading            # to update UI and plot
 import glob                 # to get directories of cards
 import time                 # for threading
 import platform             # to dermine linux version
 import signal               # for sigint handling
+import atexit               # to hand back fan control
 import subprocess           # for running lspci
 import os
 import re                   # for getting fancy GPU name
@@ -16,6 +17,16 @@ from pathlib import Path
 from WattmanGTK.handler import Handler # handles GUI
 from WattmanGTK.plot import Plot       # handles PLOT
 from WattmanGTK.GPU import GPU         # handles GPU information and subroutines
+from WattmanGTK.backend import SysfsBackend, DeadlineBackend, ProfilingBackend, SyntheticBackend # access to (fake) cards
+from WattmanGTK.telemetry import Recorder, TelemetryLog, TelemetryFile, ReplayBackend # recording, logging and replay
+from WattmanGTK.fancurve import FanCurve, FanController, outputs # software fan curve
+from WattmanGTK.sampling import JitterStats, jitter_report, parse_periods, read_periods # sampling periods and jitter statistics
+from WattmanGTK.renderer import renderers # available plot renderers
+from WattmanGTK.alerts import AlertEngine, read_rules # alert rules
+from WattmanGTK.derived import default_definitions, read_definitions # derived signals
+from WattmanGTK.processview import ProcessView # GPU usage per process
+from WattmanGTK.energy import EnergyMeter # energy per DPM state
+from WattmanGTK.energyview import EnergyView
 
 ROOT = Path(__file__).parent
 
@@ -30,12 +41,178 @@ def read_featuremask():
         return int(origin_file.readline())
 
 
-def refresh(refreshtime,Handler,Plot):
-    # Used in thread to update the values in the gui and plot
+def update_gui(Handler, Plot, snapshot, view, jitter, pending):
+    # Run on the GTK main thread with the values and signals copied in the refresh thread
+    Handler.update_labels(snapshot)
+    Plot.jitter = jitter
+    Plot.update_view(view)
+    pending.clear()
+    return False
+
+
+def stop_fans(fancontrollers):
+    # Hands fan control back to the cards
+    for controller in fancontrollers:
+        controller.stop()
+
+
+def refresh(refreshtime,Handler,Plot,jitter,fancontrollers=[],processview=None,energyview=None):
+    # Used in thread to read all values for the gui and plot, the GTK main thread only updates the widgets
+    # Signals are sampled with their own period by Plot.sample, the GUI is updated every refreshtime
+    # Fan controllers are run in the same thread, each with its own tick rate
+    # The processes using the GPU are scanned every refreshtime while their window is open
+    # The energy window shows the totals accumulated by its sink, also every refreshtime
+    next_refresh = time.monotonic()
+    pending = threading.Event()     # set while the GUI did not process the last update yet
     while True:
-        GLib.idle_add(Handler.update_gui)
-        GLib.idle_add(Plot.refresh)
-        time.sleep(refreshtime)
+        now = time.monotonic()
+        if now >= Plot.next_sample:
+            Plot.sample(now)
+        if now >= next_refresh:
+            jitter.add(next_refresh, now)
+            # labels and plot are not updated while the window is hidden or minimised
+            if Plot.window_visible and not pending.is_set():
+                # under the lock of the plot, so the card is not changed halfway
+                with Plot.lock:
+                    GPU = Handler.GPU
+                    GPU.get_currents()
+                    snapshot = GPU.snapshot()
+                pending.set()
+                GLib.idle_add(update_gui, Handler, Plot, snapshot, Plot.snapshot(), jitter.summary(), pending)
+            if processview is not None and processview.visible:
+                processview.sample()
+                GLib.idle_add(processview.update)
+            if energyview is not None and energyview.visible:
+                GLib.idle_add(energyview.update)
+            next_refresh += refreshtime
+            if next_refresh < now:
+                # cannot keep up, skip missed refreshes
+                next_refresh = now + refreshtime
+        for controller in fancontrollers:
+            if controller.enabled and now >= controller.next_tick:
+                controller.tick(now)
+        # wake up for whatever is due first: the GUI, a signal or a fan controller
+        wakeup = min([next_refresh, Plot.next_sample] + [controller.next_tick for controller in fancontrollers if controller.enabled])
+        # or earlier when the GUI asks for an update, e.g. after changing the card
+        if Handler.refresh_requested.wait(max(0, wakeup - time.monotonic())):
+            Handler.refresh_requested.clear()
+            next_refresh = time.monotonic()
+
+
+def find_GPUs(options, linux_kernelmain, linux_kernelsub, backend):
+    # Detect where GPU is located in SYSFS
+    amd_pci_ids = subprocess.check_output("lspci | grep -E \"^.*(VGA|Display).*\[AMD\/ATI\].*$\" | grep -Eo \"^([0-9a-fA-F]+:[0-9a-fA-F]+.[0-9a-fA-F])\"", shell=True).decode().split()
+    if options.id:
+        amd_pci_ids = [options.id]
+        print("Using AMD GPU on %s. Checking if correct kernel driver is used for this." % amd_pci_ids[0])
+    else:
+        # Detect where GPU is located in SYSFS
+        amd_pci_ids = subprocess.check_output("lspci | grep -E \"^.*(VGA|Display).*\[AMD\/ATI\].*$\" | grep -Eo \"^([0-9a-fA-F]+:[0-9a-fA-F]+.[0-9a-fA-F])\"", shell=True).decode().split()
+        print("%s AMD GPU(s) found. Checking if correct kernel driver is used for this/these." % len(amd_pci_ids))
+    GPUs = []
+    for i, pci_id in enumerate(amd_pci_ids):
+        lspci_info = subprocess.check_output("lspci -k -s " + pci_id, shell=True).decode().split("\n")
+        if 'amdgpu' in lspci_info[2]:
+            try:
+                print(f"{pci_id} uses amdgpu kernel driver")
+                print("Searching for sysfs path...")
+                searching_sysfs_GPU = True
+                sysfsdirectories = glob.glob(CARDPATH)
+                for sysfsdirectory in sysfsdirectories:
+                    sysfspath = str(Path(sysfsdirectory).resolve())
+                    if pci_id in sysfspath[-7:]:
+                        print(f"{sysfspath} belongs to {pci_id} with symbolic link to {sysfsdirectory}")
+                        searching_sysfs_GPU = False
+                        break
+                if searching_sysfs_GPU:
+                    raise AttributeError
+            except (AttributeError, IndexError):
+                print("Something went wrong in searching for the sysfspath")
+                exit()
+            print(f"Sysfs path found in {sysfspath}")
+            fancyname = re.sub(r".*:\s",'',lspci_info[1])
+            GPUs.append(GPU(sysfspath,linux_kernelmain,linux_kernelmain,fancyname,backend))
+        elif 'radeon' in lspci_info[2]:
+            print("radeon kernel driver in use for AMD GPU at pci id %s" % pci_id)
+            print("You should consider the radeon-profile project to control this card")
+            exit()
+        else:
+            print("Something went wrong in detection of your card.")
+            exit()
+
+
+    hwmondir = '/sys/class/hwmon/'
+    for i,folder in enumerate(os.listdir(hwmondir)):
+        if open(hwmondir + folder + '/name').readline().rstrip() == 'amdgpu':
+            print(f"amdgpu card found in {hwmondir}{folder} hwmon folder")
+            print("Checking which device this hwmon path belongs to")
+            for card in GPUs:
+                if str(Path(f"{hwmondir}{folder}/device").resolve()) == card.cardpath:
+                    print(f"{hwmondir}{folder} belongs to {card.cardpath} ({card.fancyname})")
+                    card.hwmonpath = hwmondir + folder
+                    card.sensors = card.init_sensors()
+                    card.get_states()
+                    break
+    return GPUs
+
+
+def synthetic_GPUs(spec, linux_kernelmain, linux_kernelsub, clock=time.monotonic):
+    # Creates GPUs on a synthetic backend, spec is "cards,sensors,rate,waveform"
+    defaults = ["1", "5", "50", "sine"]
+    values = spec.split(",") + defaults[len(spec.split(",")):]
+    try:
+        backend = SyntheticBackend(int(values[0]), int(values[1]), float(values[2]), values[3], clock)
+    except ValueError as error:
+        print(f"Cannot create synthetic backend from \"{spec}\": {error}")
+        exit()
+    GPUs = []
+    for i, cardpath in enumerate(backend.cardpaths()):
+        card = GPU(cardpath, linux_kernelmain, linux_kernelsub, f"Synthetic GPU {i}", backend)
+        card.hwmonpath = backend.hwmonpath(cardpath)
+        card.sensors = card.init_sensors()
+        card.get_states()
+        GPUs.append(card)
+    print(f"Using {len(GPUs)} synthetic GPU(s) with {values[1]} sensors at {values[2]} Hz ({values[3]})")
+    return GPUs
+
+
+def replay_GPUs(filename, speed, position, linux_kernelmain, linux_kernelsub):
+    # Creates the recorded GPUs on a replay backend
+    try:
+        recording = TelemetryFile(filename)
+    except (OSError, ValueError) as error:
+        print(f"Cannot replay {filename}: {error}")
+        exit()
+    backend = ReplayBackend(recording, speed, position)
+    GPUs = []
+    for card in backend.cards():
+        replayed = GPU(card["cardpath"], linux_kernelmain, linux_kernelsub, f"{card['fancyname']} (replay)", backend)
+        replayed.hwmonpath = card["hwmonpath"]
+        replayed.sensors = replayed.init_sensors()
+        replayed.get_states()
+        GPUs.append(replayed)
+    print(f"Replaying {len(GPUs)} GPU(s) from {filename} ({recording.duration():.1f} s) at {backend.clock.speed}x")
+    print("Keys: space to pause, left/right to seek, +/- to change speed")
+    return GPUs, backend
+
+
+def replay_key_pressed(window, event, clock):
+    # Controls the replay from the keyboard
+    key = Gdk.keyval_name(event.keyval)
+    if key == "space":
+        clock.toggle_pause()
+    elif key == "Left":
+        clock.seek(clock.now() - 10 * clock.speed)
+    elif key == "Right":
+        clock.seek(clock.now() + 10 * clock.speed)
+    elif key in ["plus", "KP_Add", "equal"]:
+        clock.set_speed(clock.speed * 2)
+    elif key in ["minus", "KP_Subtract"]:
+        clock.set_speed(clock.speed / 2)
+    else:
+        return False
+    print(f"Replay at {clock.now():.1f}/{clock.duration:.1f} s, speed {clock.speed:g}x{' (paused)' if clock.paused else ''}")
+    return True
 
 
 def main():
@@ -46,9 +223,41 @@ def main():
     parser = OptionParser()
     parser.add_option("-o", "--override", help="override when program fails a check ", metavar="linux/overdrive", type="str")
     parser.add_option("-p", "--plotpoints", help="number of points to plot", metavar="number", default=25, type="int")
-    parser.add_option("-f", "--frequency", help="frequency in Hz to refresh plot area [1-5]", metavar="number", default=1, type="int")
+    parser.add_option("-f", "--frequency", help="frequency in Hz to refresh plot area [1-5], up to 100 with --synthetic or --replay", metavar="number", default=1, type="int")
     parser.add_option("-r", "--rounding", help="digits to round to in plot", metavar="number", default=2, type="int")
+    parser.add_option("--periods", help="sampling periods in s per signal name, sensor file or subsystem, e.g. temp=2,power=1,\"GPU Usage\"=0.1", metavar="spec", type="str")
+    parser.add_option("--periods-file", help="ini file with sampling periods in a [periods] section, with the same keys as --periods", metavar="file", type="str", dest="periods_file")
+    parser.add_option("--burst", help="sample these signals (name, sensor file or subsystem) at the burst rate and plot the min/max between refreshes, e.g. pp_dpm_sclk,gpu_busy_percent,power1_average", metavar="list", type="str")
+    parser.add_option("--burst-rate", help="frequency in Hz of burst sampling", metavar="number", default=100, type="float", dest="burst_rate")
+    parser.add_option("--percentiles", help="extra table columns with percentiles over the whole session, e.g. 5,50,95,99", metavar="list", type="str")
+    parser.add_option("--history", help="samples per signal kept in a compressed history, the min, mean and max in the table are over this history, 0 to only keep the plotted points", metavar="number", default=0, type="int")
+    parser.add_option("--plot-span", help="seconds shown in the plot, read from the history (needs --history), 0 to plot the last --plotpoints points", metavar="number", default=0, type="float", dest="plot_span")
+    parser.add_option("--renderer", help="plot renderer: matplotlib or cairo (faster, for low-power machines)", metavar="name", default="matplotlib", type="str")
     parser.add_option("-i", "--id", help="manually select the GPU by its pci id ", metavar="string", type="str")
+    parser.add_option("--latency-budget", help="time in ms above which a sensor file is moved to the slow lane, 0 to read all files on every refresh", metavar="number", default=5, type="float")
+    parser.add_option("--slow-lane", help="number of refreshes between reads of slow sensor files", metavar="number", default=10, type="int")
+    parser.add_option("--drop-slow", help="read slow sensor files only every 10 slow lane periods, to measure them again", action="store_true", default=False)
+    parser.add_option("--keep-sensors", help="sensor files never moved to the slow lane, e.g. temp1_input,power1_average", metavar="list", default="", type="str")
+    parser.add_option("--latency-report", help="number of slowest sensor files printed on exit", metavar="number", default=5, type="int")
+    parser.add_option("--deadline", help="time in ms after which a hanging sysfs read is skipped and its sensor marked stale", metavar="number", default=250, type="float")
+    parser.add_option("--synthetic", help="run on synthetic cards instead of the real hardware, given as cards,sensors,rate,waveform e.g. 16,25,50,sine (waveforms: sine, square, sawtooth, triangle, noise)", metavar="spec", type="str")
+    parser.add_option("--processes", help="show the GPU usage per process in a separate window (needs kernel 5.14 or newer)", action="store_true", default=False)
+    parser.add_option("--energy", help="show the energy, time and MHz per W per DPM state of every card in a separate window", action="store_true", default=False)
+    parser.add_option("--record", help="record the signals of all cards to a file which can be replayed", metavar="file", type="str")
+    parser.add_option("--log", help="log the signals of all cards in compressed, rotated files in this directory", metavar="directory", type="str")
+    parser.add_option("--log-size", help="size in MB after which a new log file is started", metavar="number", default=64, type="float", dest="log_size")
+    parser.add_option("--log-age", help="age in hours after which a new log file is started", metavar="number", default=24, type="float", dest="log_age")
+    parser.add_option("--log-retention", help="days after which log files are removed", metavar="number", default=28, type="float", dest="log_retention")
+    parser.add_option("--derived", help="ini file with signals computed from other signals, or \"default\" for MHz per W, busy clock and total power, see WattmanGTK/derived.py", metavar="file", type="str")
+    parser.add_option("--alerts", help="ini file with alert rules checked on every sample, see WattmanGTK/alerts.py", metavar="file", type="str")
+    parser.add_option("--replay", help="replay a recording instead of using the real hardware", metavar="file", type="str")
+    parser.add_option("--replay-speed", help="replay speed [1-100]", metavar="number", default=1, type="float", dest="replay_speed")
+    parser.add_option("--replay-position", help="time in s to start the replay from", metavar="number", default=0, type="float", dest="replay_position")
+    parser.add_option("--fancurve", help="software fan curve as temperature:speed pairs in °C:%, e.g. 40:20,60:40,80:100", metavar="curve", type="str")
+    parser.add_option("--fanrate", help="frequency in Hz of the fan curve control loop", metavar="number", default=1, type="float")
+    parser.add_option("--fanhysteresis", help="temperature drop in °C before the fan curve lowers the fan speed", metavar="number", default=3, type="float")
+    parser.add_option("--fanstep", help="maximum change of the fan speed in %/s", metavar="number", default=10, type="float")
+    parser.add_option("--fanoutput", help="fan curve output, pwm1 or fan1_target", metavar="file", default="pwm1", type="str")
     (options,_ ) = parser.parse_args()
     if options.override == "linux":
         print("Will not stop at linux kernel errors")
@@ -59,10 +268,65 @@ def main():
     else:
         override_linux = False
         override_overdrive = False
-    if options.frequency > 5:
-        options.frequency = 5
-    elif options.frequency < 1:
+    if options.renderer not in renderers:
+        print(f"Unknown renderer {options.renderer}, choose from {', '.join(renderers)}")
+        exit()
+    periods = {}
+    try:
+        if options.periods_file:
+            periods.update(read_periods(options.periods_file))
+        if options.periods:
+            periods.update(parse_periods(options.periods))
+    except ValueError as error:
+        print(error)
+        exit()
+    if options.derived == "default":
+        definitions = default_definitions
+    elif options.derived:
+        try:
+            definitions = read_definitions(options.derived)
+        except ValueError as error:
+            print(error)
+            exit()
+    if options.alerts:
+        try:
+            rules = read_rules(options.alerts)
+        except ValueError as error:
+            print(error)
+            exit()
+    percentiles = []
+    if options.percentiles:
+        try:
+            percentiles = [float(percent) for percent in options.percentiles.split(",")]
+        except ValueError:
+            percentiles = [-1]
+        if any(percent < 0 or percent > 100 for percent in percentiles):
+            print(f"Cannot use percentiles {options.percentiles}, use numbers from 0 to 100 e.g. 5,50,95,99")
+            exit()
+    if options.history < 0:
+        print("History must be 0 or more samples")
+        exit()
+    if options.plot_span < 0 or (options.plot_span > 0 and options.history == 0):
+        print("Plot span must be 0 or more seconds and needs --history")
+        exit()
+    bursts = {}
+    if options.burst:
+        if not 0 < options.burst_rate < float("inf"):
+            print("Burst rate must be a number larger than 0")
+            exit()
+        bursts = {key.strip(): 1 / options.burst_rate for key in options.burst.split(",")}
+    if options.replay and not 1 <= options.replay_speed <= 100:
+        print(f"Replay speed must be from 1 to 100, not {options.replay_speed:g}")
+        exit()
+    if options.frequency < 1:
+        # checked first, 0 would divide by zero for every backend
         options.frequency = 1
+    elif options.synthetic or options.replay:
+        # no hardware involved, allow high refresh rates for load testing and fast replays
+        if options.frequency > 100:
+            options.frequency = 100
+    elif options.frequency > 5:
+        options.frequency = 5
 
     # Check python version
     (python_major, python_minor, _) = platform.python_version_tuple()
@@ -104,59 +368,50 @@ def main():
         if not override_linux:
             exit()
 
-    # Detect where GPU is located in SYSFS
-    amd_pci_ids = subprocess.check_output("lspci | grep -E \"^.*(VGA|Display).*\[AMD\/ATI\].*$\" | grep -Eo \"^([0-9a-fA-F]+:[0-9a-fA-F]+.[0-9a-fA-F])\"", shell=True).decode().split()
-    if options.id:
-        amd_pci_ids = [options.id]
-        print("Using AMD GPU on %s. Checking if correct kernel driver is used for this." % amd_pci_ids[0])
+    backend = None
+    if options.replay:
+        GPUs, replay = replay_GPUs(options.replay, options.replay_speed, options.replay_position, linux_kernelmain, linux_kernelsub)
+    elif options.synthetic:
+        GPUs = synthetic_GPUs(options.synthetic, linux_kernelmain, linux_kernelsub)
     else:
-        # Detect where GPU is located in SYSFS
-        amd_pci_ids = subprocess.check_output("lspci | grep -E \"^.*(VGA|Display).*\[AMD\/ATI\].*$\" | grep -Eo \"^([0-9a-fA-F]+:[0-9a-fA-F]+.[0-9a-fA-F])\"", shell=True).decode().split()
-        print("%s AMD GPU(s) found. Checking if correct kernel driver is used for this/these." % len(amd_pci_ids))
-    GPUs = []
-    for i, pci_id in enumerate(amd_pci_ids):
-        lspci_info = subprocess.check_output("lspci -k -s " + pci_id, shell=True).decode().split("\n")
-        if 'amdgpu' in lspci_info[2]:
-            try:
-                print(f"{pci_id} uses amdgpu kernel driver")
-                print("Searching for sysfs path...")
-                searching_sysfs_GPU = True
-                sysfsdirectories = glob.glob(CARDPATH)
-                for sysfsdirectory in sysfsdirectories:
-                    sysfspath = str(Path(sysfsdirectory).resolve())
-                    if pci_id in sysfspath[-7:]:
-                        print(f"{sysfspath} belongs to {pci_id} with symbolic link to {sysfsdirectory}")
-                        searching_sysfs_GPU = False
-                        break
-                if searching_sysfs_GPU:
-                    raise AttributeError
-            except (AttributeError, IndexError):
-                print("Something went wrong in searching for the sysfspath")
-                exit()
-            print(f"Sysfs path found in {sysfspath}")
-            fancyname = re.sub(r".*:\s",'',lspci_info[1])
-            GPUs.append(GPU(sysfspath,linux_kernelmain,linux_kernelmain,fancyname))
-        elif 'radeon' in lspci_info[2]:
-            print("radeon kernel driver in use for AMD GPU at pci id %s" % pci_id)
-            print("You should consider the radeon-profile project to control this card")
-            exit()
-        else:
-            print("Something went wrong in detection of your card.")
+        # profiled inside the deadline, so reads which hang are measured when they finish
+        profiler = ProfilingBackend(SysfsBackend())
+        backend = DeadlineBackend(profiler, options.deadline / 1000)
+        GPUs = find_GPUs(options, linux_kernelmain, linux_kernelsub, backend)
+        if options.slow_lane < 1:
+            print("--slow-lane must be at least 1")
             exit()
+        for card in GPUs:
+            card.set_lanes(options.latency_budget / 1000, options.slow_lane, options.drop_slow,
+                           [sensor for sensor in options.keep_sensors.split(",") if sensor != ""])
 
-
-    hwmondir = '/sys/class/hwmon/'
-    for i,folder in enumerate(os.listdir(hwmondir)):
-        if open(hwmondir + folder + '/name').readline().rstrip() == 'amdgpu':
-            print(f"amdgpu card found in {hwmondir}{folder} hwmon folder")
-            print("Checking which device this hwmon path belongs to")
-            for card in GPUs:
-                if str(Path(f"{hwmondir}{folder}/device").resolve()) == card.cardpath:
-                    print(f"{hwmondir}{folder} belongs to {card.cardpath} ({card.fancyname})")
-                    card.hwmonpath = hwmondir + folder
-                    card.sensors = card.init_sensors()
-                    card.get_states()
-                    break
+    # Software fan curves, one control loop per card
+    fancontrollers = []
+    if options.fancurve and options.fanoutput not in outputs:
+        print(f"Unknown fan output {options.fanoutput}, use {' or '.join(outputs)}")
+        exit()
+    if options.fancurve:
+        for card in GPUs:
+            if card.hwmonpath == '' or not card.backend.isfile(card.hwmonpath + outputs[options.fanoutput][0]):
+                print(f"No fan control for {card.fancyname}, cannot use fan curve")
+                continue
+            try:
+                curve = FanCurve.from_string(options.fancurve, options.fanhysteresis, options.fanstep)
+                controller = FanController(card.hwmonpath, curve, options.fanrate, options.fanoutput, card.read, card.backend.write)
+            except ValueError as error:
+                print(error)
+                exit()
+            if controller.start():
+                print(f"Fan curve enabled for {card.fancyname}")
+                fancontrollers.append(controller)
+    if len(fancontrollers) > 0:
+        # any other exit hands the fans back too
+        atexit.register(stop_fans, fancontrollers)
+    if len(fancontrollers) > 0 or options.record or options.log:
+        # Ctrl-C or kill must not leave the fans in manual mode or lose the buffered samples of the
+        # recording and log: the signals quit the main loop, after which both are handled below
+        for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, Gtk.main_quit)
 
     # Initialise and present GUI
     builder = Gtk.Builder()
@@ -166,18 +421,55 @@ def main():
     builder.connect_signals(Handler0)
 
     window = builder.get_object("Wattman")
+    if options.replay:
+        # connected after, so focused widgets still receive their keys
+        window.connect_after("key-press-event", replay_key_pressed, replay.clock)
     window.present()
 
     # Initialise plot
     maxpoints = options.plotpoints  # maximum points in plot e.g. last 100 points are plotted
     precision = options.rounding  # precision used in rounding when calculating mean/average
-    Plot0 = Handler0.init_plot(0, maxpoints, precision, linux_kernelmain, linux_kernelsub)
+    refreshtime = 1 / options.frequency  # s , timeout used inbetween updates e.g. 1Hz refreshrate on values/plot
+    Plot0 = Handler0.init_plot(0, maxpoints, precision, linux_kernelmain, linux_kernelsub, options.renderer, refreshtime, periods, bursts, percentiles, options.history, options.plot_span)
+    if options.derived:
+        # before the sinks, so derived signals are recorded and can be used in alerts
+        Plot0.add_derived(definitions)
+    if options.record:
+        recorder = Recorder(options.record)
+        Plot0.add_sink(recorder)
+    if options.log:
+        log = TelemetryLog(options.log, options.log_size * 1000000, options.log_age * 3600, options.log_retention * 86400)
+        Plot0.add_sink(log)
+    if options.alerts:
+        Plot0.add_sink(AlertEngine(rules))
+    if options.energy:
+        meter = EnergyMeter()
+        Plot0.add_sink(meter)
 
     # Start update thread
-    refreshtime = 1 / options.frequency  # s , timeout used inbetween updates e.g. 1Hz refreshrate on values/plot
-    thread = threading.Thread(target=refresh,args=[refreshtime, Handler0, Plot0])
+    jitter = JitterStats(refreshtime)
+    processview = ProcessView(Handler0) if options.processes else None
+    energyview = EnergyView(meter) if options.energy else None
+    thread = threading.Thread(target=refresh,args=[refreshtime, Handler0, Plot0, jitter, fancontrollers, processview, energyview])
     thread.daemon = True
     thread.start()
 
     # Launch application
     Gtk.main()
+
+    stop_fans(fancontrollers)
+    # no samples are added after this, so the recording and log can write what they buffered
+    with Plot0.lock:
+        Plot0.sinks = []
+    if options.record:
+        recorder.stop()
+    if options.log:
+        log.stop()
+    if options.energy:
+        meter.report()
+    if backend is not None:
+        backend.report()
+        if options.latency_report > 0:
+            profiler.report(options.latency_report)
+    print(f"Sampling {jitter.summary()}")
+    jitter_report(dict.fromkeys(Plotsignal for Plotsignals in Plot0.GPUsignals for Plotsignal in Plotsignals))
@@ -45,6 +45,7 @@ setup(
         'pycairo',
     ],
     entry_points={
-        "console_scripts": ["wattmanGTK=WattmanGTK.wattman:main"]
+        "console_scripts": ["wattmanGTK=WattmanGTK.wattman:main",
+                            "wattmanGTK-restore=WattmanGTK.persistence:main"]
     }
 )
@@ -0,0 +1,177 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from WattmanGTK.alerts import AlertEngine, Condition, Rule, read_rules
+from WattmanGTK.plotsignal import Plotsignal
+
+
+class Card:
+    def __init__(self, name):
+        self.fancyname = name
+
+
+def temperature():
+    return Plotsignal("Temperature", "[m°C]", max=100000, min=0, sensorpath="/hwmon/hwmon0/temp1_input")
+
+
+def power():
+    return Plotsignal("Power", "[µW]", max=200000000, min=50000000, sensorpath="/hwmon/hwmon0/power1_average")
+
+
+def engine(rules, *cards):
+    # outputs: AlertEngine on the signals of the cards and the list of sent notifications
+    notifications = []
+    alerts = AlertEngine(rules, notifier=lambda title, message: notifications.append((title, message)))
+    alerts.start_recording([Card(f"card{cardnr}") for cardnr in range(len(cards))], list(cards))
+    return alerts, notifications
+
+
+def stream(alerts, samples, period=1.0, start=0.0):
+    # Adds one sample per signal every period [s], samples: list of values per signal
+    # outputs: number of alerts fired after each sample
+    counts = []
+    signals = [check[2][number][0] for check in alerts.checks[:1] for number in range(len(check[2]))]
+    for step, values in enumerate(samples):
+        for Plotsignal, value in zip(signals, values if isinstance(values, tuple) else (values,)):
+            if value is None:
+                Plotsignal.add_suspended(100)
+            else:
+                Plotsignal.add_value(value, 100)
+        alerts.add_samples(start + step * period, None)
+        counts.append(len(alerts.fired))
+    return counts
+
+
+def test_condition_parse():
+    condition = Condition(" GPU Usage >= 98% ")
+    assert (condition.key, condition.value, condition.text) == ("GPU Usage", "98%", "GPU Usage >= 98%")
+    for text in ["temp1 90", "temp1 > hot", "> 90"]:
+        with pytest.raises(ValueError):
+            Condition(text)
+
+
+def test_thresholds_in_file_units():
+    signal = power()
+    assert Condition("power1 > 150").threshold(signal) == 150000000
+    assert Condition("power1 > min").threshold(signal) == 50000000
+    assert Condition("power1 > max").threshold(signal) == 200000000
+    assert Condition("power1 > 50%").threshold(signal) == 125000000
+
+
+def test_fires_without_duration():
+    alerts, notifications = engine([Rule("Hot", "temp1 > 90")], [temperature()])
+    assert stream(alerts, [80000, 90000, 91000, 95000]) == [0, 0, 1, 1]
+    assert alerts.fired[0] == (2.0, "Hot", 0)
+    assert notifications[0][0] == "Hot"
+    assert "temp1 > 90 (Temperature 91°C)" in notifications[0][1]
+
+
+def test_duration():
+    # must hold for 3 s: fires on the 4th sample above the threshold, once
+    alerts, _ = engine([Rule("Hot", "temp1 > 90", duration=3)], [temperature()])
+    assert stream(alerts, [95000] * 6) == [0, 0, 0, 1, 1, 1]
+
+
+def test_reset_after_recovery():
+    # a sample below the threshold restarts the duration, the alert fires again after recovering
+    alerts, _ = engine([Rule("Hot", "temp1 > 90", duration=2)], [temperature()])
+    samples = [95000, 95000, 80000, 95000, 95000, 95000, 95000, 80000, 95000, 95000, 95000]
+    assert stream(alerts, samples) == [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 2]
+    assert [fired[0] for fired in alerts.fired] == [5.0, 10.0]
+
+
+@pytest.mark.parametrize("when, fires", [
+    ("power1 >= 98%", [0, 0, 1, 1]),        # 197 W and more
+    ("power1 >= max", [0, 0, 0, 1]),        # 200 W
+    ("power1 <= min", [1, 1, 1, 1]),        # 50 W
+    ("power1 < 10%", [1, 1, 1, 1]),         # below 65 W
+    ("power1 > 150", [0, 0, 1, 1]),
+])
+def test_relative_thresholds(when, fires):
+    alerts, _ = engine([Rule("Power", when)], [power()])
+    assert stream(alerts, [50000000, 150000000, 197000000, 200000000]) == fires
+
+
+def test_all_conditions_must_hold():
+    alerts, _ = engine([Rule("Limited", "temp1 > 90 and power1 >= 98%", duration=1)], [temperature(), power()])
+    samples = [(95000, 100000000), (95000, 199000000), (80000, 199000000), (95000, 199000000), (95000, 199000000)]
+    assert stream(alerts, samples) == [0, 0, 0, 0, 1]
+
+
+@pytest.mark.parametrize("when", ["temp1 > 90", "temp1 != 20", "temp1 < 100"])
+def test_nan_does_not_hold(when):
+    # NaN is added for a suspended card or a value which cannot be computed, it restarts the duration
+    alerts, _ = engine([Rule("Check", when, duration=2)], [temperature()])
+    assert stream(alerts, [95000, 95000, np.nan, 95000, 95000, np.nan, np.nan]) == [0, 0, 0, 0, 0, 0, 0]
+    assert stream(alerts, [95000, 95000, 95000], start=10) == [0, 0, 1]
+
+
+def test_suspended_samples():
+    alerts, _ = engine([Rule("Hot", "temp1 > 90", duration=1)], [temperature()])
+    assert stream(alerts, [95000, None, None, 95000, 95000]) == [0, 0, 0, 0, 1]
+
+
+def test_rule_per_card():
+    hot, cool = temperature(), temperature()
+    alerts, _ = engine([Rule("Hot", "temp1 > 90", cards=[1])], [cool], [hot])
+    assert len(alerts.checks) == 1
+    hot.add_value(95000, 100)
+    cool.add_value(95000, 100)
+    alerts.add_samples(0, None)
+    assert list(alerts.fired) == [(0, "Hot", 1)]
+
+
+def test_missing_signal(capsys):
+    alerts, _ = engine([Rule("Fan", "fan1 < 500")], [temperature()])
+    assert alerts.checks == []
+    assert "has no signal fan1" in capsys.readouterr().out
+
+
+def test_fired_is_bounded():
+    notifications = []
+    signal = temperature()
+    alerts = AlertEngine([Rule("Hot", "temp1 > 90")], notifier=lambda title, message: notifications.append(title), maxfired=10)
+    alerts.start_recording([Card("card0")], [[signal]])
+    for step in range(100):
+        signal.add_value(95000 if step % 2 else 80000, 100)
+        alerts.add_samples(step, None)
+    assert len(notifications) == 50
+    assert len(alerts.fired) == 10
+    assert alerts.fired[-1][0] == 99
+
+
+def test_log(tmp_path):
+    log = tmp_path / "alerts.log"
+    alerts, notifications = engine([Rule("Hot", "temp1 > 90", notify=False, log=str(log))], [temperature()])
+    stream(alerts, [95000])
+    assert notifications == []
+    assert log.read_text().strip().endswith("Hot on card 0: temp1 > 90 (Temperature 95°C)")
+
+
+def test_read_rules(tmp_path):
+    rules = tmp_path / "alerts.ini"
+    rules.write_text("[Hot]\nwhen = temp1 > 90\nfor = 10\n\n"
+                     "[Power limited]\nwhen = power1 >= 98% and GPU State < 5\nnotify = no\ncards = 0,1\n")
+    hot, limited = read_rules(str(rules))
+    assert (hot.name, hot.duration, hot.notify, hot.cards) == ("Hot", 10, True, None)
+    assert [condition.key for condition in limited.conditions] == ["power1", "GPU State"]
+    assert (limited.notify, limited.cards) == (False, [0, 1])
+    rules.write_text("[Broken]\nfor = 10\n")
+    with pytest.raises(ValueError, match="has no when"):
+        read_rules(str(rules))
@@ -0,0 +1,114 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from WattmanGTK.derived import create_derived, default_definitions, read_definitions
+from WattmanGTK.plotsignal import Plotsignal
+
+
+def card(clock, power, usage):
+    # Plotsignals of a card with one sample each
+    signals = [Plotsignal("GPU Clock", "[MHz]", sensorpath="/pp_dpm_sclk"),
+               Plotsignal("Power", "[µW]", sensorpath="/hwmon/hwmon0/power1_average"),
+               Plotsignal("GPU Usage", "[%]", sensorpath="/gpu_busy_percent")]
+    for signal, value in zip(signals, [clock, power, usage]):
+        signal.add_value(value, 10, 0)
+    return signals
+
+
+def test_default_signals():
+    GPUsignals = [card(1500, 150000000, 50), card(1000, 50000000, 100)]
+    derived = create_derived(default_definitions, GPUsignals)
+    values = [{signal.name: signal.evaluate_last("") for signal in signals} for signals in derived]
+    assert values == [{"MHz per W": 10, "Busy clock": 750, "Total power": 200},
+                      {"MHz per W": 20, "Busy clock": 1000, "Total power": 200}]
+    assert all(len(Plotsignals) == 6 for Plotsignals in GPUsignals)
+
+
+def test_cross_card_signal_is_shared():
+    GPUsignals = [card(1500, 150000000, 50) for _ in range(4)]
+    derived = create_derived(default_definitions, GPUsignals)
+    totals = [next(signal for signal in signals if signal.name == "Total power") for signals in derived]
+    assert all(total is totals[0] for total in totals)
+    assert len(totals[0].input_signals()) == 4
+    # signals of one card are created per card
+    clocks = [next(signal for signal in signals if signal.name == "MHz per W") for signals in derived]
+    assert len(set(map(id, clocks))) == 4
+
+
+def test_signal_of_a_given_card_is_shared():
+    GPUsignals = [card(1500, 150000000, 50), card(1000, 50000000, 100)]
+    definitions = [{"name": "Card 1 clock", "expression": "{1:GPU Clock}", "unit": "[MHz]"},
+                   {"name": "Clock difference", "expression": "{GPU Clock} - {1:GPU Clock}", "unit": "[MHz]"}]
+    derived = create_derived(definitions, GPUsignals)
+    assert derived[0][0] is derived[1][0]
+    assert derived[0][1] is not derived[1][1]
+    assert [signals[1].evaluate_last("") for signals in derived] == [500, 0]
+
+
+def test_missing_input(capsys):
+    GPUsignals = [card(1500, 150000000, 50), [Plotsignal("GPU Clock", "[MHz]", sensorpath="/pp_dpm_sclk")]]
+    derived = create_derived(default_definitions, GPUsignals)
+    assert [signal.name for signal in derived[0]] == ["MHz per W", "Busy clock"]
+    assert derived[1] == []
+    assert "Cannot add Total power to card 0: not every card has a signal power1" in capsys.readouterr().out
+
+
+def test_rebuild_and_nan():
+    GPUsignals = [card(1500, 150000000, 50)]
+    for value, timestamp in [(0, 1), (100000000, 2)]:
+        GPUsignals[0][1].add_value(value, 10, timestamp)
+        GPUsignals[0][0].add_value(1500, 10, timestamp)
+    derived = create_derived(default_definitions[:1], GPUsignals)
+    signal = derived[0][0]
+    signal.rebuild(10)
+    assert np.isnan(signal.get_values()[1])
+    assert list(signal.get_values()[[0, 2]]) == [10, 15]
+
+
+def test_expressions():
+    GPUsignals = [card(1500, 150000000, 50)]
+    definitions = [{"name": "Boost", "expression": "-({GPU Clock} - 1000) ** 2 // 1000 + sqrt(abs({power1}))", "unit": "[-]"},
+                   {"name": "Busy", "expression": "({GPU Usage} >= 50) * 1.5", "unit": "[-]"}]
+    derived = create_derived(definitions, GPUsignals)
+    assert [signal.evaluate_last("") for signal in derived[0]] == [-250 + np.sqrt(150), 1.5]
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("().__class__.__mro__[1].__subclasses__()", "can be called"),
+    ("().__class__.__mro__", "Attribute is not allowed"),
+    ("{GPU Clock}.__class__", "Attribute is not allowed"),
+    ("__import__('os').system('true')", "only total, average, maximum, minimum, abs, sqrt can be called"),
+    ("{GPU Clock}[0]", "Subscript is not allowed"),
+    ("(lambda: 1)()", "can be called"),
+    ("total(values={power1})", "can be called"),
+    ("open", "Name is not allowed"),
+    ("'text'", "Constant is not allowed"),
+    ("{GPU Clock} if {power1} else 0", "IfExp is not allowed"),
+    ("{GPU Clock} /", "cannot parse"),
+])
+def test_refused_expressions(tmp_path, capsys, expression, message):
+    definitions = tmp_path / "derived.ini"
+    definitions.write_text(f"[Escape]\nexpression = {expression}\n")
+    with pytest.raises(ValueError, match="Derived signal Escape in .*derived.ini: cannot (use|parse)") as error:
+        read_definitions(str(definitions))
+    assert message in str(error.value)
+    # also when not read from a file
+    GPUsignals = [card(1500, 150000000, 50)]
+    assert create_derived([{"name": "Escape", "expression": expression, "unit": "[-]"}], GPUsignals) == [[]]
+    assert message in capsys.readouterr().out
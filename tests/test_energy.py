@@ -0,0 +1,114 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from WattmanGTK.energy import CardEnergy, EnergyMeter
+from WattmanGTK.plotsignal import Plotsignal
+
+
+def card_signals():
+    # power, GPU state, GPU clock, MEM state, MEM clock as created by Plot
+    return [Plotsignal("power1", "[µW]", sensorpath="/power1_average"),
+            Plotsignal("GPU State", "[-]", sensorpath="/pp_dpm_sclk"),
+            Plotsignal("GPU Clock", "[MHz]", sensorpath="/pp_dpm_sclk"),
+            Plotsignal("MEM State", "[-]", sensorpath="/pp_dpm_mclk"),
+            Plotsignal("MEM Clock", "[MHz]", sensorpath="/pp_dpm_mclk")]
+
+
+def add(card, timestamp, power, gpu_state, gpu_clock, mem_state=0, mem_clock=300, maxgap=10):
+    # power in W, stored in µW like power1_average
+    for signal, value in zip(card.signals, [power * 1000000, gpu_state, gpu_clock, mem_state, mem_clock]):
+        signal.add_value(value, 25)
+    card.add(timestamp, maxgap)
+
+
+@pytest.fixture
+def card():
+    # 100 W for 10 s in GPU state 1 at 600 MHz, no samples for 20 s, then 100 W for 10 s
+    # in GPU state 2 at 1200 MHz
+    card = CardEnergy("card0", card_signals())
+    for timestamp in range(0, 11):
+        add(card, timestamp, 100, 1, 600)
+    for timestamp in range(30, 41):
+        add(card, timestamp, 100, 2, 1200)
+    return card
+
+
+def test_energy_per_state(card):
+    summary = card.summary()
+    assert summary["gpu_states"][1]["time"] == 10
+    assert summary["gpu_states"][1]["energy"] == 1000
+    assert summary["gpu_states"][2]["energy"] == 1000
+    assert summary["gpu_states"][1]["share"] == summary["gpu_states"][2]["share"] == 50
+    assert summary["gpu_states"][2]["power"] == 100
+    assert summary["mem_states"][0]["energy"] == 2000
+    assert summary["mem_states"][0]["clock"] == 300
+
+
+def test_gap_is_skipped(card):
+    # the 20 s without samples is longer than maxgap, so only 20 of the 40 s are counted
+    summary = card.summary()
+    assert summary["time"] == 20
+    assert summary["energy"] == 2000
+    assert summary["power"] == 100
+    add(card, 49, 100, 2, 1200)
+    assert card.summary()["time"] == 29
+
+
+def test_mhz_per_w(card):
+    summary = card.summary()
+    assert summary["clock"] == 900
+    # 18000 MHz s per 2000 J
+    assert summary["mhz_per_w"] == 9
+    assert summary["gpu_states"][1]["mhz_per_w"] == 6
+    assert summary["gpu_states"][2]["mhz_per_w"] == 12
+    assert summary["mem_states"][0]["mhz_per_w"] == 3
+
+
+def test_unknown_power_is_not_counted():
+    card = CardEnergy("card0", card_signals())
+    add(card, 0, 100, 1, 600)
+    # suspended card, NaN is plotted and the interval after it has no power
+    add(card, 1, np.nan, 1, 600)
+    add(card, 2, 100, 1, 600)
+    add(card, 3, 100, 1, 600)
+    assert card.summary()["time"] == 2
+    assert card.summary()["energy"] == 200
+    card.reset()
+    assert card.summary()["time"] == 0
+    assert card.summary()["gpu_states"] == {}
+
+
+def test_meter_finds_signals(capsys):
+    class Card:
+        def __init__(self, fancyname):
+            self.fancyname = fancyname
+
+    meter = EnergyMeter(maxgap=10)
+    signals = card_signals()
+    meter.start_recording([Card("card0"), Card("card1")], [signals, signals[1:]])
+    assert "card1 has no power sensor" in capsys.readouterr().out
+    for timestamp in range(0, 5):
+        for signal, value in zip(signals, [50000000, 0, 300, 0, 300]):
+            signal.add_value(value, 25)
+        meter.add_samples(timestamp, None)
+    summary = meter.summary()
+    assert summary[0]["energy"] == 200
+    assert summary[1]["time"] == 0
+    meter.reset()
+    assert meter.summary()[0]["energy"] == 0
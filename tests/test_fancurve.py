@@ -0,0 +1,226 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from WattmanGTK.fancurve import FanCurve, FanController
+
+hwmon = "/sys/class/drm/card0/device/hwmon/hwmon0"
+
+
+class ThermalCard:
+    # hwmon files of a card with a first order thermal model: the power heats the chip,
+    # the fan cools it proportional to the difference with the ambient temperature
+    def __init__(self, files, temperature=40.0, ambient=25.0, capacity=20.0):
+        self.files = dict(files)
+        self.temperature = temperature
+        self.ambient = ambient
+        self.capacity = capacity    # [J/°C]
+        self.power = 0.0            # [W]
+        self.writes = []
+
+    def read(self, path):
+        if path == hwmon + "/temp1_input":
+            return int(self.temperature * 1000)
+        name = path[len(hwmon) + 1:]
+        if name not in self.files:
+            raise FileNotFoundError(2, "No such file or directory")
+        return self.files[name]
+
+    def write(self, path, value):
+        name = path[len(hwmon) + 1:]
+        if name not in self.files:
+            raise PermissionError(13, "Permission denied")
+        self.files[name] = value
+        self.writes.append((name, value))
+
+    def fan(self):
+        # fan speed as a fraction of the maximum
+        if "fan1_target" in self.files:
+            return self.files["fan1_target"] / self.files["fan1_max"]
+        return self.files["pwm1"] / 255
+
+    def step(self, dt):
+        cooling = 1.0 + 4.0 * self.fan()    # [W/°C]
+        self.temperature += dt * (self.power - cooling * (self.temperature - self.ambient)) / self.capacity
+
+
+def pwm_card(**kwargs):
+    return ThermalCard({"pwm1": 80, "pwm1_enable": 2, "pwm1_min": 0, "pwm1_max": 255}, **kwargs)
+
+
+def run(controller, card, power, seconds, now, dt=0.1):
+    # outputs: time, temperature and output after every tick of the controller
+    card.power = power
+    trace = []
+    end = now + seconds
+    while now < end:
+        if now >= controller.next_tick:
+            controller.tick(now)
+            trace.append((now, card.temperature, card.files[controller.output]))
+        card.step(dt)
+        now = round(now + dt, 6)
+    return trace, now
+
+
+def test_curve_interpolation():
+    curve = FanCurve.from_string("80:100,40:20,60:40")
+    assert [curve.evaluate(temperature) for temperature in [20, 40, 50, 60, 70, 80, 95]] == [20, 20, 30, 40, 70, 100, 100]
+    for text in ["", "40", "40:20:10", "hot:20"]:
+        with pytest.raises(ValueError):
+            FanCurve.from_string(text)
+
+
+def test_curve_hysteresis():
+    curve = FanCurve.from_string("40:20,80:100", hysteresis=3, max_step=1000)
+    assert curve.update(70, 0) == 80
+    # drops less than the hysteresis keep the speed
+    assert curve.update(68, 1) == 80
+    assert curve.update(67.5, 2) == 80
+    # a larger drop follows 3 °C behind the temperature
+    assert curve.update(65, 3) == 76
+    assert curve.update(66, 4) == 76
+    # rising is followed at once
+    assert curve.update(72, 5) == 84
+
+
+def test_curve_rate_limit():
+    curve = FanCurve.from_string("40:20,80:100", hysteresis=0, max_step=10)
+    assert curve.update(40, 0) == 20
+    assert curve.update(80, 1) == 30
+    assert curve.update(80, 3) == 50
+    assert curve.update(40, 3.5) == 45
+
+
+def test_takes_and_hands_back_control():
+    card = pwm_card()
+    controller = FanController(hwmon, FanCurve.from_string("40:20,80:100"), reader=card.read, writer=card.write)
+    assert controller.start(0)
+    assert card.files["pwm1_enable"] == 1
+    controller.tick(0)
+    assert card.files["pwm1"] == 51
+    controller.stop()
+    controller.stop()
+    assert card.files["pwm1_enable"] == 2
+    assert card.writes == [("pwm1_enable", 1), ("pwm1", 51), ("pwm1_enable", 2)]
+    # ticks after stopping (e.g. still running in the refresh thread) do not write
+    controller.tick(1)
+    assert len(card.writes) == 3
+
+
+def test_fan1_target_uses_fan1_enable():
+    card = ThermalCard({"fan1_target": 1000, "fan1_enable": 0, "fan1_min": 0, "fan1_max": 3000, "pwm1_enable": 2})
+    controller = FanController(hwmon, FanCurve.from_string("40:20,80:100"), output="fan1_target", reader=card.read, writer=card.write)
+    assert controller.start(0)
+    controller.tick(0)
+    controller.stop()
+    assert card.writes == [("fan1_enable", 1), ("fan1_target", 600), ("fan1_enable", 0)]
+    assert card.files["pwm1_enable"] == 2
+
+
+@pytest.mark.parametrize("files", [
+    {"fan1_target": 1000, "fan1_enable": 0, "fan1_min": 0},
+    {"fan1_target": 1000, "fan1_enable": 0, "fan1_min": 0, "fan1_max": 0},
+])
+def test_refuses_without_range(files, capsys):
+    card = ThermalCard(files)
+    controller = FanController(hwmon, FanCurve.from_string("40:20,80:100"), output="fan1_target", reader=card.read, writer=card.write)
+    assert not controller.start(0)
+    assert card.writes == []
+    assert "not taking fan control" in capsys.readouterr().out
+
+
+def test_unknown_output():
+    card = pwm_card()
+    with pytest.raises(ValueError, match="Unknown fan output"):
+        FanController(hwmon, FanCurve.from_string("40:20"), output="pwm2", reader=card.read, writer=card.write)
+
+
+def test_failed_write_hands_back_control(capsys):
+    card = pwm_card()
+    controller = FanController(hwmon, FanCurve.from_string("40:20,80:100"), reader=card.read, writer=card.write)
+    controller.start(0)
+    del card.files["pwm1"]
+    controller.tick(0)
+    assert not controller.enabled
+    assert card.files["pwm1_enable"] == 2
+    assert "disabling fan curve" in capsys.readouterr().out
+
+
+def test_failed_temperature_read_hands_back_control(capsys):
+    card = pwm_card()
+    controller = FanController(hwmon, FanCurve.from_string("40:20,80:100"), reader=card.read, writer=card.write)
+    controller.start(0)
+    controller.tick(0)
+    def removed(path):
+        raise OSError(19, "No such device")
+    controller.read = removed
+    controller.tick(1)
+    assert not controller.enabled
+    assert card.files["pwm1_enable"] == 2
+    assert "Cannot read " + hwmon + "/temp1_input: No such device, disabling fan curve" in capsys.readouterr().out
+    # the refresh thread keeps running and does not touch the fan again
+    controller.tick(2)
+    assert card.writes[-1] == ("pwm1_enable", 2)
+
+
+def test_thermal_model():
+    # load steps on the simulated card: the fan follows the curve within the rate limit,
+    # does not drop within the hysteresis and the temperature settles
+    card = pwm_card(temperature=40.0)
+    curve = FanCurve.from_string("40:20,60:40,80:100", hysteresis=3, max_step=10)
+    controller = FanController(hwmon, curve, tickrate=2, reader=card.read, writer=card.write)
+    controller.start(0)
+    heavy, now = run(controller, card, 250, 600, 0)
+    idle, now = run(controller, card, 20, 600, now)
+    trace = heavy + idle
+    assert len(trace) == 2400
+
+    # rate limit: at most 10 %/s, 0.5 s per tick
+    for (_, _, previous), (_, _, value) in zip(trace, trace[1:]):
+        assert abs(value - previous) <= 0.05 * 255 * 1.01 + 1
+
+    # under load the fan ramps up and the temperature settles, the fan speed is on the curve
+    # between the temperature and the hysteresis above it (after the overshoot)
+    def settled(trace):
+        _, temperature, value = trace[-1]
+        assert abs(temperature - trace[-20][1]) < 0.01
+        assert curve.evaluate(temperature) / 100 * 255 - 1 <= value <= curve.evaluate(temperature + 3) / 100 * 255 + 1
+    settled(heavy)
+    assert heavy[-1][2] > heavy[0][2]
+    assert all(temperature < 85 for _, temperature, _ in heavy)
+    settled(idle)
+    assert idle[-1][2] < heavy[-1][2]
+
+    # the output is only written when it changes
+    values = [value for name, value in card.writes if name == "pwm1"]
+    assert controller.writes == len(values)
+    assert all(value != previous for previous, value in zip(values, values[1:]))
+    controller.stop()
+    assert card.files["pwm1_enable"] == 2
+
+
+def test_hysteresis_against_noise():
+    # temperature noise smaller than the hysteresis does not move the fan
+    card = pwm_card(temperature=65.0)
+    curve = FanCurve.from_string("40:20,80:100", hysteresis=3, max_step=100)
+    controller = FanController(hwmon, curve, reader=card.read, writer=card.write)
+    controller.start(0)
+    for step in range(100):
+        card.temperature = 65.0 + (2.5 if step % 2 else 0)
+        controller.tick(step)
+    values = [value for name, value in card.writes if name == "pwm1"]
+    assert values == [178, 191]
@@ -0,0 +1,233 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import pytest
+from WattmanGTK import gpumetrics
+from WattmanGTK.GPU import GPU
+from WattmanGTK.gpumetrics import GpuMetrics, decode, layouts
+
+# struct sizes and offsets of the fields used here, from the structs in kgd_pp_interface.h (x86_64),
+# written out by hand so a wrong layout in gpumetrics.py shifts the decoded values
+blobs = {
+    (1, 0): (80, {"system_clock_counter": (8, "Q"), "temperature_edge": (16, "H"), "temperature_hotspot": (18, "H"),
+                  "temperature_mem": (20, "H"), "average_gfx_activity": (28, "H"), "average_umc_activity": (30, "H"),
+                  "average_socket_power": (34, "H"), "current_gfxclk": (54, "H"), "current_uclk": (58, "H"),
+                  "throttle_status": (68, "I"), "current_fan_speed": (72, "H")}),
+    (1, 1): (96, {"temperature_edge": (4, "H"), "temperature_hotspot": (6, "H"), "temperature_mem": (8, "H"),
+                  "average_gfx_activity": (16, "H"), "average_umc_activity": (18, "H"), "average_socket_power": (22, "H"),
+                  "system_clock_counter": (32, "Q"), "current_gfxclk": (54, "H"), "current_uclk": (58, "H"),
+                  "throttle_status": (68, "I"), "current_fan_speed": (72, "H")}),
+    (2, 0): (120, {"system_clock_counter": (8, "Q"), "temperature_gfx": (16, "H"), "temperature_soc": (18, "H"),
+                   "temperature_core": (20, "8H"), "average_gfx_activity": (40, "H"), "average_socket_power": (44, "H"),
+                   "current_gfxclk": (80, "H"), "current_uclk": (84, "H"), "throttle_status": (112, "I"),
+                   "fan_pwm": (116, "H")}),
+    (2, 1): (120, {"temperature_gfx": (4, "H"), "temperature_soc": (6, "H"), "temperature_core": (8, "8H"),
+                   "average_gfx_activity": (28, "H"), "system_clock_counter": (32, "Q"), "average_socket_power": (40, "H"),
+                   "current_gfxclk": (76, "H"), "current_uclk": (80, "H"), "throttle_status": (108, "I"),
+                   "fan_pwm": (112, "H")}),
+}
+blobs[(1, 2)] = (104, {**blobs[(1, 1)][1], "firmware_timestamp": (96, "Q")})
+blobs[(1, 3)] = (120, {**blobs[(1, 2)][1], "voltage_gfx": (106, "H"), "indep_throttle_status": (112, "Q")})
+
+# dGPU values in the units of gpu_metrics format 1, 0xffff is not supported by the firmware
+values_v1 = {"system_clock_counter": 123456789012, "temperature_edge": 55, "temperature_hotspot": 71,
+             "temperature_mem": 0xffff, "average_socket_power": 143, "current_fan_speed": 1650,
+             "average_gfx_activity": 97, "average_umc_activity": 33, "current_gfxclk": 2105, "current_uclk": 1000,
+             "throttle_status": 0x10}
+values_v2 = {"system_clock_counter": 123456789012, "temperature_gfx": 4725, "temperature_soc": 4650,
+             "average_socket_power": 15300, "average_gfx_activity": 8750, "current_gfxclk": 1800, "current_uclk": 800,
+             "throttle_status": 0x20}
+
+
+def blob(revision, values, size=None, header=None):
+    # gpu_metrics of revision with values, size and header (format and content revision) can be given to break it
+    structure_size, offsets = blobs[revision]
+    data = bytearray(structure_size)
+    struct.pack_into("<HBB", data, 0, structure_size if size is None else size, *(header or revision))
+    for field, value in values.items():
+        offset, form = offsets[field]
+        struct.pack_into("<" + form, data, offset, *(value if isinstance(value, range) else [value]))
+    return bytes(data)
+
+
+class Files:
+    # gpu_metrics of one card, the clock decides when it is read again
+    def __init__(self, blobs):
+        self.blobs = list(blobs)
+        self.reads = 0
+        self.now = 0.0
+
+    def readbytes(self, path):
+        self.reads += 1
+        return self.blobs[min(self.reads, len(self.blobs)) - 1]
+
+    def clock(self):
+        return self.now
+
+
+class Backend:
+    # Only the card directory with gpu_metrics, enough to construct a GPU, None when it cannot be read
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def isfile(self, path):
+        return path.endswith("/gpu_metrics")
+
+    def readbytes(self, path):
+        if self.metrics is None:
+            raise PermissionError(13, "Permission denied")
+        return self.metrics
+
+
+@pytest.mark.parametrize("revision", sorted(blobs))
+def test_layout_sizes(revision):
+    assert layouts[revision].itemsize == blobs[revision][0]
+    assert sorted(layouts) == sorted(blobs)
+
+
+@pytest.mark.parametrize("revision", [(1, 0), (1, 1), (1, 2), (1, 3)])
+def test_decode_v1(revision):
+    metrics = decode(blob(revision, values_v1))
+    for field, value in values_v1.items():
+        assert metrics[field] == value
+    assert (int(metrics["format_revision"]), int(metrics["content_revision"])) == revision
+
+
+def test_decode_v1_3_voltage():
+    metrics = decode(blob((1, 3), {"voltage_gfx": 1150, "indep_throttle_status": 1 << 40}))
+    assert metrics["voltage_gfx"] == 1150
+    assert metrics["indep_throttle_status"] == 1 << 40
+
+
+@pytest.mark.parametrize("revision", [(2, 0), (2, 1)])
+def test_decode_v2(revision):
+    # v2_0 and v2_1 have the same size, but the timestamp moved
+    metrics = decode(blob(revision, {**values_v2, "temperature_core": range(8), "fan_pwm": 120}))
+    for field, value in values_v2.items():
+        assert metrics[field] == value
+    assert list(metrics["temperature_core"]) == list(range(8))
+    assert metrics["fan_pwm"] == 120
+
+
+def test_decode_longer_blob():
+    # newer kernels may append fields to a known revision
+    metrics = decode(blob((1, 1), values_v1) + bytes(16))
+    assert metrics["current_gfxclk"] == 2105
+
+
+def test_read_v1_scaling():
+    files = Files([blob((1, 0), values_v1)])
+    metrics = GpuMetrics("gpu_metrics", files.readbytes, clock=files.clock)
+    assert metrics.read("/temp1_input") == 55000           # °C -> m°C
+    assert metrics.read("/temp2_input") == 71000
+    assert metrics.read("/power1_average") == 143000000    # W -> µW
+    assert metrics.read("/fan1_input") == 1650
+    assert metrics.read("/gpu_busy_percent") == 97
+    assert metrics.read("/mem_busy_percent") == 33
+    assert metrics.read("/pp_dpm_sclk") == 2105
+    assert metrics.read("/pp_dpm_mclk") == 1000
+    # not supported by the firmware, read from the file instead
+    assert metrics.read("/temp3_input") is None
+    # voltage_gfx only exists from v1_3 on
+    assert "/in0_input" not in metrics.fields
+    assert metrics.read("/in0_input") is None
+    assert metrics.read("/pp_od_clk_voltage") is None
+
+
+def test_read_v1_3_voltage():
+    files = Files([blob((1, 3), {**values_v1, "voltage_gfx": 1150})])
+    metrics = GpuMetrics("gpu_metrics", files.readbytes, clock=files.clock)
+    assert metrics.read("/in0_input") == 1150
+
+
+@pytest.mark.parametrize("revision", [(2, 0), (2, 1)])
+def test_read_v2_scaling(revision):
+    files = Files([blob(revision, values_v2)])
+    metrics = GpuMetrics("gpu_metrics", files.readbytes, clock=files.clock)
+    assert metrics.read("/temp1_input") == 47250           # centi °C -> m°C
+    assert metrics.read("/power1_average") == 15300000     # mW -> µW
+    assert metrics.read("/gpu_busy_percent") == 87         # centi % -> %
+    assert metrics.read("/pp_dpm_sclk") == 1800
+    assert metrics.read("/fan1_input") is None
+
+
+@pytest.mark.parametrize("table", [1, 2])
+def test_sysfs_fields_exist(table):
+    # every field which is looked up exists in at least one layout of its format
+    names = set()
+    for revision, layout in layouts.items():
+        if revision[0] == table:
+            names.update(layout.names)
+    for field, scale in gpumetrics.sysfs_fields[table].values():
+        assert field in names
+        assert scale > 0
+
+
+def test_read_once_per_max_age():
+    files = Files([blob((1, 0), values_v1), blob((1, 0), {**values_v1, "temperature_edge": 60})])
+    metrics = GpuMetrics("gpu_metrics", files.readbytes, max_age=0.005, clock=files.clock)
+    assert files.reads == 1
+    metrics.read("/temp1_input")
+    metrics.read("/power1_average")
+    assert files.reads == 1
+    files.now = 0.01
+    assert metrics.read("/temp1_input") == 60000
+    assert metrics.read("/power1_average") == 143000000
+    assert files.reads == 2
+
+
+def test_read_error_after_start():
+    # e.g. a kernel update of the running card is not expected, but a failing read must not raise
+    files = Files([blob((1, 0), values_v1), b"\x04\x00"])
+    metrics = GpuMetrics("gpu_metrics", files.readbytes, clock=files.clock)
+    files.now = 1
+    assert metrics.read("/temp1_input") is None
+
+
+@pytest.mark.parametrize("data, message", [
+    (None, "could not be read"),
+    (b"\x50\x00", "too short"),
+    (blob((1, 0), values_v1)[:40], "expected 80"),
+    (blob((1, 3), values_v1, size=104), "expected 120"),
+    (blob((1, 0), values_v1, header=(1, 9)), "unknown gpu_metrics revision v1_9"),
+    (blob((1, 0), values_v1, header=(3, 0)), "unknown gpu_metrics revision v3_0"),
+])
+def test_decode_invalid(data, message):
+    with pytest.raises(ValueError, match=message):
+        decode(data)
+
+
+@pytest.mark.parametrize("data", [
+    None,
+    b"\x50\x00",
+    blob((1, 0), values_v1)[:40],
+    blob((1, 0), values_v1, header=(1, 9)),
+])
+def test_fallback_to_files(data, capsys):
+    # unknown revisions and short blobs are not used, every file is read instead
+    card = GPU("/sys/class/drm/card0/device", 6, 1, "Test", Backend(data))
+    assert card.metrics is None
+    assert card.metrics_value("/sys/class/drm/card0/device/gpu_busy_percent") is None
+    assert "reading the sensor files instead" in capsys.readouterr().out
+
+
+def test_known_revision_is_used(capsys):
+    card = GPU("/sys/class/drm/card0/device", 6, 1, "Test", Backend(blob((1, 1), values_v1)))
+    assert card.metrics.revision == (1, 1)
+    assert card.metrics_value("/sys/class/drm/card0/device/gpu_busy_percent") == 97
+    assert "Using gpu_metrics v1_1" in capsys.readouterr().out
@@ -0,0 +1,61 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from WattmanGTK.histogram import Histogram
+
+
+def test_upper_edge_rounding():
+    # 1.724 is below low + 1024 * width, but (1.724 - low) / width rounds to 1024
+    histogram = Histogram()
+    histogram.add(1.0)
+    histogram.low, histogram.width = 0.7000000000000001, 0.001
+    histogram.counts[:] = 0
+    histogram.add(1.724)
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(100) == 1.724
+
+
+@pytest.mark.parametrize("values", [
+    np.random.default_rng(0).normal(1500, 200, 100000),
+    np.random.default_rng(1).exponential(50, 100000),
+    np.random.default_rng(2).uniform(-1e6, 1e6, 100000),
+])
+def test_percentiles(values):
+    histogram = Histogram()
+    for value in values.tolist():
+        histogram.add(value)
+    spread = np.percentile(values, 99) - np.percentile(values, 1)
+    for percent in [1, 5, 50, 95, 99]:
+        assert histogram.percentile(percent) == pytest.approx(np.percentile(values, percent), abs=spread * 0.01)
+
+
+def test_discrete_values():
+    # e.g. DPM states, percentiles give exactly the values
+    histogram = Histogram()
+    for value in [0] * 50 + [7] * 50:
+        histogram.add(value)
+    assert histogram.percentile(0) == 0
+    assert histogram.percentile(100) == 7
+
+
+def test_ignores_missing():
+    histogram = Histogram()
+    for value in [None, float("nan"), float("inf")]:
+        histogram.add(value)
+    assert histogram.percentile(50) is None
@@ -0,0 +1,85 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from WattmanGTK.history import History, decode, encode
+
+rng = np.random.default_rng(0)
+n = 10000
+signals = {"states": np.repeat(rng.integers(0, 8, n // 20 + 1), 20)[:n].astype(float),
+           "temperature": np.round(60 + 10 * np.sin(np.arange(n) / 600)),
+           "power": np.round(120 + 60 * np.sin(np.arange(n) / 60) + rng.normal(0, 2, n), 3),
+           "noise": rng.normal(0, 1, n),
+           "suspended": np.where(np.arange(n) % 1000 < 300, np.nan, 1.5)}
+
+
+def fill(values, **kwargs):
+    history = History(chunksize=512, **kwargs)
+    times = np.cumsum(1_000_000_000 + rng.integers(-200_000, 200_000, len(values)))
+    for timestamp, value in zip(times.tolist(), values.tolist()):
+        history.append(timestamp, value)
+    return history, times
+
+
+@pytest.mark.parametrize("name", sorted(signals))
+def test_lossless(name):
+    history, times = fill(signals[name])
+    decoded_times, decoded = history.get()
+    assert np.array_equal(decoded_times, times)
+    assert np.array_equal(decoded, signals[name], equal_nan=True)
+    decoded_times, decoded = history.get(700)
+    assert np.array_equal(decoded_times, times[-700:])
+    assert np.array_equal(decoded, signals[name][-700:], equal_nan=True)
+
+
+@pytest.mark.parametrize("name", sorted(signals))
+def test_stats_without_decoding(name):
+    history, _ = fill(signals[name])
+    values = signals[name]
+    assert np.allclose(history.stats(), (np.nanmin(values), np.nanmean(values), np.nanmax(values)))
+
+
+def test_compression():
+    # states and rounded temperatures take less than a byte per value
+    for name in ["states", "temperature"]:
+        history, _ = fill(signals[name])
+        values = sum(part.nbytes for _, encoded, _, _ in history.chunks for part in encoded[2:] if isinstance(part, np.ndarray))
+        assert values < 512 * len(history.chunks)
+
+
+def test_retention():
+    history, times = fill(signals["power"], maxsamples=2000)
+    assert 2000 <= len(history) < 2000 + 512
+    decoded_times, decoded = history.get()
+    assert np.array_equal(decoded_times, times[-len(history):])
+    assert np.array_equal(decoded, signals["power"][-len(history):])
+    assert np.isclose(history.stats()[1], np.mean(signals["power"][-len(history):]))
+
+
+def test_empty():
+    history = History()
+    assert len(history) == 0
+    assert all(np.isnan(history.stats()))
+    times, values = history.get()
+    assert len(times) == 0 and len(values) == 0
+
+
+@pytest.mark.parametrize("values", [[0.1, 0.2, 0.30000000000000004], [1e300, -1e300, 5.0], [np.inf, 1.0, 2.0]])
+def test_encode_exact(values):
+    values = np.array(values * 10)
+    assert np.array_equal(decode(encode(values)), values)
@@ -0,0 +1,103 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from WattmanGTK.backend import SyntheticBackend, normpath
+from WattmanGTK.GPU import GPU
+
+
+class TimedBackend(SyntheticBackend):
+    # Synthetic card of which the read time of every file is set by the test,
+    # like ProfilingBackend the time is only known after a read
+    def __init__(self):
+        super().__init__(clock=lambda: 0.0)
+        self.read_times = {}
+        self.latencies = {}
+        self.reads = []
+
+    def read(self, path):
+        self.reads.append(normpath(path))
+        self.latencies[normpath(path)] = self.read_times.get(normpath(path), 0.0001)
+        return super().read(path)
+
+    def latency(self, path):
+        return self.latencies.get(normpath(path))
+
+
+@pytest.fixture
+def card():
+    backend = TimedBackend()
+    cardpath = backend.cardpaths()[0]
+    card = GPU(cardpath, 5, 15, "Synthetic GPU 0", backend)
+    card.hwmonpath = backend.hwmonpath(cardpath)
+    card.sensors = card.init_sensors()
+    card.get_states()
+    return card
+
+
+def refresh(card, count):
+    # outputs: number of reads of power1_average during count refreshes
+    path = card.hwmonpath + "/power1_average"
+    card.backend.reads = []
+    for _ in range(count):
+        card.get_currents()
+    return card.backend.reads.count(path)
+
+
+def test_slow_file_moves_to_slow_lane_and_back(card):
+    path = card.hwmonpath + "/power1_average"
+    card.backend.read_times[path] = 0.020
+    card.get_currents()
+    card.set_lanes(0.005, slow_lane=10)
+    assert path in card.slow_paths
+    assert refresh(card, 100) == 10
+    card.backend.read_times[path] = 0.001
+    refresh(card, 10)
+    assert path not in card.slow_paths
+    assert refresh(card, 10) == 10
+
+
+def test_dropped_file_is_timed_again(card):
+    path = card.hwmonpath + "/power1_average"
+    card.backend.read_times[path] = 0.020
+    card.get_currents()
+    card.set_lanes(0.005, slow_lane=10, drop_slow=True)
+    assert card.slow_period() == 100
+    assert refresh(card, 200) == 2
+    assert path in card.slow_paths
+    card.backend.read_times[path] = 0.001
+    refresh(card, 100)
+    assert path not in card.slow_paths
+    assert refresh(card, 10) == 10
+
+
+def test_kept_sensor_stays_in_fast_lane(card):
+    path = card.hwmonpath + "/power1_average"
+    card.backend.read_times[path] = 0.020
+    card.get_currents()
+    card.set_lanes(0.005, slow_lane=10, keep_sensors=["power1_average"])
+    assert path not in card.slow_paths
+    assert refresh(card, 10) == 10
+
+
+def test_no_budget_reads_every_file(card):
+    path = card.hwmonpath + "/power1_average"
+    card.backend.read_times[path] = 0.020
+    card.get_currents()
+    card.set_lanes(0, slow_lane=10)
+    assert card.slow_paths == set()
+    assert refresh(card, 10) == 10
@@ -0,0 +1,208 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import WattmanGTK.persistence as persistence
+from WattmanGTK.persistence import read_od_states, read_od_ranges, validate_profile, restore_card, restore_profiles, apply_profile
+
+profile = {"power_dpm_force_performance_level": "manual",
+           "pstates": [[300, 750], [1200, 900]],
+           "pmemstates": [[300, 750], [1000, 850]],
+           "pp_sclk_od": 5,
+           "hwmon": {"/power1_cap": 150000000, "/pwm1_enable": 2}}
+
+
+class Sysfs:
+    # Card folders in a temporary directory, writes to pp_od_clk_voltage are collected
+    # and only show up in the file after a commit, as with the kernel driver
+    def __init__(self, root):
+        self.root = root
+        self.pending = {}
+        self.writes = []
+        self.readonly = []
+
+    def add_card(self, name, sclk=2000, mclk=1500):
+        cardpath = self.root / name / "device"
+        hwmonpath = cardpath / "hwmon" / "hwmon0"
+        hwmonpath.mkdir(parents=True)
+        self.pending[str(cardpath)] = {"s": [[300, 750], [600, 769]], "m": [[300, 750], [900, 800]]}
+        self.commit(str(cardpath), sclk, mclk)
+        (cardpath / "power_dpm_force_performance_level").write_text("auto\n")
+        (cardpath / "pp_sclk_od").write_text("0\n")
+        (cardpath / "pp_mclk_od").write_text("0\n")
+        (hwmonpath / "power1_cap").write_text("120000000\n")
+        (hwmonpath / "power1_cap_min").write_text("0\n")
+        (hwmonpath / "power1_cap_max").write_text("180000000\n")
+        (hwmonpath / "pwm1_enable").write_text("2\n")
+        return str(cardpath)
+
+    def commit(self, cardpath, sclk=2000, mclk=1500):
+        states = self.pending[cardpath]
+        lines = ["OD_SCLK:"] + [f"{i}:        {clock}MHz        {voltage}mV" for i, (clock, voltage) in enumerate(states["s"])]
+        lines += ["OD_MCLK:"] + [f"{i}:        {clock}MHz        {voltage}mV" for i, (clock, voltage) in enumerate(states["m"])]
+        lines += ["OD_RANGE:", f"SCLK:     300MHz       {sclk}MHz", f"MCLK:     300MHz       {mclk}MHz", "VDDC:     750mV        1200mV"]
+        with open(cardpath + "/pp_od_clk_voltage", "w") as pp_od_clk_voltage:
+            pp_od_clk_voltage.write("\n".join(lines) + "\n")
+
+    def write(self, path, value):
+        if any(path.startswith(cardpath) for cardpath in self.readonly):
+            raise PermissionError(13, "Permission denied")
+        self.writes.append((path, value))
+        if path.endswith("/pp_od_clk_voltage"):
+            cardpath = path[:-len("/pp_od_clk_voltage")]
+            ranges = read_od_ranges(cardpath)
+            if value == "c":
+                self.commit(cardpath, ranges["pstate_clockrange"][1], ranges["pmem_clockrange"][1])
+            else:
+                prefix, i, clock, voltage = value.split()
+                self.pending[cardpath][prefix][int(i)] = [int(clock), int(voltage)]
+            return
+        with open(path, "w") as sysfsfile:
+            sysfsfile.write(f"{value}\n")
+
+
+@pytest.fixture
+def sysfs(tmp_path, monkeypatch):
+    sysfs = Sysfs(tmp_path)
+    monkeypatch.setattr(persistence, "write", sysfs.write)
+    return sysfs
+
+
+def test_restore_writes_profile(sysfs):
+    cardpath = sysfs.add_card("card0")
+    result = restore_card(cardpath, profile)
+    assert result["errors"] == []
+    assert read_od_states(cardpath) == {"pstates": profile["pstates"], "pmemstates": profile["pmemstates"]}
+    assert open(cardpath + "/power_dpm_force_performance_level").read() == "manual\n"
+    assert open(cardpath + "/pp_sclk_od").read() == "5\n"
+    assert open(cardpath + "/hwmon/hwmon0/power1_cap").read() == "150000000\n"
+    # P states that already match and pwm1_enable are not written
+    assert len(result["writes"]) == len(sysfs.writes) == 6
+    assert result["skipped"] == 3
+
+
+def test_second_restore_writes_nothing(sysfs):
+    cardpath = sysfs.add_card("card0")
+    restore_card(cardpath, profile)
+    sysfs.writes = []
+    result = restore_card(cardpath, profile)
+    assert result["errors"] == []
+    assert result["writes"] == []
+    assert sysfs.writes == []
+    assert result["skipped"] == 8
+
+
+def test_dry_run_writes_nothing(sysfs):
+    cardpath = sysfs.add_card("card0")
+    result = restore_card(cardpath, profile, dry_run=True)
+    assert len(result["writes"]) == 6
+    assert sysfs.writes == []
+    assert read_od_states(cardpath)["pstates"] == [[300, 750], [600, 769]]
+
+
+@pytest.mark.parametrize("key, states, error", [
+    ("pstates", [[300, 750], [2100, 900]], "pstates 1: 2100 MHz outside 300-2000 MHz"),
+    ("pmemstates", [[300, 700], [1000, 850]], "pmemstates 0: 700 mV outside 750-1200 mV"),
+    ("pstates", [[300, 750], [600, 769], [1200, 900]], "pstates: profile has 3 states, card has 2"),
+])
+def test_out_of_range_profile_is_rejected(sysfs, key, states, error):
+    cardpath = sysfs.add_card("card0")
+    result = restore_card(cardpath, dict(profile, **{key: states}))
+    assert error in result["errors"]
+    # nothing is written, also not the values that are in range
+    assert result["writes"] == []
+    assert sysfs.writes == []
+    assert open(cardpath + "/power_dpm_force_performance_level").read() == "auto\n"
+
+
+def test_profile_without_ranges_is_rejected(sysfs):
+    cardpath = sysfs.add_card("card0")
+    with open(cardpath + "/pp_od_clk_voltage", "w") as pp_od_clk_voltage:
+        pp_od_clk_voltage.write("OD_SCLK:\n0:        300MHz        750mV\n1:        600MHz        769mV\n")
+    result = restore_card(cardpath, {"pstates": [[300, 750], [600, 769]]})
+    assert result["errors"] == ["pstates: card reports no OD_RANGE to check against"]
+    assert sysfs.writes == []
+
+
+def test_restore_profiles_per_card(sysfs):
+    card0 = sysfs.add_card("card0")
+    card1 = sysfs.add_card("card1", sclk=1100)
+    results = restore_profiles({card0: profile, card1: profile})
+    assert [result["cardpath"] for result in results] == [card0, card1]
+    assert results[0]["errors"] == []
+    assert results[1]["errors"] == ["pstates 1: 1200 MHz outside 300-1100 MHz"]
+    assert all(path.startswith(card0) for path, value in sysfs.writes)
+    sysfs.writes = []
+    results = restore_profiles({card0: profile})
+    assert results[0]["writes"] == []
+    assert sysfs.writes == []
+
+
+ranges = {"pstate_clockrange": [300, 2000], "pmem_clockrange": [300, 1500], "volt_range": [750, 1200],
+          "power_cap_range": [0, 180000000]}
+
+
+@pytest.mark.parametrize("cardprofile, errors", [
+    (profile, []),
+    ({"hwmon": {"/power1_cap": 200000000}}, ["power1_cap: 200 W outside 0-180 W"]),
+    ({"hwmon": {"/pwm1_enable": 1}}, []),
+    ({"pstates": [[300, 750], [2100, 1250]]}, ["pstates 1: 2100 MHz outside 300-2000 MHz", "pstates 1: 1250 mV outside 750-1200 mV"]),
+])
+def test_validate_profile(cardprofile, errors):
+    assert validate_profile(cardprofile, ranges) == errors
+
+
+def test_validate_profile_without_power_cap_range():
+    assert validate_profile(profile, dict(ranges, power_cap_range=[])) == ["power1_cap: card reports no power cap range to check against"]
+
+
+def test_validate_profile_states():
+    states = {"pstates": [[300, 750]], "pmemstates": [[300, 750], [900, 800]]}
+    assert validate_profile(profile, ranges, states) == ["pstates: profile has 2 states, card has 1"]
+
+
+def test_apply_profile_isolates_cards(sysfs):
+    cardpaths = [sysfs.add_card(f"card{i}") for i in range(4)]
+    # card1 allows lower clocks, card2 a lower power cap and card3 cannot be written to
+    with open(cardpaths[1] + "/pp_od_clk_voltage") as pp_od_clk_voltage:
+        content = pp_od_clk_voltage.read().replace("2000MHz", "1100MHz")
+    with open(cardpaths[1] + "/pp_od_clk_voltage", "w") as pp_od_clk_voltage:
+        pp_od_clk_voltage.write(content)
+    with open(cardpaths[2] + "/hwmon/hwmon0/power1_cap_max", "w") as power1_cap_max:
+        power1_cap_max.write("100000000\n")
+    sysfs.readonly = [cardpaths[3]]
+    results = apply_profile(cardpaths, profile)
+    assert [result["cardpath"] for result in results] == cardpaths
+    assert results[0]["errors"] == []
+    assert results[1]["errors"] == ["pstates 1: 1200 MHz outside 300-1100 MHz"]
+    assert results[2]["errors"] == ["power1_cap: 150 W outside 0-100 W"]
+    assert len(results[3]["errors"]) == len(results[3]["writes"]) == 6
+    assert all(error.endswith("Permission denied") for error in results[3]["errors"])
+    # only the valid card is written to, the failing cards are left as they were
+    assert {path for path, value in sysfs.writes} == {cardpaths[0] + "/power_dpm_force_performance_level",
+                                                      cardpaths[0] + "/pp_od_clk_voltage", cardpaths[0] + "/pp_sclk_od",
+                                                      cardpaths[0] + "/hwmon/hwmon0/power1_cap"}
+    for cardpath in cardpaths[1:]:
+        assert read_od_states(cardpath)["pstates"] == [[300, 750], [600, 769]]
+        assert open(cardpath + "/hwmon/hwmon0/power1_cap").read() == "120000000\n"
+
+
+def test_apply_profile_dry_run(sysfs):
+    cardpaths = [sysfs.add_card(f"card{i}") for i in range(2)]
+    results = apply_profile(cardpaths, profile, dry_run=True)
+    assert [len(result["writes"]) for result in results] == [6, 6]
+    assert sysfs.writes == []
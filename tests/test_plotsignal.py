@@ -0,0 +1,75 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from WattmanGTK.plotsignal import Plotsignal
+
+
+def burst_signal(values):
+    # Plotsignal which reads values one by one, sampled in bursts of 10 per period
+    values = iter(values)
+    signal = Plotsignal("GPU Clock", "[MHz]", max=2000, min=300, parser=lambda path: next(values))
+    signal.period = 0.1
+    signal.burst = 0.01
+    signal.next_point = 0.1
+    return signal
+
+
+def point_bytes(signal):
+    arrays = [signal.times, signal.data] + list(signal.get_envelope() or [])
+    return sum(array.nbytes for array in arrays) / len(signal.data)
+
+
+def test_burst_envelope():
+    values = [1000, 1000, 300, 1000, 1000, 1000, 1000, 1000, 1000, 2000] * 3
+    signal = burst_signal(values)
+    added = [signal.retrieve_burst(100, step * 0.01 + 0.0105) for step in range(len(values))]
+    assert added.count(True) == 3
+    assert np.allclose(signal.get_values(), np.mean(values[:10]))
+    low, high = signal.get_envelope()
+    assert list(low) == [300] * 3 and list(high) == [2000] * 3
+    assert signal.get_min() == 300 and signal.get_max() == 2000
+
+
+def test_burst_history_length():
+    # one point per period like without bursts, older points are dropped together with their envelope
+    signal = burst_signal([1000] * 1000)
+    for step in range(1000):
+        signal.retrieve_burst(25, step * 0.01 + 0.0105)
+    assert len(signal.get_values()) == 26
+    assert all(len(part) == 26 for part in signal.get_envelope())
+
+
+def test_point_size():
+    plain = Plotsignal("Temperature", "[m°C]", parser=lambda path: 45000)
+    for _ in range(100):
+        plain.retrieve_data(100)
+    assert point_bytes(plain) == 16
+    burst = burst_signal([1000] * 1000)
+    for step in range(1000):
+        burst.retrieve_burst(100, step * 0.01 + 0.0105)
+    assert point_bytes(burst) == 24
+
+
+def test_suspended_gap():
+    signal = burst_signal([1000] * 20)
+    for step in range(10):
+        signal.retrieve_burst(100, step * 0.01 + 0.0105)
+    signal.add_suspended(100)
+    assert np.isnan(signal.get_last_value())
+    assert np.isnan(signal.get_envelope()[0][-1])
+    assert signal.get_min() == 1000
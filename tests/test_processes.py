@@ -0,0 +1,162 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+from WattmanGTK.processes import ProcessScanner, parse_fdinfo
+
+pdev = "0000:03:00.0"
+
+
+class Proc:
+    # Fake /proc tree in a directory, with a clock for the scanner
+    def __init__(self, path):
+        self.path = path
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def process(self, pid, name, start=1000):
+        directory = self.path / str(pid)
+        (directory / "fd").mkdir(parents=True)
+        (directory / "fdinfo").mkdir()
+        (directory / "comm").write_text(name + "\n")
+        # field 22 is the start time, the name may contain spaces and parentheses
+        (directory / "stat").write_text(f"{pid} ({name}) S 1 " + " ".join(["0"] * 17) + f" {start} 0 0\n")
+
+    def exit(self, pid):
+        shutil.rmtree(self.path / str(pid))
+
+    def open(self, pid, fd, client, gfx=0, compute=0, vram=0, driver="amdgpu", target="/dev/dri/renderD128"):
+        os.symlink(target, self.path / str(pid) / "fd" / str(fd))
+        self.update(pid, fd, client, gfx, compute, vram, driver)
+
+    def update(self, pid, fd, client, gfx=0, compute=0, vram=0, driver="amdgpu"):
+        (self.path / str(pid) / "fdinfo" / str(fd)).write_text(
+            f"pos:\t0\nflags:\t02100002\ndrm-driver:\t{driver}\ndrm-pdev:\t{pdev}\ndrm-client-id:\t{client}\n"
+            f"drm-memory-vram:\t{vram} KiB\ndrm-memory-gtt:\t512 KiB\n"
+            f"drm-engine-gfx:\t{gfx} ns\ndrm-engine-compute:\t{compute} ns\n")
+
+    def close(self, pid, fd):
+        os.remove(self.path / str(pid) / "fd" / str(fd))
+        os.remove(self.path / str(pid) / "fdinfo" / str(fd))
+
+
+def test_parse_fdinfo():
+    info = parse_fdinfo("drm-driver:\tamdgpu\ndrm-pdev:\t0000:03:00.0\ndrm-client-id:\t42\n"
+                        "drm-memory-vram:\t1024 KiB\ndrm-engine-gfx:\t1234567 ns\n")
+    assert info == {"pdev": "0000:03:00.0", "client": "42", "engines": {"gfx": 1234567}, "memory": {"vram": 1024}}
+    assert parse_fdinfo("drm-driver:\ti915\ndrm-client-id:\t42\n") is None
+    assert parse_fdinfo("pos:\t0\nflags:\t02\n") is None
+
+
+def test_engine_usage(tmp_path):
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    proc.open(100, 5, 42, gfx=1000000000, compute=0, vram=2048)
+    proc.process(200, "shell")
+    os.symlink("/dev/pts/0", tmp_path / "200" / "fd" / "0")
+    scanner = ProcessScanner(str(tmp_path), clock=proc.clock)
+    first = scanner.scan()
+    assert [(row["pid"], row["name"], row["pdev"], row["usage"]) for row in first] == [(100, "game", pdev, {})]
+    proc.now = 2.0
+    proc.update(100, 5, 42, gfx=2500000000, compute=200000000, vram=4096)
+    rows = scanner.scan()
+    assert len(rows) == 1
+    assert rows[0]["usage"] == {"gfx": 75.0, "compute": 10.0}
+    assert rows[0]["memory"] == {"vram": 4096, "gtt": 512}
+    assert scanner.fds == {"100": ["5"], "200": []}
+
+
+def test_clients_are_summed_once(tmp_path):
+    # two clients of one process are summed, a dup of a client is counted once
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    proc.open(100, 5, 42)
+    proc.open(100, 6, 42)
+    proc.open(100, 7, 43)
+    proc.open(100, 8, 44, driver="i915")
+    scanner = ProcessScanner(str(tmp_path), clock=proc.clock)
+    scanner.scan()
+    proc.now = 1.0
+    for fd, client, gfx in [(5, 42, 200000000), (6, 42, 200000000), (7, 43, 300000000)]:
+        proc.update(100, fd, client, gfx=gfx, vram=1024)
+    rows = scanner.scan()
+    assert rows[0]["usage"]["gfx"] == 50.0
+    assert rows[0]["memory"]["vram"] == 2048
+    assert sorted(scanner.fds["100"]) == ["5", "6", "7"]
+
+
+def test_closed_clients_are_dropped(tmp_path):
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    proc.open(100, 5, 42)
+    proc.open(100, 6, 43)
+    scanner = ProcessScanner(str(tmp_path), clock=proc.clock)
+    scanner.scan()
+    assert sorted(scanner.previous) == [("100", "42"), ("100", "43")]
+    proc.close(100, 6)
+    proc.now = 1.0
+    scanner.scan()
+    assert list(scanner.previous) == [("100", "42")]
+    assert scanner.fds["100"] == ["5"]
+
+
+def test_exited_process(tmp_path):
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    proc.open(100, 5, 42)
+    scanner = ProcessScanner(str(tmp_path), clock=proc.clock)
+    scanner.scan()
+    proc.exit(100)
+    proc.now = 1.0
+    assert scanner.scan() == []
+    assert (scanner.fds, scanner.names, scanner.starts, scanner.scanned, scanner.previous) == ({}, {}, {}, {}, {})
+
+
+def test_reused_pid(tmp_path):
+    # another process with the same pid is searched again at once and shows its own name
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    proc.open(100, 5, 42, gfx=5000000000)
+    scanner = ProcessScanner(str(tmp_path), clock=proc.clock)
+    scanner.scan()
+    proc.exit(100)
+    proc.process(100, "blender (render)", start=2000)
+    proc.open(100, 9, 50, gfx=100000000)
+    proc.now = 1.0
+    rows = scanner.scan()
+    assert [(row["name"], row["usage"]) for row in rows] == [("blender (render)", {})]
+    assert scanner.names == {("100", 2000): "blender (render)"}
+    assert scanner.fds["100"] == ["9"]
+    proc.now = 2.0
+    proc.update(100, 9, 50, gfx=600000000)
+    assert scanner.scan()[0]["usage"]["gfx"] == 50.0
+
+
+def test_new_fds_after_rescan(tmp_path):
+    # known processes are only searched again every rescan seconds
+    proc = Proc(tmp_path)
+    proc.process(100, "game")
+    scanner = ProcessScanner(str(tmp_path), rescan=10, clock=proc.clock)
+    assert scanner.scan() == []
+    proc.open(100, 5, 42)
+    proc.now = 5.0
+    assert scanner.scan() == []
+    proc.now = 10.0
+    assert [row["pid"] for row in scanner.scan()] == [100]
@@ -0,0 +1,72 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from WattmanGTK.sampling import JitterStats, jitter_report, parse_periods, read_periods
+from WattmanGTK.plotsignal import Plotsignal
+
+
+def test_parse_periods():
+    assert parse_periods("temp=2, power1_average=0.5,GPU Usage=0.1") == {"temp": 2, "power1_average": 0.5, "GPU Usage": 0.1}
+
+
+@pytest.mark.parametrize("spec, error", [
+    ("temp", "Cannot parse sampling period \"temp\""),
+    ("temp=fast", "Cannot parse sampling period \"temp=fast\""),
+    ("temp=0", "Sampling period of temp must be a number larger than 0"),
+    ("temp=-1", "Sampling period of temp must be a number larger than 0"),
+    ("temp=nan", "Sampling period of temp must be a number larger than 0"),
+    ("temp=inf", "Sampling period of temp must be a number larger than 0"),
+    ("temp=-inf", "Sampling period of temp must be a number larger than 0"),
+])
+def test_invalid_periods(spec, error):
+    with pytest.raises(ValueError, match=error):
+        parse_periods(spec)
+
+
+def test_read_periods(tmp_path):
+    (tmp_path / "periods.ini").write_text("[periods]\nGPU Usage = 0.2\ntemp = nan\n")
+    with pytest.raises(ValueError, match="temp must be a number"):
+        read_periods(str(tmp_path / "periods.ini"))
+
+
+def test_jitter():
+    jitter = JitterStats(0.5, size=4)
+    assert jitter.percentiles() is None
+    for i, deviation in enumerate([0.001, 0.002, 0.003, 1.2]):
+        jitter.add(i * 0.5, i * 0.5 + deviation)
+    assert jitter.percentiles()[0] == pytest.approx(0.0025)
+    # 1.2 s late on a period of 0.5 s skipped two samples
+    assert jitter.skipped == 2
+    assert jitter.summary().endswith("2 of 6 samples skipped")
+    # only the last size deviations are kept
+    jitter.add(2, 2.001)
+    assert jitter.percentiles()[1] < 1.2
+
+
+def test_jitter_report(capsys):
+    signals = []
+    for name, deviation in [("slow", 0.010), ("fast", 0.001), ("unsampled", None)]:
+        signal = Plotsignal(name, "[MHz]", sensorpath="/pp_dpm_sclk")
+        signal.jitter = JitterStats(1)
+        if deviation is not None:
+            signal.jitter.add(0, deviation)
+        signals.append(signal)
+    jitter_report(signals)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines[1:]] == ["slow", "fast"]
+    assert lines[1].split()[3] == "10.00"
@@ -0,0 +1,60 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+# Runs the GUI offscreen, skipped without GTK or a display
+
+import pytest
+
+gi = pytest.importorskip("gi")
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gdk, Gtk
+pytestmark = pytest.mark.skipif(Gdk.Display.get_default() is None, reason="needs a display")
+
+
+@pytest.fixture
+def cards():
+    from WattmanGTK.soak import VirtualClock
+    from WattmanGTK.wattman import synthetic_GPUs
+    clock = VirtualClock()
+    return synthetic_GPUs("3,8,50,sine", 0, 0, clock), clock
+
+
+def test_switch_cards(cards):
+    from WattmanGTK.soak import switch_cards
+    GPUs, clock = cards
+    records = switch_cards(GPUs, clock, 1, "cairo", 25, 150, interval=50)
+    assert [record[0] for record in records] == [50, 100, 150]
+    assert max(record[3] for record in records) < 100
+
+
+def test_switch_shows_current_settings(cards):
+    from WattmanGTK.soak import start_gui
+    from WattmanGTK.wattman import update_gui
+    import threading
+    GPUs, clock = cards
+    handler, plot, combobox, offscreen = start_gui(GPUs, 1, "cairo", 25)
+    # changed after startup, e.g. by wattmanGTK-restore
+    GPUs[1].backend.files[GPUs[1].cardpath + "/pp_sclk_od"] = 7
+    GPUs[1].backend.files[GPUs[1].cardpath + "/power_dpm_force_performance_level"] = "manual"
+    combobox.set_active(1)
+    GPUs[1].get_currents()
+    update_gui(handler, plot, GPUs[1].snapshot(), plot.snapshot(), None, threading.Event())
+    while Gtk.events_pending():
+        Gtk.main_iteration()
+    assert handler.builder.get_object("GPU Target").get_value() == 7
+    assert handler.builder.get_object("GPU Frequency auto switch").get_state()
+    offscreen.destroy()
@@ -0,0 +1,138 @@
+# This file is part of WattmanGTK.
+#
+# Copyright (c) 2018 Bouke Haarsma
+#
+# WattmanGTK is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+#
+# WattmanGTK is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with WattmanGTK.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import zlib
+import numpy as np
+import pytest
+from WattmanGTK.plotsignal import Plotsignal
+from WattmanGTK.telemetry import LOGMAGIC_V1, ReplayClock, TelemetryLog, TelemetryLogFile, decode_block, encode_block, encode_header
+
+rng = np.random.default_rng(0)
+
+
+def sample_block(rows):
+    # time [s] since the start of the log, a clock, a temperature, a DPM state and a float signal with gaps
+    times = 86400 + np.cumsum(np.full(rows, 0.5) + rng.integers(0, 100, rows) / 1e6)
+    block = np.column_stack((times, rng.integers(300, 2000, rows), np.full(rows, 45000), rng.integers(0, 8, rows),
+                             rng.normal(100, 5, rows)))
+    block[::7, 4] = np.nan
+    return block
+
+
+def decoded(encoded, ncolumns, first_value=True):
+    rows, size = struct.unpack("<II", encoded[:8])
+    assert size == len(encoded) - 8
+    return decode_block(rows, encoded[8:], ncolumns, first_value)
+
+
+def encode_v1(block):
+    # Blocks of LOGMAGIC_V1 logs: integer columns delta encoded from 0
+    block = block.copy()
+    block[:, 0] = np.round(block[:, 0] * 1000000)
+    types = bytearray()
+    columns = []
+    for column in block.T:
+        if np.all(np.isfinite(column)):
+            types.append(8)
+            columns.append(np.diff(column.astype(np.int64), prepend=0).astype("<i8").tobytes())
+        else:
+            types.append(0)
+            columns.append(column.astype("<f8").tobytes())
+    data = zlib.compress(bytes(types) + b"".join(columns))
+    return struct.pack("<II", block.shape[0], len(data)) + data
+
+
+@pytest.mark.parametrize("rows", [1, 2, 600])
+def test_block_roundtrip(rows):
+    block = sample_block(rows)
+    result = decoded(encode_block(block), block.shape[1])
+    assert np.allclose(result[:, 0], block[:, 0], rtol=0, atol=1e-6)
+    assert np.array_equal(result[:, 1:], block[:, 1:], equal_nan=True)
+
+
+def test_block_negative_and_large_values():
+    block = np.array([[0.0, -5, 2**40], [1.0, 3, -2**40], [2.0, -2**31, 0]])
+    assert np.array_equal(decoded(encode_block(block), 3), block)
+
+
+def test_first_value_is_stored_separately():
+    # the time is a day in µs, its differences still fit in 4 bytes
+    block = sample_block(600)
+    data = zlib.decompress(encode_block(block)[8:])
+    assert list(data[:4]) == [4, 2, 1, 1]
+    assert data[4] == 0
+
+
+def test_v1_log(tmp_path):
+    block = sample_block(100)
+    log = tmp_path / "WattmanGTK-v1.wlog"
+    header = {"version": 1, "start": 0, "cards": [], "signals": [{"card": 0}] * 4}
+    log.write_bytes(encode_header(header, LOGMAGIC_V1) + encode_v1(block) + encode_v1(block[:10]))
+    blocks = list(TelemetryLogFile(str(log)).blocks())
+    assert [len(decoded) for decoded in blocks] == [100, 10]
+    assert np.allclose(blocks[0][:, 0], block[:, 0], rtol=0, atol=1e-6)
+    assert np.array_equal(blocks[1][:, 1:], block[:10, 1:], equal_nan=True)
+
+
+class Card:
+    # Enough of a GPU for the header of a log, without readable files
+    cardpath = "/sys/class/drm/card0/device"
+    hwmonpath = ""
+    fancyname = "Test"
+
+    class backend:
+        def readlines(path):
+            raise OSError(2, "No such file or directory")
+
+    def signal_path(self, sensorpath):
+        return self.cardpath + sensorpath
+
+
+def test_stop_writes_buffered_samples(tmp_path):
+    # on exit (also after Ctrl-C) the samples of a block which is neither full nor old are written
+    signal = Plotsignal("GPU Usage", "[-]", 100, 0, "/gpu_busy_percent")
+    log = TelemetryLog(str(tmp_path), block_rows=600, block_age=60)
+    log.start_recording([Card()], [[signal]])
+    for step in range(10):
+        signal.add_value(step * 10, 10)
+        log.add_samples(log.start + step, [[signal]])
+    log.stop()
+    segments = list(tmp_path.glob("WattmanGTK-*.wlog"))
+    assert len(segments) == 1
+    blocks = list(TelemetryLogFile(str(segments[0])).blocks())
+    assert len(blocks) == 1
+    assert list(blocks[0][:, 1]) == [step * 10 for step in range(10)]
+
+
+@pytest.mark.parametrize("speed, limited", [(1, 1), (2.5, 2.5), (100, 100), (0, 1), (-3, 1), (1000, 100),
+                                            (float("nan"), 1), (float("inf"), 100)])
+def test_replay_speed_limits(speed, limited):
+    assert ReplayClock(60, speed).speed == limited
+    clock = ReplayClock(60)
+    clock.set_speed(speed)
+    assert clock.speed == limited
+
+
+def test_replay_clock_positions():
+    clock = ReplayClock(60, position=90)
+    assert clock.now() == 60
+    clock.toggle_pause()
+    clock.seek(-5)
+    assert clock.now() == 0
+    clock.seek(30)
+    assert clock.now() == 30